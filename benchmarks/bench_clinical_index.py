@@ -0,0 +1,66 @@
+""" Benchmark attaching case & submitter ids from fileinfo to parsed clinical records,
+    using boolean-mask scans of the fileinfo DataFrame per file (as `get_clinical_data_from_file`
+    used to) vs a lookup in fileinfo indexed once by file_id (`_index_fileinfo`).
+
+    The mask scan grows with files² while the indexed lookup grows linearly.
+    The XML parsing itself is not included, since it costs the same per file either way.
+
+    $ python -m benchmarks.bench_clinical_index --files 1000 2500 5000 10000
+"""
+from __future__ import absolute_import, print_function
+import argparse
+import logging
+import time
+import pandas as pd
+from query_tcga import query_tcga as qt
+
+
+def make_fileinfo(n):
+    file_ids = ['{:08d}-0000-0000-0000-000000000000'.format(i) for i in range(n)]
+    return pd.DataFrame({'file_id': file_ids,
+                         'case_id': ['case-{}'.format(i) for i in range(n)],
+                         'submitter_id': ['TCGA-XX-{:04d}'.format(i) for i in range(n)],
+                         'file_name': ['{}.xml'.format(i) for i in range(n)]})
+
+
+def lookup_mask(fileinfo, file_ids):
+    data = list()
+    for file_id in file_ids:
+        data.append({'case_id': fileinfo.loc[fileinfo['file_id']==file_id, 'case_id'].values[0],
+                     'submitter_id': fileinfo.loc[fileinfo['file_id']==file_id, 'submitter_id'].values[0]})
+    return data
+
+
+def lookup_index(fileinfo, file_ids):
+    index = qt._index_fileinfo(fileinfo)
+    return [dict(index[file_id]) for file_id in file_ids]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, nargs='+', default=[1000, 2500, 5000, 10000])
+    parser.add_argument('--skip-mask-above', type=int, default=10000,
+                        help='skip the (quadratic) mask scan for more files than this')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    print('{:>8} {:>12} {:>14} {:>12} {:>14}'.format('files', 'mask (s)', 'mask us/file',
+                                                     'index (s)', 'index us/file'))
+    for n in args.files:
+        fileinfo = make_fileinfo(n)
+        file_ids = list(fileinfo['file_id'])
+        start = time.time()
+        indexed = lookup_index(fileinfo, file_ids)
+        index_time = time.time() - start
+        if n <= args.skip_mask_above:
+            start = time.time()
+            masked = lookup_mask(fileinfo, file_ids)
+            mask_time = time.time() - start
+            assert masked == indexed
+            mask_cols = '{:>12.3f} {:>14.1f}'.format(mask_time, 1e6 * mask_time / n)
+        else:
+            mask_cols = '{:>12} {:>14}'.format('-', '-')
+        print('{:>8} {} {:>12.4f} {:>14.2f}'.format(n, mask_cols, index_time, 1e6 * index_time / n))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+""" Benchmark parsing synthetic clinical XML files with the BeautifulSoup parser
+    vs the streaming lxml parser (`clinical_xml.parse_clinical_xml`).
+
+    $ python -m benchmarks.bench_clinical_xml --files 200 --sections 200
+"""
+from __future__ import absolute_import, print_function
+import argparse
+import logging
+import shutil
+import tempfile
+import time
+from query_tcga import clinical_xml
+from query_tcga import query_tcga as qt
+from test.synthetic_clinical import write_clinical_xml_files
+
+
+def parse_bs4(path):
+    soup = qt._read_xml_bs(path)
+    return qt._parse_clin_data_soup(soup), soup.findChild('patient_id').text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--sections', type=int, default=200)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    data_dir = tempfile.mkdtemp()
+    try:
+        paths = write_clinical_xml_files(data_dir, n_files=args.files, n_sections=args.sections)
+        timings = dict()
+        results = dict()
+        for (name, parse) in [('bs4', parse_bs4), ('lxml', clinical_xml.parse_clinical_xml)]:
+            start = time.time()
+            results[name] = [parse(path) for path in paths]
+            timings[name] = time.time() - start
+    finally:
+        shutil.rmtree(data_dir)
+    assert results['bs4'] == results['lxml']
+    print('{:>8} {:>10} {:>12} {:>10}'.format('parser', 'seconds', 'files/s', 'speedup'))
+    for name in ['bs4', 'lxml']:
+        print('{:>8} {:>10.2f} {:>12.1f} {:>10.2f}'.format(
+            name, timings[name], args.files / timings[name], timings['bs4'] / timings[name]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+""" Benchmark `api.get_fileinfo_data` fetching chunks serially vs concurrently,
+    against a local stub GDC server with a fixed latency per request.
+
+    Every run fetches all files from the server: the metadata store & http cache are
+    not used, & GDC_DATA_DIR points at a temporary directory.
+
+    $ python -m benchmarks.bench_fileinfo --files 2000 --chunk-size 100 --latency 0.25
+"""
+from __future__ import absolute_import, print_function
+import argparse
+import logging
+import shutil
+import tempfile
+import time
+from query_tcga import api
+from test.gdc_stub import StubGDCServer, settings, hits_route, make_file_hit
+
+
+def run(file_ids, hits, chunk_size, max_workers, latency):
+    data_dir = tempfile.mkdtemp()
+    try:
+        with StubGDCServer(routes={'files': hits_route(hits)}, latency=latency) as server, \
+                settings(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=100, RATE_LIMIT_BURST=100,
+                         GDC_DATA_DIR=data_dir, USE_CACHE=False):
+            start = time.time()
+            df = api.get_fileinfo_data(file_id=file_ids, chunk_size=chunk_size, max_workers=max_workers,
+                                       use_store=False)
+            elapsed = time.time() - start
+    finally:
+        shutil.rmtree(data_dir)
+    assert len(df.index) == len(file_ids)
+    return elapsed, df.attrs.get('chunk_latency', [])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--chunk-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.25)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    file_ids = ['{:08d}-aaaa-bbbb-cccc-000000000000'.format(i) for i in range(args.files)]
+    hits = [make_file_hit(file_id) for file_id in file_ids]
+    print('{:>12} {:>10} {:>10} {:>16}'.format('max_workers', 'seconds', 'speedup', 'mean chunk (s)'))
+    baseline = None
+    for max_workers in [1, 2, 4, 8]:
+        elapsed, chunk_latency = run(file_ids, hits, chunk_size=args.chunk_size,
+                                     max_workers=max_workers, latency=args.latency)
+        baseline = baseline or elapsed
+        print('{:>12} {:>10.2f} {:>10.2f} {:>16.3f}'.format(
+            max_workers, elapsed, baseline / elapsed, sum(chunk_latency) / max(len(chunk_latency), 1)))
+
+
+if __name__ == '__main__':
+    main()
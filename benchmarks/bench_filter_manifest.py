@@ -0,0 +1,87 @@
+""" Benchmark filtering a manifest down to files not yet downloaded (`_filter_manifest_updates`),
+    comparing the former filter, which tested each row's filename against a list of
+    failed files (rows x failed), with the current one, which looks up (id, filename)
+    in a set of downloaded files.
+
+    A fraction (--present) of the files in the manifest are written (empty) to a temporary
+    data_dir; files are checked for existence only (VERIFY_CHECK='exists'), so the timings
+    include listing data_dir but no stat or hashing.
+
+    $ python -m benchmarks.bench_filter_manifest --rows 10000 50000 200000
+"""
+from __future__ import absolute_import, print_function
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+from query_tcga import query_tcga as qt
+from test.gdc_stub import MANIFEST_HEADER
+
+
+def make_manifest(n):
+    rows = ['{id:08d}-0000-0000-0000-000000000000\tfile_{id:06d}.xml\t{md5:032x}\t0\tlive'.format(id=i, md5=i)
+            for i in range(n)]
+    return '\n'.join([MANIFEST_HEADER] + rows)
+
+
+def make_data_dir(manifest_contents, present):
+    data_dir = tempfile.mkdtemp()
+    rows = manifest_contents.splitlines()[1:]
+    step = int(round(1 / present)) if present else None
+    for (i, row) in enumerate(rows):
+        if step and i % step == 0:
+            (file_id, filename) = row.split('\t')[:2]
+            os.mkdir(os.path.join(data_dir, file_id))
+            open(os.path.join(data_dir, file_id, filename), 'w').close()
+    return data_dir
+
+
+def filter_list(manifest_contents, data_dir):
+    """ The former filter: filenames of failed downloads in a list, tested for each row
+    """
+    failed_downloads = qt._list_failed_downloads(manifest_contents=manifest_contents,
+                                                 data_dir=data_dir, check='exists')
+    failed_files = [os.path.basename(f) for f in failed_downloads]
+    manifest_contents = [row
+                    for row in manifest_contents.splitlines()
+                    if row.split('\t')[1] in failed_files
+                    or row.split('\t')[0] == 'id']
+    return '\n'.join(manifest_contents)
+
+
+def filter_set(manifest_contents, data_dir):
+    return qt._filter_manifest_updates(manifest_contents, data_dir=data_dir, check='exists')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 50000, 200000])
+    parser.add_argument('--present', type=float, default=0.5,
+                        help='fraction of files in the manifest already downloaded')
+    parser.add_argument('--skip-list-above', type=int, default=20000,
+                        help='skip the (quadratic) list filter for more rows than this')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    print('{:>8} {:>10} {:>12} {:>12}'.format('rows', 'updates', 'list (s)', 'set (s)'))
+    for n in args.rows:
+        manifest_contents = make_manifest(n)
+        data_dir = make_data_dir(manifest_contents, present=args.present)
+        try:
+            start = time.time()
+            updates = filter_set(manifest_contents, data_dir)
+            set_time = time.time() - start
+            if n <= args.skip_list_above:
+                start = time.time()
+                assert filter_list(manifest_contents, data_dir) == updates
+                list_col = '{:>12.3f}'.format(time.time() - start)
+            else:
+                list_col = '{:>12}'.format('-')
+        finally:
+            shutil.rmtree(data_dir)
+        print('{:>8} {:>10} {} {:>12.3f}'.format(n, len(updates.splitlines()) - 1, list_col, set_time))
+
+
+if __name__ == '__main__':
+    main()
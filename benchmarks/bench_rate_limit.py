@@ -0,0 +1,38 @@
+""" Benchmark requests per second through `cache.requests_get` against a local
+    stub GDC server, for a few rate-limit settings.
+
+    $ python -m benchmarks.bench_rate_limit --requests 50
+"""
+from __future__ import absolute_import, print_function
+import argparse
+import logging
+import time
+from query_tcga import cache, config
+from test.gdc_stub import StubGDCServer
+
+
+def run(n_requests, rate, burst):
+    config.set_value(RATE_LIMIT=rate, RATE_LIMIT_BURST=burst)
+    with StubGDCServer() as server:
+        url = server.endpoint.format(endpoint='files')
+        start = time.time()
+        for i in range(n_requests):
+            cache.requests_get(url, params={'from': i}).raise_for_status()
+        elapsed = time.time() - start
+    return n_requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    print('{:>8} {:>8} {:>12}'.format('rate', 'burst', 'requests/s'))
+    for (rate, burst) in [(1, 1), (2, 5), (10, 10), (100, 20)]:
+        throughput = run(args.requests, rate=rate, burst=burst)
+        print('{:>8} {:>8} {:>12.2f}'.format(rate, burst, throughput))
+    config.restore_default_settings()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+""" asyncio client for the GDC api (python 3 only).
+
+    Mirrors `api.get_data`, `api.get_fileinfo`, `query_tcga.get_manifest` & the
+    `parameters._list_valid_*` helpers, sharing their request construction & parsing,
+    so that many metadata queries can be awaited concurrently:
+
+>>> async with AsyncGDCClient(max_connections=20) as client:
+...     hits = await asyncio.gather(*[client.get_fileinfo(chunk, format='json') for chunk in chunks])
+"""
+from __future__ import absolute_import
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from .config import get_setting_value
+from . import api
+from . import cache
+from . import parameters as _params
+from . import query_tcga as qt
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 10
+
+
+class AsyncRateLimiter(object):
+    """ Awaitable front to a `cache.TokenBucket`: waits for tokens with `asyncio.sleep`
+        rather than blocking the event loop. By default uses the bucket shared with
+        the synchronous api (`cache.get_rate_limiter`), so both count against the same limit.
+    """
+    def __init__(self, bucket=None):
+        self._bucket = bucket
+
+    @property
+    def bucket(self):
+        return self._bucket or cache.get_rate_limiter()
+
+    async def acquire(self, tokens=1):
+        wait = self.bucket.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+class AsyncGDCClient(object):
+    """ asyncio client for the GDC api.
+
+        At most `max_connections` requests are in flight at once, over a pool of as many
+        HTTP connections, & requests are subject to `rate_limiter` (default: the limit
+        shared with the synchronous api, see settings `RATE_LIMIT` & `RATE_LIMIT_BURST`).
+
+        Requests are sent by a pool of `max_connections` threads, using `requests` &
+        the same http cache as the synchronous api (see `cache.make_session`). Cancelling a task
+        awaiting a request frees its slot at once; a request already sent is left to
+        complete in the background & its response discarded.
+    """
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS, rate_limiter=None, timeout=None):
+        self.max_connections = int(max_connections)
+        self.rate_limiter = rate_limiter or AsyncRateLimiter()
+        self.timeout = timeout
+        self._session = cache.make_session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections, pool_block=True)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_connections)
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def close(self):
+        """ Stop sending requests & close pooled connections.
+        """
+        try:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        except TypeError: # python < 3.9
+            self._executor.shutdown(wait=False)
+        self._session.close()
+
+    async def request(self, method, url, **kwargs):
+        """ Send a request, returning the `requests.Response`.
+            Failed requests are retried as described in `cache.RetryPolicy`,
+            without holding a connection while waiting to retry.
+        """
+        ## created here, so it belongs to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        kwargs.setdefault('timeout', self.timeout)
+        send = functools.partial(self._session.request, method, url, **kwargs)
+        policy = cache.RetryPolicy()
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self._semaphore:
+                await self.rate_limiter.acquire()
+                try:
+                    response = await loop.run_in_executor(self._executor, send)
+                except requests.RequestException as e:
+                    wait = policy.next_wait(error=e)
+                    if wait is None:
+                        raise
+                else:
+                    wait = policy.next_wait(response=response)
+                    if wait is None:
+                        cache._track_response(response, self._session)
+                        return response
+            await asyncio.sleep(wait)
+
+    async def get_data(self, endpoint_name, arg=None, project_name=None, fields=None,
+                       size=get_setting_value('DEFAULT_SIZE'), page=0, data_category=None,
+                       query_args={}, verify=False, method=None, **kwargs):
+        """ Same as `api.get_data`
+        """
+        method, endpoint, request_kwargs = api._prepare_request(endpoint_name, arg=arg,
+                                                                project_name=project_name,
+                                                                fields=fields, size=size, page=page,
+                                                                data_category=data_category,
+                                                                query_args=query_args, verify=verify,
+                                                                method=method, **kwargs)
+        response = await self.request(method, endpoint, **request_kwargs)
+        response.raise_for_status()
+        return response
+
+    async def get_fileinfo(self, file_id, fields=get_setting_value('DEFAULT_FILE_FIELDS'), format=None):
+        """ Same as `api.get_fileinfo`
+        """
+        response = await self.get_data(endpoint_name='files', fields=fields, format=format,
+                                       **api._fileinfo_query(file_id))
+        if format == 'json':
+            return response.json()['data']['hits']
+        return response
+
+    async def count_files(self, project_name=None, data_category=None, query_args={}, verify=False):
+        """ Same as `query_tcga._count_files`
+        """
+        endpoint, body = qt._count_files_request(project_name=project_name, data_category=data_category,
+                                                 query_args=query_args, verify=verify)
+        response = await self.request('POST', endpoint, json=body)
+        response.raise_for_status()
+        return int(response.json()['data']['pagination']['total'])
+
+    async def _get_manifest_page(self, page, **kwargs):
+        endpoint, body = qt._manifest_request(page=page, **kwargs)
+        response = await self.request('POST', endpoint, json=body)
+        response.raise_for_status()
+        return response.text
+
+    async def get_manifest(self, project_name=None, n=None, data_category=None, query_args={},
+                           verify=False, size=None, pages=None):
+        """ Same as `query_tcga.get_manifest`, with all pages requested concurrently
+        """
+        plan = qt._manifest_page_plan(n=n, size=size, pages=pages)
+        if plan is None:
+            total = await self.count_files(project_name=project_name, data_category=data_category,
+                                           query_args=query_args, verify=verify)
+            plan = qt._manifest_page_plan(n=n, size=size, pages=pages, total=total)
+        pages, size = plan
+        page_texts = await asyncio.gather(*[
+            self._get_manifest_page(page=page, project_name=project_name, size=size,
+                                    data_category=data_category, query_args=query_args, verify=verify)
+            for page in range(pages)])
+        return qt._join_manifest(qt._split_manifest_pages(page_texts, size=size, n=n))
+
+    async def list_valid_fields(self, endpoint_name):
+        """ Same as `parameters._list_valid_fields`
+        """
+        response = await self.request('GET', _params._valid_fields_endpoint(endpoint_name))
+        response.raise_for_status()
+        return _params._parse_valid_fields(response)
+
+    async def list_valid_options(self, field_name, endpoint_name, project_name=None,
+                                 strip_endpoint_from_field_name=True):
+        """ Same as `parameters._list_valid_options`
+        """
+        endpoint, params, field_name = _params._valid_options_request(
+            field_name=field_name, endpoint_name=endpoint_name, project_name=project_name,
+            strip_endpoint_from_field_name=strip_endpoint_from_field_name)
+        response = await self.request('GET', endpoint, params=params)
+        response.raise_for_status()
+        return _params._parse_valid_options(response, field_name=field_name)
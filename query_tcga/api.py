@@ -1,11 +1,19 @@
 from __future__ import absolute_import
 import pandas as pd
+import numpy as np
 import logging
+import json
+import time
+try:
+    from pandas import json_normalize
+except ImportError: # pandas < 1.0
+    from pandas.io.json import json_normalize
 from .log_with import log_with
 from .config import get_setting_value 
 from . import parameters as _params
-from .cache import requests_get
+from .cache import requests_get, requests_post
 from . import helpers
+from . import metadata_store
 
 logging.basicConfig()
 log = logging.getLogger(__name__)
@@ -13,18 +21,17 @@ log.setLevel(logging.DEBUG)
 
 #### ---- utilities for interacting with the GDC api ---- 
 
-@log_with()
-def get_data(endpoint_name, arg=None,
-              project_name=None, fields=None, size=get_setting_value('DEFAULT_SIZE'), page=0,
-              data_category=None, query_args={}, verify=False, *args, **kwargs):
-    """ Get single result from querying GDC api endpoint
-
-    >>> file = get_data(endpoint='files', data_category='Clinical', query_args=dict(file_id=df['case_uuid'][0]))
-    <Response [200]>
+def _prepare_request(endpoint_name, arg=None,
+                     project_name=None, fields=None, size=get_setting_value('DEFAULT_SIZE'), page=0,
+                     data_category=None, query_args={}, verify=False, method=None, **kwargs):
+    """ Build request for `get_data`, returning a tuple of (method, url, request_kwargs),
+        where request_kwargs gives either `params` (GET) or a `json` body (POST).
     """
     endpoint = get_setting_value('GDC_API_ENDPOINT').format(endpoint=endpoint_name)
     if arg:
         endpoint = endpoint+'/{}'.format(arg)
+        params = {}
+        method = 'GET'
     else:
         ## prep extra-params, including `from` param, as dict
         extra_params = {}
@@ -46,9 +53,46 @@ def get_data(endpoint_name, arg=None,
                                              verify=verify,
                                              **extra_params
                                              )
-    # requests URL-encodes automatically
-    log.info('submitting request for {endpoint} with params {params}'.format(endpoint=endpoint, params=params))
-    response = requests_get(endpoint, params=params)
+    if not method:
+        if len(params.get('filters', '')) > int(get_setting_value('POST_THRESHOLD')):
+            method = 'POST'
+        else:
+            method = 'GET'
+    log.info('submitting {method} request for {endpoint} with params {params}'.format(
+        method=method, endpoint=endpoint, params=params))
+    if method.upper() == 'POST':
+        body = dict((k, v) for (k, v) in params.items() if v is not None)
+        if 'filters' in body:
+            body['filters'] = json.loads(body['filters'])
+        return 'POST', endpoint, {'json': body}
+    else:
+        # requests URL-encodes automatically
+        return 'GET', endpoint, {'params': params}
+
+
+@log_with()
+def get_data(endpoint_name, arg=None,
+              project_name=None, fields=None, size=get_setting_value('DEFAULT_SIZE'), page=0,
+              data_category=None, query_args={}, verify=False, method=None, *args, **kwargs):
+    """ Get single result from querying GDC api endpoint
+
+        Queries are sent as GET requests, unless the encoded filter is longer than
+        setting `POST_THRESHOLD`, in which case they are sent as a POST with a json body.
+        Use `method='GET'` or `method='POST'` to override.
+
+        See `aio.AsyncGDCClient.get_data` for an asyncio version.
+
+    >>> file = get_data(endpoint='files', data_category='Clinical', query_args=dict(file_id=df['case_uuid'][0]))
+    <Response [200]>
+    """
+    method, endpoint, request_kwargs = _prepare_request(endpoint_name, arg=arg, project_name=project_name,
+                                                        fields=fields, size=size, page=page,
+                                                        data_category=data_category, query_args=query_args,
+                                                        verify=verify, method=method, **kwargs)
+    if method == 'POST':
+        response = requests_post(endpoint, **request_kwargs)
+    else:
+        response = requests_get(endpoint, **request_kwargs)
     log.info('url requested was: {}'.format(response.url))
     response.raise_for_status()
     return response
@@ -73,98 +117,275 @@ def _get_sample_data():
     return True
 
 
+def _fileinfo_query(file_id):
+    """ Arguments to `get_data` to look up `file_id` (one or a list) in the 'files' endpoint
+    """
+    return dict(query_args={'files.file_id': file_id}, size=len(helpers.convert_to_list(file_id)))
+
+
 @log_with()
 def get_fileinfo(file_id, fields=get_setting_value('DEFAULT_FILE_FIELDS'), format=None):
-    query_args = {'files.file_id': file_id}
-    response = get_data(endpoint_name='files', query_args=query_args, fields=fields, format=format)
+    response = get_data(endpoint_name='files', fields=fields, format=format, **_fileinfo_query(file_id))
     if format == 'json':
         return response.json()['data']['hits']
     else:
         return response
 
 
+def _normalize_column(series):
+    """ Expand a column of dicts (or missing values) into a DataFrame
+        with one column per key, aligned to the index of `series`.
+    """
+    records = [value if isinstance(value, dict) else {} for value in series]
+    expanded = json_normalize(records, max_level=0)
+    expanded.index = series.index
+    return expanded
+
+
+def _key_positions(records, key):
+    """ Position of `key` among the keys of each dict in `records` (-1 where missing)
+    """
+    return np.array([list(record).index(key) if isinstance(record, dict) and key in record else -1
+                     for record in records])
+
+
+def _join_nested(left, positions, hits, key, nested, records):
+    """ Join `nested` (fields of the record under `key`, e.g. 'analysis', of each of `hits`,
+        with the dicts themselves given in `records`) to `left`, all aligned by row.
+
+        Fields in both are resolved as the former loop over each hit's items did: the nested
+        value replaces the left value if `key` comes after the key which set it, in that hit.
+        `positions` maps columns of `left` (already resolved) to the position of the key which
+        set each value, & is updated for columns taken from `nested`.
+    """
+    overlap = left.columns.intersection(nested.columns)
+    if len(overlap) == 0:
+        return left.join(nested)
+    nested_position = _key_positions(hits, key)
+    for column in overlap:
+        if column not in positions:
+            positions[column] = _key_positions(hits, column)
+        present = np.array([isinstance(record, dict) and column in record for record in records])
+        use_nested = present & (nested_position > positions[column])
+        left[column] = np.where(use_nested, nested[column].astype(object).values,
+                                left[column].astype(object).values)
+        positions[column] = np.where(use_nested, nested_position, positions[column])
+    for column in nested.columns.difference(overlap):
+        positions[column] = nested_position
+    return left.join(nested.drop(overlap, axis=1))
+
+
+def _flatten_fileinfo_hits(hits, explode=False):
+    """ Convert list of hits returned for the 'files' endpoint to a DataFrame.
+
+        By default returns one row per file, with fields of `analysis` and of the
+        *first* of `cases` given as columns. With `explode=True`, returns one row
+        per file, case & sample, with sample fields given as columns prefixed by
+        'samples.'. A field of `analysis` or of the case with the same name as another
+        field (e.g. `state`) replaces it if it is listed after it in the hit.
+
+    >>> _flatten_fileinfo_hits([{'file_id': 'f1', 'analysis': {'analysis_id': 'a1'},
+    ...                          'cases': [{'case_id': 'c1', 'samples': [{'sample_id': 's1'}]}]}],
+    ...                        explode=True)
+      file_id analysis_id case_id samples.sample_id
+    0      f1          a1      c1                s1
+    """
+    if len(hits) == 0:
+        return pd.DataFrame()
+    files = json_normalize(hits, max_level=0)
+    positions = dict()
+    if 'analysis' in files.columns:
+        analysis = files.pop('analysis')
+        files = _join_nested(files, positions, hits, 'analysis', _normalize_column(analysis), list(analysis))
+    if 'cases' not in files.columns:
+        return files.infer_objects()
+    cases = files.pop('cases')
+    if not explode:
+        n_cases = cases.apply(lambda x: len(x) if isinstance(x, list) else 0)
+        if (n_cases > 1).any():
+            log.warning('{} files have more than one case; only the first is kept. '
+                        'Use explode=True to keep all cases.'.format((n_cases > 1).sum()))
+        first_case = cases.apply(lambda x: x[0] if isinstance(x, list) and len(x) > 0 else None)
+        return _join_nested(files, positions, hits, 'cases', _normalize_column(first_case),
+                            list(first_case)).infer_objects()
+    ## one row per (file, case), then per (file, case, sample)
+    cases = cases.apply(lambda x: x if isinstance(x, list) and len(x) > 0 else [None]).explode()
+    file_index = cases.index
+    case_records = list(cases)
+    case_data = _normalize_column(cases.reset_index(drop=True))
+    if 'samples' in case_data.columns:
+        samples = case_data.pop('samples')
+        samples = samples.apply(lambda x: x if isinstance(x, list) and len(x) > 0 else [None]).explode()
+        case_index = samples.index
+        sample_data = _normalize_column(samples.reset_index(drop=True)).add_prefix('samples.')
+        file_index = file_index[case_index]
+        case_records = [case_records[i] for i in case_index]
+        case_data = case_data.iloc[case_index].reset_index(drop=True).join(sample_data)
+    rows = files.iloc[file_index].reset_index(drop=True)
+    positions = dict((column, position[np.asarray(file_index)]) for (column, position) in positions.items())
+    rows = _join_nested(rows, positions, [hits[i] for i in file_index], 'cases', case_data, case_records)
+    return rows.infer_objects()
+
+
 def get_fileinfo_data(file_id,
                       fields=get_setting_value('DEFAULT_FILE_FIELDS'),
-                      chunk_size=get_setting_value('DEFAULT_CHUNK_SIZE')
+                      chunk_size=get_setting_value('DEFAULT_CHUNK_SIZE'),
+                      max_workers=None,
+                      explode=False,
+                      use_store=None
                       ):
+    """ Get meta-data for files, as a pandas.DataFrame with one row per file.
+
+        Meta-data are read from the local metadata store (see `metadata_store.get_store`)
+        where possible; only files missing from the store, or changed since they were
+        stored, are fetched. Use `use_store=False` to skip the store.
+
+        File ids are looked up in chunks of `chunk_size`, with up to `max_workers`
+        (default: setting `MAX_WORKERS`) chunks in flight at once, subject to the
+        shared rate limit. Latency of each chunk is logged & recorded, as a list of
+        seconds per chunk, in `df.attrs['chunk_latency']`.
+
+        By default, only the first case of each file is described. Use `explode=True`
+        to return one row per file, case & sample (see `_flatten_fileinfo_hits`).
+    """
     file_id = helpers.convert_to_list(file_id)
     file_id = [x for x in file_id if x != '']
     if len(file_id) == 0:
         # logger.warning('No files left to process')
         return pd.DataFrame()
-    if len(file_id)>chunk_size:
+    chunk_latency = list()
+
+    def fetch_chunk(chunk, fields):
+        start = time.time()
+        hits = get_fileinfo(file_id=chunk, fields=fields, format='json')
+        latency = time.time() - start
+        log.info('fetched fileinfo for {n} files in {latency:.2f}s'.format(n=len(chunk), latency=latency))
+        return hits, latency
+
+    def fetch(file_id, fields):
         chunks = [file_id[x:x+chunk_size] for x in range(0, len(file_id), chunk_size)]
-        data = [get_fileinfo_data(chunk, fields=fields) for chunk in chunks]
-        return pd.concat(data)
-    res = get_fileinfo(file_id=file_id, fields=fields, format='json')
-    df = list()
-    for hit in res:
-        hit_data = dict()
-        for (k, v) in hit.items():
-            if k == 'cases':
-                for (subkey, subval) in hit['cases'][0].items():
-                  hit_data[subkey] = subval
-            elif k == 'analysis':
-                for (subkey, subval) in hit['analysis'].items():
-                  hit_data[subkey] = subval
-            else:
-                hit_data[k] = v
-        df.append(hit_data)
-    df = pd.DataFrame(df)
+        results = helpers.map_concurrently(lambda chunk: fetch_chunk(chunk, fields), chunks,
+                                           max_workers=max_workers)
+        hits = list()
+        for (chunk_hits, latency) in results:
+            hits.extend(chunk_hits)
+            chunk_latency.append(latency)
+        return hits
+
+    hits = metadata_store.fetch_through_store('files', file_id, fields=fields, id_field='file_id',
+                                              fetch=fetch, use_store=use_store)
+    df = _flatten_fileinfo_hits(hits, explode=explode)
+    if hasattr(df, 'attrs'):
+        df.attrs['chunk_latency'] = chunk_latency
     return df
 
+SAMPLE_FIELDS = ['files.cases.samples.{}'.format(field) for field in [
+    'sample_id',
+    'sample_type',
+    'sample_type_id',
+    'composition',
+    'created_datetime',
+    'current_weight',
+    'days_to_collection',
+    'days_to_sample_procurement',
+    'freezing_method',
+    'initial_weight',
+    'intermediate_dimension',
+    'is_ffpe',
+    'longest_dimension',
+    'oct_embedded',
+    'pathology_report_uuid',
+    'preservation_method',
+    'shortest_dimension',
+    'state',
+    'submitter_id',
+    'time_between_clamping_and_freezing',
+    'time_between_excision_and_freezing',
+    'tissue_type',
+    'tumor_code',
+    'tumor_code_id',
+    'tumor_descriptor',
+    'updated_datetime',
+    ]]
+
+
 @log_with()
 def _describe_samples(case_ids,
                       query_args={},
-
+                      chunk_size=100,
+                      max_workers=None,
+                      use_store=None,
                       **kwargs):
     """ Helper function to describe sample files
+
+        Cases are queried in chunks of `chunk_size` case ids, with up to `max_workers`
+        (default: setting `MAX_WORKERS`) chunks in flight at once. Samples listed more
+        than once for a case are dropped from each chunk as it arrives (see
+        `_dedupe_case_samples`). Returns one row per distinct sample_id.
+
+        Unless other query parameters are given, cases are read from the local metadata
+        store where possible (see `get_fileinfo_data`).
     """
-    sample_df = list()
-    for case_id in helpers.convert_to_list(case_ids):
-        samples = get_data(endpoint_name='cases',
-                               fields=['files.cases.samples.sample_id',
-                                       'files.cases.samples.sample_type',
-                                       'files.cases.samples.sample_type_id',
-                                       'files.cases.samples.composition',
-                                       'files.cases.samples.created_datetime',
-'files.cases.samples.current_weight',
-'files.cases.samples.days_to_collection',
-'files.cases.samples.days_to_sample_procurement',
-'files.cases.samples.freezing_method',
-'files.cases.samples.initial_weight',
-'files.cases.samples.intermediate_dimension',
-'files.cases.samples.is_ffpe',
-'files.cases.samples.longest_dimension',
-'files.cases.samples.oct_embedded',
-'files.cases.samples.pathology_report_uuid',
-'files.cases.samples.preservation_method',
-'files.cases.samples.sample_id',
-'files.cases.samples.sample_type',
-'files.cases.samples.sample_type_id',
-'files.cases.samples.shortest_dimension',
-'files.cases.samples.state',
-'files.cases.samples.submitter_id',
-'files.cases.samples.time_between_clamping_and_freezing',
-'files.cases.samples.time_between_excision_and_freezing',
-'files.cases.samples.tissue_type',
-'files.cases.samples.tumor_code',
-'files.cases.samples.tumor_code_id',
-'files.cases.samples.tumor_descriptor',
-'files.cases.samples.updated_datetime'],
-                               query_args=dict(case_id=case_id, **query_args),
+    case_ids = helpers.convert_to_list(case_ids)
+
+    def fetch(case_ids, fields):
+        chunks = [case_ids[x:x+chunk_size] for x in range(0, len(case_ids), chunk_size)]
+
+        def fetch_chunk(chunk):
+            samples = get_data(endpoint_name='cases',
+                               fields=fields,
+                               query_args=dict({'cases.case_id': chunk}, **query_args),
+                               size=len(chunk),
                                **kwargs
                                )
-        sample_data = _convert_sample_result_to_df(samples.json()['data']['hits'])
-        sample_df.append(sample_data)
-    return pd.concat(sample_df).drop_duplicates()
+            return [_dedupe_case_samples(hit) for hit in samples.json()['data']['hits']]
 
-def _convert_sample_result_to_df(res):
-    sample_df_list = list()
+        hits = list()
+        for chunk_hits in helpers.map_concurrently(fetch_chunk, chunks, max_workers=max_workers):
+            hits.extend(chunk_hits)
+        return hits
+
+    if query_args or kwargs:
+        use_store = False
+    hits = metadata_store.fetch_through_store('cases', case_ids, fields=SAMPLE_FIELDS, id_field='case_id',
+                                              fetch=fetch, use_store=use_store)
+    seen = set()
+    records = list()
+    for sample in _iter_sample_records(hits):
+        sample_id = sample.get('sample_id')
+        if sample_id is not None:
+            if sample_id in seen:
+                continue
+            seen.add(sample_id)
+        records.append(sample)
+    return pd.DataFrame(records)
+
+
+def _dedupe_case_samples(hit):
+    """ Copy of a hit for the 'cases' endpoint listing each of its samples once,
+        since the GDC lists the samples of a case again under each of its files
+    """
+    seen = set()
+    samples = list()
+    for sample in _iter_sample_records([hit]):
+        sample_id = sample.get('sample_id')
+        if sample_id is not None:
+            if sample_id in seen:
+                continue
+            seen.add(sample_id)
+        samples.append(sample)
+    return dict(hit, files=[{'cases': [{'samples': samples}]}])
+
+
+def _iter_sample_records(res):
+    """ Yield each sample (as a dict) described in hits returned for the 'cases' endpoint
+    """
     for hit in res:
-        for result_file in hit['files']:
-            for result_case in result_file['cases']:
-                hit_data = pd.DataFrame(result_case['samples'])
-                sample_df_list.append(hit_data)
-    return pd.concat(sample_df_list)
-            
+        for result_file in hit.get('files', []):
+            for result_case in result_file.get('cases', []):
+                for sample in result_case.get('samples', []):
+                    yield sample
+
+
+def _convert_sample_result_to_df(res):
+    return pd.DataFrame(list(_iter_sample_records(res)))
@@ -1,70 +1,472 @@
 from __future__ import absolute_import
 from .config import get_setting_value
 import requests
+import os
+import json
 import time
-import errno
+import email.utils
+import collections
+import random
 import logging
+import functools
+import threading
+try:
+    from urllib.parse import urlparse, parse_qs
+except ImportError: # python 2
+    from urlparse import urlparse, parse_qs
+
+## session shared by all requests to the GDC api (see `get_session`)
+SESSION = None
+
+try:
+    _monotonic = time.monotonic
+except AttributeError: # python 2
+    _monotonic = time.time
+
+
+class TokenBucket(object):
+    """ Thread-safe token-bucket rate limiter.
+
+        Tokens accrue at `rate` per second, up to a maximum of `burst`.
+        Each call to `acquire` consumes tokens, sleeping until the bucket
+        has refilled enough to cover them. Requests larger than `burst`
+        are allowed; they simply borrow against future tokens.
+
+    >>> bucket = TokenBucket(rate=2, burst=5)
+    >>> bucket.acquire()
+    0
+    """
+    def __init__(self, rate, burst=1, clock=_monotonic, sleep=time.sleep):
+        if float(rate) <= 0:
+            raise ValueError('Rate must be positive: {}'.format(rate))
+        if float(burst) < 1:
+            raise ValueError('Burst must be at least 1: {}'.format(burst))
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.burst
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """ Consume `tokens` without blocking. Returns the number of seconds the
+            caller must wait before they are available (e.g. to sleep asynchronously).
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= tokens
+            return -self._tokens / self.rate if self._tokens < 0 else 0
+
+    def acquire(self, tokens=1):
+        """ Consume `tokens`, blocking until they are available.
+            Returns the number of seconds spent waiting.
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
 
-SESSION = requests.Session()
 
 def RateLimited(maxPerSecond):
-    minInterval = 1.0 / float(maxPerSecond)
+    """ Decorator limiting calls to `func` to at most `maxPerSecond`
+    """
     def decorate(func):
-        lastTimeCalled = [0.0]
+        bucket = TokenBucket(rate=maxPerSecond, burst=1)
+        @functools.wraps(func)
         def rateLimitedFunction(*args,**kargs):
-            elapsed = time.clock() - lastTimeCalled[0]
-            leftToWait = minInterval - elapsed
-            if leftToWait>0:
-                time.sleep(leftToWait)
-            ret = func(*args,**kargs)
-            lastTimeCalled[0] = time.clock()
-            return ret
+            bucket.acquire()
+            return func(*args,**kargs)
         return rateLimitedFunction
     return decorate
 
 
-def setup_cache():
-    global SESSION
-    if get_setting_value('USE_CACHE'):
-        import requests_cache
-        requests_cache.install_cache(cache_name='gdc_cache', backend='sqlite', expire_after=18000)
-    #   import cachecontrol
-    #   from cachecontrol.caches import FileCache
-    #   SESSION = cachecontrol.CacheControl(requests.Session(), cache=FileCache('.web_cache', forever=True))
-    #else:
-    #    SESSION = requests.Session()
-
-
-@RateLimited(1)
-def requests_get(*args, **kwargs):
-    global SESSION
-    time.sleep(10)
+_RATE_LIMITER = None
+_RATE_LIMITER_LOCK = threading.Lock()
+
+def get_rate_limiter():
+    """ Return the token bucket shared by all requests to the GDC api,
+        (re)building it if settings RATE_LIMIT or RATE_LIMIT_BURST have changed.
+    """
+    global _RATE_LIMITER
+    rate = float(get_setting_value('RATE_LIMIT'))
+    burst = float(get_setting_value('RATE_LIMIT_BURST'))
+    with _RATE_LIMITER_LOCK:
+        if _RATE_LIMITER is None or (_RATE_LIMITER.rate, _RATE_LIMITER.burst) != (rate, burst):
+            _RATE_LIMITER = TokenBucket(rate=rate, burst=burst)
+        return _RATE_LIMITER
+
+
+#### ---- http cache ----
+
+_SESSION_LOCK = threading.RLock()
+_SESSION_CONFIG = None
+## cache keys of responses used by this process, least recently used first
+_LRU = collections.OrderedDict()
+_CACHE_COUNTS = collections.Counter()
+
+
+def _cache_config():
+    """ Settings for the http cache, as a hashable tuple (or None if not caching)
+    """
+    use_cache = get_setting_value('USE_CACHE')
+    if not use_cache or str(use_cache).lower() in ('false', '0', 'no'):
+        return None
+    path = get_setting_value('CACHE_PATH')
+    if not path:
+        path = os.path.join(get_setting_value('GDC_DATA_DIR'), 'http_cache')
+    ttls = get_setting_value('CACHE_TTLS')
+    if isinstance(ttls, str):
+        ttls = json.loads(ttls)
+    max_entries = get_setting_value('CACHE_MAX_ENTRIES')
+    return (path, get_setting_value('CACHE_BACKEND'), int(max_entries) if max_entries else None,
+            json.dumps(ttls or {}, sort_keys=True), get_setting_value('GDC_API_ENDPOINT'))
+
+
+def _expire_after(ttl):
+    import requests_cache
+    if ttl is None:
+        return requests_cache.NEVER_EXPIRE
+    if float(ttl) <= 0:
+        return requests_cache.DO_NOT_CACHE
+    return float(ttl)
+
+
+def _urls_expire_after(ttls, api_endpoint):
+    """ requests_cache url patterns -> expiry, for each endpoint given in `ttls`
+    """
+    base_url = api_endpoint.split('://')[-1]
+    patterns = collections.OrderedDict()
+    ## field listings first, since they are below each endpoint's url
+    if '_mapping' in ttls:
+        patterns[base_url.format(endpoint='*') + '/_mapping'] = _expire_after(ttls['_mapping'])
+    for (endpoint_name, ttl) in sorted(ttls.items()):
+        if endpoint_name not in ('_mapping', 'default'):
+            patterns[base_url.format(endpoint=endpoint_name)] = _expire_after(ttl)
+    return patterns
+
+
+def _request_params(request):
+    """ Parameters of a request to the GDC api, from its query string & (json) body
+    """
+    params = dict((key, values[-1]) for (key, values) in parse_qs(urlparse(request.url).query).items())
+    body = request.body or b''
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', 'replace')
     try:
-        resp = SESSION.get(*args, **kwargs)
-    except requests.ConnectionError as e:
-        if e.errno != 54:
-            raise # Not error we are looking for
-        else:
-            logging.warning('Warning - connection reset by peer. Trying request again.')
-            time.sleep(12)
-            resp = SESSION.get(*args, **kwargs)
-    return resp
+        body = json.loads(body) if body else dict()
+    except ValueError:
+        body = dict()
+    if isinstance(body, dict):
+        params.update(body)
+    return params
 
 
-@RateLimited(1)
-def requests_post(*args, **kwargs):
-    time.sleep(1)
+def _is_cacheable(response):
+    """ Manifests & counts (requests for size=0 records) are never cached, so that downloads
+        always use a current list of files, & pages planned from a count cover all of them
+    """
+    params = _request_params(response.request)
+    return params.get('return_type') != 'manifest' and str(params.get('size')) != '0'
+
+
+def make_session():
+    """ New `requests.Session` using the http cache described by settings `USE_CACHE`,
+        `CACHE_PATH`, `CACHE_BACKEND` & `CACHE_TTLS`.
+    """
+    config = _cache_config()
+    if config is None:
+        return requests.Session()
+    import requests_cache
+    (path, backend, max_entries, ttls, api_endpoint) = config
+    ttls = json.loads(ttls)
+    if backend in ('sqlite', 'filesystem'):
+        dir_name = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+    return requests_cache.CachedSession(cache_name=path,
+                                        backend=backend,
+                                        expire_after=_expire_after(ttls.get('default')),
+                                        urls_expire_after=_urls_expire_after(ttls, api_endpoint),
+                                        allowable_methods=('GET', 'HEAD', 'POST'),
+                                        filter_fn=_is_cacheable)
+
+
+def get_session():
+    """ Return the session shared by all requests to the GDC api, (re)building it
+        if cache settings have changed. The cache is set up lazily, on first use.
+    """
+    global SESSION, _SESSION_CONFIG
+    config = _cache_config()
+    with _SESSION_LOCK:
+        if SESSION is None or config != _SESSION_CONFIG:
+            if config is not None:
+                logging.debug('Using http cache at {}'.format(config[0]))
+            SESSION = make_session()
+            _SESSION_CONFIG = config
+            _LRU.clear()
+        return SESSION
+
+
+def setup_cache():
+    """ (Re)configure the http cache from current settings
+    """
+    return get_session()
+
+
+def _track_response(response, session):
+    """ Count cache hits & misses, and evict least recently used responses
+        once the cache holds more than setting `CACHE_MAX_ENTRIES`.
+    """
+    if not hasattr(session, 'cache'):
+        return
+    cache_key = getattr(response, 'cache_key', None)
+    from_cache = getattr(response, 'from_cache', False)
+    max_entries = get_setting_value('CACHE_MAX_ENTRIES')
+    with _SESSION_LOCK:
+        _CACHE_COUNTS['hits' if from_cache else 'misses'] += 1
+        if cache_key is None:
+            return
+        _LRU.pop(cache_key, None)
+        _LRU[cache_key] = True
+        if not from_cache and max_entries:
+            _evict(session, int(max_entries))
+
+
+def _evict(session, max_entries):
+    n_entries = len(session.cache.responses)
+    if n_entries <= max_entries:
+        return
+    ## evict down to 90% of max, so we don't evict on every request.
+    ## Responses not used by this process go first, oldest stored first
+    n_evict = n_entries - int(max_entries * 0.9)
+    keys = [key for key in session.cache.responses.keys() if key not in _LRU]
+    keys = (keys + list(_LRU))[0:n_evict]
+    session.cache.delete(*keys)
+    for key in keys:
+        _LRU.pop(key, None)
+    _CACHE_COUNTS['evicted'] += len(keys)
+    logging.debug('Evicted {} responses from http cache'.format(len(keys)))
+
+
+def clear(endpoint=None):
+    """ Remove cached responses for `endpoint` (e.g. 'files', or '_mapping' for field
+        listings), or all cached responses. Returns the number of responses removed.
+
+    >>> clear(endpoint='files')
+    12
+    """
+    session = get_session()
+    if not hasattr(session, 'cache'):
+        return 0
+    with _SESSION_LOCK:
+        if endpoint is None:
+            n_entries = len(session.cache.responses)
+            session.cache.clear()
+            _LRU.clear()
+            return n_entries
+        prefix = get_setting_value('GDC_API_ENDPOINT').format(endpoint=endpoint)
+        keys = list()
+        for response in session.cache.filter(expired=True):
+            url = response.url.split('?')[0]
+            if url.endswith('/_mapping') if endpoint == '_mapping' else url.startswith(prefix):
+                keys.append(response.cache_key)
+        session.cache.delete(*keys)
+        for key in keys:
+            _LRU.pop(key, None)
+        return len(keys)
+
+
+def stats():
+    """ Describe the http cache: its location & backend, number of responses held,
+        and the number of cache hits, misses & evictions by this process.
+
+    >>> stats()
+    {'enabled': True, 'backend': 'sqlite', 'location': 'data/gdc/http_cache', 'entries': 120,
+     'max_entries': 10000, 'hits': 80, 'misses': 120, 'evicted': 0}
+    """
+    session = get_session()
+    config = _SESSION_CONFIG
+    with _SESSION_LOCK:
+        res = dict(enabled=config is not None,
+                   backend=config[1] if config else None,
+                   location=config[0] if config else None,
+                   entries=len(session.cache.responses) if hasattr(session, 'cache') else 0,
+                   max_entries=config[2] if config else None)
+        res.update((key, _CACHE_COUNTS[key]) for key in ['hits', 'misses', 'evicted'])
+    return res
+
+
+#### ---- retries ----
+
+## status class -> setting giving max number of retries
+RETRY_SETTINGS = {
+    'connection': 'RETRY_CONNECTION_ERRORS',
+    'rate_limited': 'RETRY_RATE_LIMITED',
+    'server_error': 'RETRY_SERVER_ERRORS',
+}
+
+
+def _classify(response=None, error=None):
+    """ Status class of a failed request that may be retried, or None
+    """
+    if error is not None:
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return 'connection'
+        return None
+    if response.status_code == 429:
+        return 'rate_limited'
+    if 500 <= response.status_code < 600:
+        return 'server_error'
+    return None
+
+
+def _parse_retry_after(response):
+    """ Seconds to wait as given by the response's Retry-After header (in seconds or as a date), if any
+    """
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
     try:
-        resp = requests.post(*args, **kwargs)
-    except requests.ConnectionError as e:
-        if e.errno != errno.ECONNRESET:
-            raise # Not error we are looking for
+        when = email.utils.parsedate_tz(value)
+        return max(0, email.utils.mktime_tz(when) - time.time())
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+class RetryMetrics(object):
+    """ Thread-safe counts of retries, by status class, across all requests
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = collections.Counter()
+            self._wait = 0.0
+
+    def record(self, key, wait=0):
+        with self._lock:
+            self._counts[key] += 1
+            self._wait += wait
+
+    def as_dict(self):
+        """ Returns dict with number of retries per status class, number of requests
+            given up on ('gave_up') and total seconds spent waiting to retry ('wait_seconds')
+        """
+        with self._lock:
+            metrics = dict((key, 0) for key in list(RETRY_SETTINGS) + ['gave_up'])
+            metrics.update(self._counts)
+            metrics['wait_seconds'] = self._wait
+            return metrics
+
+
+RETRY_METRICS = RetryMetrics()
+
+
+def get_retry_metrics():
+    """ Retry counts for requests to the GDC api since import (or the last reset)
+
+    >>> get_retry_metrics()
+    {'connection': 0, 'rate_limited': 2, 'server_error': 1, 'gave_up': 0, 'wait_seconds': 3.4}
+    """
+    return RETRY_METRICS.as_dict()
+
+
+def reset_retry_metrics():
+    RETRY_METRICS.reset()
+
+
+class RetryPolicy(object):
+    """ Decides whether & when to retry a failed request.
+
+        Requests failing with a connection error, a 429 or a 5xx response are retried
+        up to `max_retries[status class]` times, after an exponential backoff
+        (`backoff` * 2**retry, capped at `max_backoff`) with full jitter, or after
+        the delay given in the response's Retry-After header, if any.
+        Defaults come from settings (see `RETRY_SETTINGS`, `RETRY_BACKOFF` & `RETRY_MAX_BACKOFF`).
+    """
+    def __init__(self, max_retries=None, backoff=None, max_backoff=None, metrics=RETRY_METRICS,
+                 jitter=random.random):
+        self.max_retries = dict((key, int(get_setting_value(setting)))
+                                for (key, setting) in RETRY_SETTINGS.items())
+        self.max_retries.update(max_retries or {})
+        self.backoff = float(get_setting_value('RETRY_BACKOFF') if backoff is None else backoff)
+        self.max_backoff = float(get_setting_value('RETRY_MAX_BACKOFF') if max_backoff is None else max_backoff)
+        self.metrics = metrics
+        self._jitter = jitter
+        self._retries = collections.Counter()
+
+    def next_wait(self, response=None, error=None):
+        """ Seconds to wait before retrying a request which failed with `response` or
+            `error`, or None if it should not be retried.
+        """
+        status_class = _classify(response=response, error=error)
+        if status_class is None:
+            return None
+        retry = self._retries[status_class]
+        if retry >= self.max_retries.get(status_class, 0):
+            if self.metrics is not None:
+                self.metrics.record('gave_up')
+            return None
+        self._retries[status_class] += 1
+        wait = _parse_retry_after(response)
+        if wait is None:
+            wait = self._jitter() * min(self.max_backoff, self.backoff * 2 ** retry)
+        if self.metrics is not None:
+            self.metrics.record(status_class, wait=wait)
+        logging.warning('Request failed ({reason}); retry {retry} of {max_retries} in {wait:.1f}s'.format(
+            reason=error or 'status {}'.format(response.status_code), retry=retry + 1,
+            max_retries=self.max_retries[status_class], wait=wait))
+        return wait
+
+
+def send_with_retries(send, policy=None, sleep=time.sleep):
+    """ Call `send()` (returning a `requests.Response`), retrying according to `policy`
+        (default: a new `RetryPolicy`). Returns the last response, which may still
+        be an error, or raises the last connection error.
+    """
+    policy = policy or RetryPolicy()
+    while True:
+        try:
+            response = send()
+        except requests.RequestException as e:
+            wait = policy.next_wait(error=e)
+            if wait is None:
+                raise
         else:
-            logging.warning('Warning - connection reset by peer. Trying request again.')
-            time.sleep(12)
-            resp = requests.post(*args, **kwargs)
-    return resp
+            wait = policy.next_wait(response=response)
+            if wait is None:
+                return response
+        sleep(wait)
+
+
+def _rate_limited_send(method, *args, **kwargs):
+    get_rate_limiter().acquire()
+    return method(*args, **kwargs)
+
 
+def requests_get(*args, **kwargs):
+    """ GET request using the shared session, subject to the shared rate limit & retried on failure
+    """
+    session = get_session()
+    response = send_with_retries(functools.partial(_rate_limited_send, session.get, *args, **kwargs))
+    _track_response(response, session)
+    return response
+
+
+def requests_post(*args, **kwargs):
+    """ POST request using the shared session, subject to the shared rate limit & retried on failure
+    """
+    session = get_session()
+    response = send_with_retries(functools.partial(_rate_limited_send, session.post, *args, **kwargs))
+    _track_response(response, session)
+    return response
 
-if get_setting_value('USE_CACHE'):
-    setup_cache()
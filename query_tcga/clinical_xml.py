@@ -0,0 +1,108 @@
+from __future__ import absolute_import
+from lxml import etree
+
+#### ---- streaming parser for clinical XML files ----
+## Produces the same output as `query_tcga._parse_clin_data_soup` (BeautifulSoup), including
+## its treatment of whitespace, comments & nested tags, but reads the file with `lxml.etree.iterparse`
+## & discards each section of the patient record once it has been parsed. As with BeautifulSoup,
+## the parser recovers from malformed XML (e.g. undeclared namespace prefixes) where it can.
+
+## whitespace-only strings are collapsed by BeautifulSoup to a single newline or space
+_ASCII_SPACES = dict((ord(c), None) for c in '\x20\x0a\x09\x0c\x0d')
+
+
+def _collapse(text):
+    if not text:
+        return ''
+    if text.translate(_ASCII_SPACES) == '':
+        return '\n' if '\n' in text else ' '
+    return text
+
+
+def _localname(element):
+    ## tags with undeclared namespace prefixes keep their prefix, in recover mode
+    return element.tag.rsplit('}', 1)[-1].rsplit(':', 1)[-1]
+
+
+def _n_contents(element):
+    """ Number of child nodes (text, elements, comments) of element, as counted by `len(tag)` in BeautifulSoup
+    """
+    n = 1 if element.text else 0
+    for child in element:
+        n += 2 if child.tail else 1
+    return n
+
+
+def _parse_element(element, entries, counter, visit, preferred_only=True):
+    """ Record (position, field_name, field_value) in `entries` for this element & its
+        descendants, if `visit`-ed. Returns text of element (as BeautifulSoup's `tag.text`).
+
+        `counter` is a single-element list giving the next position, in document order.
+    """
+    position = counter[0]
+    counter[0] += 1
+    n_contents = _n_contents(element)
+    visit_children = visit and n_contents > 1
+    parts = [_collapse(element.text)]
+    for child in element:
+        if isinstance(child.tag, str):
+            parts.append(_parse_element(child, entries, counter, visit=visit_children))
+        parts.append(_collapse(child.tail))
+    text = ''.join(parts)
+
+    if visit and n_contents > 0:
+        if 'preferred_name' in element.attrib:
+            field_name = element.get('preferred_name')
+        elif not(preferred_only):
+            field_name = _localname(element)
+        else:
+            field_name = None
+        field_value = text.strip()
+        if field_name and field_value:
+            entries.append((position, field_name, field_value))
+    return text
+
+
+def _element_text(element):
+    return _parse_element(element, entries=[], counter=[0], visit=False)
+
+
+def parse_clinical_xml(xml_file, preferred_only=True):
+    """ Parse clinical data from the `patient` section of a TCGA clinical XML file.
+
+        Returns a tuple of (data, patient_id) where `data` is a dict of field values keyed
+        by the `preferred_name` of each tag (or by the tag name, for top-level tags without
+        a preferred_name, if `preferred_only=False`), and `patient_id` is the text of the
+        first `patient_id` tag in the file.
+
+    >>> data, patient_id = parse_clinical_xml('nationwidechildrens.org_clinical.TCGA-2F-A9KO.xml')
+    >>> data['gender']
+    'MALE'
+    """
+    patient = None
+    patient_id = None
+    entries = list()
+    counter = [0]
+    depth = 0
+    for (event, element) in etree.iterparse(xml_file, events=('start', 'end'), recover=True):
+        if event == 'start':
+            depth += 1
+            if patient is None and _localname(element) == 'patient':
+                patient = element
+            continue
+        depth -= 1
+        if patient_id is None and _localname(element) == 'patient_id':
+            patient_id = _element_text(element)
+        if patient is not None and element.getparent() is patient:
+            ## a complete top-level section of the patient record
+            _parse_element(element, entries, counter, visit=True, preferred_only=preferred_only)
+            element.clear()
+        elif depth == 1 and element is not patient and patient is None:
+            ## top-level section of the file preceding the patient record
+            element.clear()
+    if patient is None:
+        raise ValueError('No patient record found in {}'.format(xml_file))
+    data = dict()
+    for (position, field_name, field_value) in sorted(entries):
+        data[field_name] = field_value
+    return data, patient_id
@@ -3,50 +3,67 @@ import cohorts
 from . import query_tcga as qt
 from . import samples
 from . import helpers
+from . import storage
 from .config import get_setting_value
 from . import config
 import numpy as np
 import pandas as pd
-import logging
 import os
 
 def _get_file_path(project_data_dir, file_type):
-    return os.path.join(project_data_dir, '{}.csv'.format(file_type))
+    return storage.get_file_path(project_data_dir, file_type)
 
-def _try_get_file(project_data_dir=None, file_type='generic'):
+def _try_get_file(project_data_dir=None, file_type='generic', columns=None):
+    """ Read table saved in project_data_dir (in format given by setting `CACHE_FORMAT`), if any
+    """
     if project_data_dir:
-        file_path = _get_file_path(project_data_dir=project_data_dir, file_type=file_type)
-        if os.path.exists(file_path):
-            dataframe = pd.read_csv(file_path, sep='|')
-            return dataframe
+        return storage.read_table(project_data_dir, file_type=file_type, columns=columns)
     return None
 
 def _try_save_file(dataframe, project_data_dir=None, file_type='generic'):
     if project_data_dir:
-        file_path = _get_file_path(project_data_dir=project_data_dir, file_type=file_type)
-        dataframe.to_csv(file_path, sep='|', index=False)
+        storage.write_table(dataframe, project_data_dir, file_type=file_type)
+
+
+def _load_clinical_data(project_name, data_dir, project_data_dir=None, refresh=False, workers=None, **kwargs):
+    """ Load clinical data saved in project_data_dir, or build it from the project's clinical files.
 
+        With `refresh=True`, the saved data are updated from the current manifest, parsing only
+        files which are new or have changed (by md5) since they were saved. The md5 & parse
+        time of each file are kept alongside the data, as file_type 'clinical_index'.
 
-def _load_clinical_data(project_name, data_dir, project_data_dir=None, **kwargs):
+        Files are parsed by up to `workers` processes (see `update_clinical_data`); other
+        `kwargs` are passed to `download_clinical_files`.
+    """
     clinical_data = _try_get_file(project_data_dir, file_type='clinical')
-    if clinical_data is None:
-        clinical_data = qt.get_clinical_data(project_name=project_name, data_dir=data_dir, **kwargs)
+    if clinical_data is None or refresh:
+        clinical_index = _try_get_file(project_data_dir, file_type='clinical_index')
+        xml_files = qt.download_clinical_files(project_name=project_name, data_dir=data_dir, **kwargs)
+        clinical_data, clinical_index = qt.update_clinical_data(xml_files,
+                                                                clinical_data=clinical_data,
+                                                                clinical_index=clinical_index,
+                                                                workers=workers)
         _try_save_file(clinical_data, project_data_dir=project_data_dir, file_type='clinical')
+        _try_save_file(clinical_index, project_data_dir=project_data_dir, file_type='clinical_index')
     return clinical_data
 
 
-def _load_vcf_fileinfo(project_name, data_dir, project_data_dir=None, **kwargs):
-    vcf_fileinfo = _try_get_file(project_data_dir, file_type='vcf_fileinfo')
+def _load_vcf_fileinfo(project_name, data_dir, project_data_dir=None, columns=None, **kwargs):
+    """ Load vcf fileinfo saved in project_data_dir (only `columns`, if given), or download it
+    """
+    vcf_fileinfo = _try_get_file(project_data_dir, file_type='vcf_fileinfo', columns=columns)
     if vcf_fileinfo is None:
         vcf_files = samples.download_vcf_files(project_name=project_name, data_dir=data_dir, **kwargs)
         vcf_fileinfo = vcf_files.fileinfo
         _try_save_file(vcf_fileinfo, project_data_dir=project_data_dir, file_type='vcf_fileinfo')
+        if columns is not None:
+            vcf_fileinfo = vcf_fileinfo.loc[:, columns]
     return vcf_fileinfo
 
 
 def _prep_vcf_fileinfo(project_name, data_dir, project_data_dir=None, **kwargs):
-    all_vcf_fileinfo = _load_vcf_fileinfo(project_name=project_name, project_data_dir=project_data_dir, data_dir=data_dir, **kwargs)
-    vcf_fileinfo = all_vcf_fileinfo.loc[:,['submitter_id','filepath']]
+    vcf_fileinfo = _load_vcf_fileinfo(project_name=project_name, project_data_dir=project_data_dir, data_dir=data_dir,
+                                      columns=['submitter_id', 'filepath'], **kwargs)
     vcf_fileinfo.rename(columns = {'filepath': 'snv_vcf_paths'}, inplace=True)
     vcf_fileinfo['patient_id'] = vcf_fileinfo['submitter_id'].apply(lambda x: x.split('-')[2])
     vcf_fileinfo['snv_vcf_paths'] = vcf_fileinfo['snv_vcf_paths'].apply(helpers.convert_to_list)
@@ -54,69 +71,106 @@ def _prep_vcf_fileinfo(project_name, data_dir, project_data_dir=None, **kwargs):
     return vcf_fileinfo_agg
 
 
-def build_cohort_patient(row, benefit_days, **kwargs):
-    patient_id = row['case_id']
-    deceased = row['vital_status'] != 'Alive'
-    progressed = row['treatment_outcome_at_tcga_followup'] != 'Complete Response'
-    censor_time = float(row['last_contact_days_to'])
-    deceased_time = float(row['death_days_to'])
-    progressed_time = float(row['new_tumor_event_dx_days_to'])
-
-    row['progressed_time'] = progressed_time
-    row['deceased_time'] = deceased_time
-    row['censor_time'] = censor_time
-    row['progressed'] = progressed
-    row['deceased'] = deceased
-    row['age'] = -1*row['birth_days_to']/365.25
-
-    censor_time = censor_time or 0
-    if np.isnan(censor_time):
-        censor_time = max(progressed_time, deceased_time, censor_time)
-
-    if censor_time > progressed_time:
-        censor_time = progressed_time
-    if censor_time > deceased_time:
-        censor_time = deceased_time
-
-    os = deceased_time if deceased else censor_time
-    pfs = progressed_time if progressed else os
-
-    if np.isnan(os):
-        os = censor_time
-
-    if np.isnan(pfs):
-        pfs = os
-
-    row['pfs'] = pfs
-    row['os'] = os
-    row['censor_time'] = censor_time
+def _max_as_builtin(*arrays):
+    """ Element-wise equivalent of the builtin `max(*values)`, which keeps the first value
+        unless a later one compares greater (so a leading NaN is kept, & later NaNs ignored)
+    """
+    current = arrays[0]
+    for values in arrays[1:]:
+        current = np.where(values > current, values, current)
+    return current
 
-    pfs = min(pfs, os) ## force progressed time to be < os 
 
-    benefit = pfs <= benefit_days
+def _derive_outcomes(clinical_data, benefit_days):
+    """ Compute censoring, OS, PFS, benefit & age for each patient (row) in clinical_data,
+        as whole-column operations. Returns a copy of clinical_data with columns
+        'progressed_time', 'deceased_time', 'censor_time', 'progressed', 'deceased', 'age', 'os'
+        & 'pfs' added, plus '_pfs' & 'benefit' as used for the patient (pfs capped at os).
+    """
+    df = clinical_data.copy()
+    deceased = (df['vital_status'] != 'Alive').values
+    progressed = (df['treatment_outcome_at_tcga_followup'] != 'Complete Response').values
+    censor_time = np.asarray(df['last_contact_days_to'], dtype=float)
+    deceased_time = np.asarray(df['death_days_to'], dtype=float)
+    progressed_time = np.asarray(df['new_tumor_event_dx_days_to'], dtype=float)
+
+    df['progressed_time'] = progressed_time
+    df['deceased_time'] = deceased_time
+    df['progressed'] = progressed
+    df['deceased'] = deceased
+    df['age'] = -1*df['birth_days_to']/365.25
+
+    censor_time = np.where(np.isnan(censor_time),
+                           _max_as_builtin(progressed_time, deceased_time, censor_time),
+                           censor_time)
+    censor_time = np.where(censor_time > progressed_time, progressed_time, censor_time)
+    censor_time = np.where(censor_time > deceased_time, deceased_time, censor_time)
+
+    os = np.where(deceased, deceased_time, censor_time)
+    pfs = np.where(progressed, progressed_time, os)
+    os = np.where(np.isnan(os), censor_time, os)
+    pfs = np.where(np.isnan(pfs), os, pfs)
+
+    df['pfs'] = pfs
+    df['os'] = os
+    df['censor_time'] = censor_time
+
+    pfs = np.where(os < pfs, os, pfs) ## force progressed time to be < os
+    df['_pfs'] = pfs
+    df['benefit'] = pfs <= benefit_days
+    return df
+
+
+def _check_outcomes(outcomes):
+    """ Assert that OS & PFS are known, and PFS <= OS, for all patients
+    """
+    patient_ids = outcomes['case_id'].values
+    pfs = outcomes['_pfs'].values
+    os = outcomes['os'].values
+    assert not np.isnan(pfs).any(), 'PFS is NaN for Patients {}'.format(list(patient_ids[np.isnan(pfs)]))
+    assert not np.isnan(os).any(), 'OS is NaN for Patients {}'.format(list(patient_ids[np.isnan(os)]))
+    invalid = pfs > os
+    assert not invalid.any(), 'PFS is not <= OS for Patients {}'.format(list(patient_ids[invalid]))
+
+
+def build_cohort_patients(clinical_data, benefit_days, **kwargs):
+    """ Build a `cohorts.Patient` for each row of clinical_data.
+        Outcomes are derived for all patients at once (see `_derive_outcomes`).
+    """
+    outcomes = _derive_outcomes(clinical_data, benefit_days=benefit_days)
+    _check_outcomes(outcomes)
+    columns = [column for column in outcomes.columns if column not in ('_pfs', 'benefit')]
+    if 'snv_vcf_paths' in outcomes.columns:
+        snv_vcf_paths = [helpers.convert_to_list(paths) if isinstance(paths, list) else None
+                         for paths in outcomes['snv_vcf_paths']]
+    else:
+        snv_vcf_paths = [None] * len(outcomes.index)
+    records = zip(outcomes['case_id'].values,
+                  outcomes['deceased'].values,
+                  outcomes['progressed'].values,
+                  outcomes['os'].values,
+                  outcomes['_pfs'].values,
+                  outcomes['benefit'].values,
+                  outcomes.loc[:, columns].itertuples(index=False, name=None),
+                  snv_vcf_paths)
+    patients = list()
+    for (patient_id, deceased, progressed, os_days, pfs_days, benefit, row, vcf_paths) in records:
+        patients.append(cohorts.Patient(
+            id=str(patient_id),
+            deceased=bool(deceased),
+            progressed=bool(progressed),
+            os=float(os_days),
+            pfs=float(pfs_days),
+            benefit=bool(benefit),
+            additional_data=dict(zip(columns, row)),
+            snv_vcf_paths=vcf_paths,
+            **kwargs
+        ))
+    return patients
 
-    assert(not np.isnan(pfs))
-    assert(not np.isnan(os))
-    assert pfs <= os, 'PFS {pfs} is not <= OS {os} for Patient {patid}'.format(pfs=pfs, os=os, patid=patient_id)
 
-    # capture snv_vcf_paths, if they exist
-    if 'snv_vcf_paths' in row.keys() and isinstance(row['snv_vcf_paths'], list):
-        snv_vcf_paths = helpers.convert_to_list(row['snv_vcf_paths'])
-    else:
-        snv_vcf_paths = None
-
-    patient = cohorts.Patient(
-        id=str(patient_id),
-        deceased=deceased,
-        progressed=progressed,
-        os=os,
-        pfs=pfs,
-        benefit=benefit,
-        additional_data=row,
-        snv_vcf_paths=snv_vcf_paths,
-        **kwargs
-    )
-    return(patient)
+def build_cohort_patient(row, benefit_days, **kwargs):
+    return build_cohort_patients(pd.DataFrame([row]), benefit_days=benefit_days, **kwargs)[0]
 
 
 def _merge_filepath_with_fileinfo(files):
@@ -129,14 +183,19 @@ def _merge_filepath_with_fileinfo(files):
 
 
 def prep_patients(project_name, data_dir=get_setting_value('GDC_DATA_DIR'), benefit_days=365.25,
-                 include_vcfs=True, project_data_dir='data', cache_dir='data-cache', **kwargs):
+                 include_vcfs=True, project_data_dir='data', cache_dir='data-cache',
+                 refresh_clinical=False, workers=None, **kwargs):
     """ Given a project_name, return a list of cohorts.Patient objects
+
+        Use `refresh_clinical=True` to update saved clinical data with any new or changed files,
+        parsed by up to `workers` processes.
     """
     ## try to load config file, if it exists
     if os.path.exists('config.ini'):
         config.load_config('config.ini')
 
-    clinical_data = _load_clinical_data(project_name=project_name, project_data_dir=project_data_dir, data_dir=data_dir, **kwargs)
+    clinical_data = _load_clinical_data(project_name=project_name, project_data_dir=project_data_dir, data_dir=data_dir,
+                                        refresh=refresh_clinical, workers=workers, **kwargs)
 
     # merge clinical & vcf data
     if include_vcfs:
@@ -147,10 +206,7 @@ def prep_patients(project_name, data_dir=get_setting_value('GDC_DATA_DIR'), bene
     
     assert clinical_data.duplicated('patient_id').any() == False, 'Duplicates by patient_id'
 
-    patients = []
-    for (i, row) in clinical_data.iterrows():
-        patients.append(build_cohort_patient(row, benefit_days=benefit_days))
-    return patients
+    return build_cohort_patients(clinical_data, benefit_days=benefit_days)
 
 
 def prep_cohort(patients, cache_dir='data-cache', **kwargs):
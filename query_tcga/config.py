@@ -19,6 +19,36 @@ __DEFAULTS.VALID_ENDPOINTS = defaults.VALID_ENDPOINTS
 __DEFAULTS.DEFAULT_SIZE = defaults.DEFAULT_SIZE
 __DEFAULTS.DEFAULT_FILE_FIELDS = defaults.DEFAULT_FILE_FIELDS
 __DEFAULTS.DEFAULT_CHUNK_SIZE = defaults.DEFAULT_CHUNK_SIZE
+__DEFAULTS.RATE_LIMIT = defaults.RATE_LIMIT
+__DEFAULTS.RATE_LIMIT_BURST = defaults.RATE_LIMIT_BURST
+__DEFAULTS.MAX_WORKERS = defaults.MAX_WORKERS
+__DEFAULTS.RETRY_CONNECTION_ERRORS = defaults.RETRY_CONNECTION_ERRORS
+__DEFAULTS.RETRY_RATE_LIMITED = defaults.RETRY_RATE_LIMITED
+__DEFAULTS.RETRY_SERVER_ERRORS = defaults.RETRY_SERVER_ERRORS
+__DEFAULTS.RETRY_BACKOFF = defaults.RETRY_BACKOFF
+__DEFAULTS.RETRY_MAX_BACKOFF = defaults.RETRY_MAX_BACKOFF
+__DEFAULTS.MAX_PAGE_SIZE = defaults.MAX_PAGE_SIZE
+__DEFAULTS.POST_THRESHOLD = defaults.POST_THRESHOLD
+__DEFAULTS.USE_METADATA_STORE = defaults.USE_METADATA_STORE
+__DEFAULTS.METADATA_STORE_PATH = defaults.METADATA_STORE_PATH
+__DEFAULTS.METADATA_TTL = defaults.METADATA_TTL
+__DEFAULTS.CACHE_FORMAT = defaults.CACHE_FORMAT
+__DEFAULTS.CACHE_PATH = defaults.CACHE_PATH
+__DEFAULTS.CACHE_BACKEND = defaults.CACHE_BACKEND
+__DEFAULTS.CACHE_MAX_ENTRIES = defaults.CACHE_MAX_ENTRIES
+__DEFAULTS.CACHE_TTLS = defaults.CACHE_TTLS
+__DEFAULTS.SCHEMA_TTL = defaults.SCHEMA_TTL
+__DEFAULTS.VERIFY_WORKERS = defaults.VERIFY_WORKERS
+__DEFAULTS.VERIFY_CHECK = defaults.VERIFY_CHECK
+__DEFAULTS.HASH_WORKERS = defaults.HASH_WORKERS
+__DEFAULTS.VERIFY_CACHE_PATH = defaults.VERIFY_CACHE_PATH
+__DEFAULTS.DOWNLOAD_CLIENT = defaults.DOWNLOAD_CLIENT
+__DEFAULTS.DOWNLOAD_WORKERS = defaults.DOWNLOAD_WORKERS
+__DEFAULTS.SEGMENT_THRESHOLD = defaults.SEGMENT_THRESHOLD
+__DEFAULTS.SEGMENT_SIZE = defaults.SEGMENT_SIZE
+__DEFAULTS.SEGMENT_WORKERS = defaults.SEGMENT_WORKERS
+__DEFAULTS.DOWNLOAD_BANDWIDTH = defaults.DOWNLOAD_BANDWIDTH
+__DEFAULTS.DISK_SPACE_RESERVE = defaults.DISK_SPACE_RESERVE
 
 
 REQUIRED_SETTINGS = ['GDC_TOKEN_PATH']
@@ -36,6 +66,36 @@ def restore_default_settings():
     __DEFAULTS.DEFAULT_SIZE = defaults.DEFAULT_SIZE
     __DEFAULTS.DEFAULT_FILE_FIELDS = defaults.DEFAULT_FILE_FIELDS
     __DEFAULTS.DEFAULT_CHUNK_SIZE = defaults.DEFAULT_CHUNK_SIZE
+    __DEFAULTS.RATE_LIMIT = defaults.RATE_LIMIT
+    __DEFAULTS.RATE_LIMIT_BURST = defaults.RATE_LIMIT_BURST
+    __DEFAULTS.MAX_WORKERS = defaults.MAX_WORKERS
+    __DEFAULTS.RETRY_CONNECTION_ERRORS = defaults.RETRY_CONNECTION_ERRORS
+    __DEFAULTS.RETRY_RATE_LIMITED = defaults.RETRY_RATE_LIMITED
+    __DEFAULTS.RETRY_SERVER_ERRORS = defaults.RETRY_SERVER_ERRORS
+    __DEFAULTS.RETRY_BACKOFF = defaults.RETRY_BACKOFF
+    __DEFAULTS.RETRY_MAX_BACKOFF = defaults.RETRY_MAX_BACKOFF
+    __DEFAULTS.MAX_PAGE_SIZE = defaults.MAX_PAGE_SIZE
+    __DEFAULTS.POST_THRESHOLD = defaults.POST_THRESHOLD
+    __DEFAULTS.USE_METADATA_STORE = defaults.USE_METADATA_STORE
+    __DEFAULTS.METADATA_STORE_PATH = defaults.METADATA_STORE_PATH
+    __DEFAULTS.METADATA_TTL = defaults.METADATA_TTL
+    __DEFAULTS.CACHE_FORMAT = defaults.CACHE_FORMAT
+    __DEFAULTS.CACHE_PATH = defaults.CACHE_PATH
+    __DEFAULTS.CACHE_BACKEND = defaults.CACHE_BACKEND
+    __DEFAULTS.CACHE_MAX_ENTRIES = defaults.CACHE_MAX_ENTRIES
+    __DEFAULTS.CACHE_TTLS = defaults.CACHE_TTLS
+    __DEFAULTS.SCHEMA_TTL = defaults.SCHEMA_TTL
+    __DEFAULTS.VERIFY_WORKERS = defaults.VERIFY_WORKERS
+    __DEFAULTS.VERIFY_CHECK = defaults.VERIFY_CHECK
+    __DEFAULTS.HASH_WORKERS = defaults.HASH_WORKERS
+    __DEFAULTS.VERIFY_CACHE_PATH = defaults.VERIFY_CACHE_PATH
+    __DEFAULTS.DOWNLOAD_CLIENT = defaults.DOWNLOAD_CLIENT
+    __DEFAULTS.DOWNLOAD_WORKERS = defaults.DOWNLOAD_WORKERS
+    __DEFAULTS.SEGMENT_THRESHOLD = defaults.SEGMENT_THRESHOLD
+    __DEFAULTS.SEGMENT_SIZE = defaults.SEGMENT_SIZE
+    __DEFAULTS.SEGMENT_WORKERS = defaults.SEGMENT_WORKERS
+    __DEFAULTS.DOWNLOAD_BANDWIDTH = defaults.DOWNLOAD_BANDWIDTH
+    __DEFAULTS.DISK_SPACE_RESERVE = defaults.DISK_SPACE_RESERVE
     logging.info('Settings reverted to their default values.')
 
 
@@ -24,4 +24,66 @@ VALID_ENDPOINTS = ['files', 'projects', 'cases', 'annotations']
 DEFAULT_SIZE = 10
 # fields to pull for 'file-metadata' table
 DEFAULT_FILE_FIELDS=['file_id','file_name','cases.submitter_id','cases.case_id','data_category','data_type','cases.samples.tumor_descriptor','cases.samples.tissue_type','cases.samples.sample_type','cases.samples.submitter_id','cases.samples.sample_id', 'analysis.analysis_id', 'files.analysis.workflow_type']
-DEFAULT_CHUNK_SIZE=30
+# number of file ids to look up per request
+DEFAULT_CHUNK_SIZE=2000
+# maximum sustained rate of requests to the GDC api (requests per second)
+RATE_LIMIT=2
+# number of requests that may be issued back-to-back before RATE_LIMIT applies
+RATE_LIMIT_BURST=5
+# number of pages/chunks to fetch concurrently (1 fetches serially)
+MAX_WORKERS=4
+# max number of times to retry a request to the GDC api after a connection error (e.g. reset, timeout)
+RETRY_CONNECTION_ERRORS=3
+# max number of times to retry a request answered with 429 (Too Many Requests)
+RETRY_RATE_LIMITED=5
+# max number of times to retry a request answered with a 5xx server error
+RETRY_SERVER_ERRORS=3
+# base delay (seconds) before retrying a request; doubles with each attempt, with random jitter
+RETRY_BACKOFF=1
+# longest delay (seconds) before retrying a request, unless the server asks for longer (Retry-After)
+RETRY_MAX_BACKOFF=60
+# largest number of records to request per page of a manifest
+MAX_PAGE_SIZE=10000
+# queries with an encoded filter longer than this many characters are sent as a POST
+POST_THRESHOLD=2000
+# whether to keep a local store of metadata fetched for files & cases
+USE_METADATA_STORE=True
+# location of metadata store (default: metadata.sqlite in GDC_DATA_DIR)
+METADATA_STORE_PATH=None
+# seconds after which stored metadata is checked against updated_datetime on the server
+METADATA_TTL=7*24*60*60
+# format of tables saved by cohort in project_data_dir: 'parquet', 'feather' or 'csv'
+CACHE_FORMAT='parquet'
+# location of http cache of GDC api responses (default: http_cache in GDC_DATA_DIR)
+CACHE_PATH=None
+# requests_cache backend for the http cache (e.g. 'sqlite', 'filesystem', 'memory')
+CACHE_BACKEND='sqlite'
+# max number of responses kept in the http cache; least recently used are evicted first
+CACHE_MAX_ENTRIES=10000
+# seconds to keep cached responses, by endpoint ('_mapping' for field listings of any endpoint; 'default' for others)
+# None keeps responses until evicted, 0 disables caching. Manifests & counts (size=0) are never cached
+CACHE_TTLS={'_mapping': 7*24*60*60, 'files': 6*60*60, 'cases': 6*60*60, 'default': 5*60*60}
+# seconds to keep valid fields & field values (used to verify queries) in memory
+SCHEMA_TTL=24*60*60
+# number of threads listing download directories when verifying downloads (more can help on network filesystems)
+VERIFY_WORKERS=1
+# how downloaded files are checked against the manifest: 'exists', 'size' or 'md5' (size, then md5)
+VERIFY_CHECK='size'
+# number of threads hashing downloaded files when VERIFY_CHECK is 'md5' (default: number of cpus)
+HASH_WORKERS=None
+# location of store of md5s of downloaded files, by path, size & mtime (default: verified.sqlite in GDC_DATA_DIR)
+VERIFY_CACHE_PATH=None
+# program used to download files: 'gdc-client' (at GDC_CLIENT_PATH) or 'native' (streams files from the data endpoint)
+DOWNLOAD_CLIENT='gdc-client'
+# number of files downloaded at once, when DOWNLOAD_CLIENT is 'native'
+DOWNLOAD_WORKERS=4
+# files of at least this many bytes are downloaded in segments, when DOWNLOAD_CLIENT is 'native' (None: never)
+SEGMENT_THRESHOLD=1024*1024*1024
+# bytes per segment of a segmented download
+SEGMENT_SIZE=256*1024*1024
+# number of segments of a file downloaded at once
+SEGMENT_WORKERS=4
+# max bytes per second downloaded by all files together, when DOWNLOAD_CLIENT is 'native' (None: no limit)
+DOWNLOAD_BANDWIDTH=None
+# bytes to keep free on the disk holding data_dir; downloads needing more space are not started
+DISK_SPACE_RESERVE=1024*1024*1024
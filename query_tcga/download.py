@@ -0,0 +1,537 @@
+from __future__ import absolute_import
+import os
+import json
+import shutil
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from .config import get_setting_value
+from . import cache
+from . import integrity
+
+#### ---- download files from the GDC `data` endpoint ----
+## An alternative to gdc-client (see setting `DOWNLOAD_CLIENT`). Files are streamed
+## to data_dir/<file_id>/<filename>.partial & renamed once complete, so an interrupted
+## download is resumed (with an http Range request) from the bytes already on disk,
+## whether retrying within a run or in a later one. Each file is retried on its own
+## (see `cache.RetryPolicy`), & up to `DOWNLOAD_WORKERS` files are streamed at once.
+##
+## Files of at least `SEGMENT_THRESHOLD` bytes (e.g. BAMs) are instead split into segments
+## of `SEGMENT_SIZE` bytes, fetched with up to `SEGMENT_WORKERS` range requests at once &
+## written in place (with `pwrite`) into a preallocated .partial file. Bytes received for
+## each segment are recorded in a sidecar .state file, from which an interrupted download
+## is resumed. The completed file is checked against the md5 in the manifest.
+##
+## `download_manifest` schedules files by size: large files are started first, one per
+## worker, & small files are packed into batches of about `PACK_BYTES`, so that workers
+## finish at about the same time. Bytes received count against a bandwidth cap shared
+## by all workers (setting `DOWNLOAD_BANDWIDTH`), & progress is logged with an ETA.
+
+## bytes read from a response at a time (a chunk cut short by a broken connection is discarded)
+CHUNK_SIZE = 1024*1024
+
+## seconds to wait to connect, & between bytes received
+TIMEOUT = (30, 300)
+
+PARTIAL_SUFFIX = '.partial'
+STATE_SUFFIX = '.state'
+
+## seconds between saves of the state of a segmented download
+STATE_INTERVAL = 1
+
+## small files are downloaded in batches of about this many bytes
+PACK_BYTES = 64*1024*1024
+
+## seconds between progress reports
+PROGRESS_INTERVAL = 10
+
+
+class DownloadError(Exception):
+    pass
+
+
+class RangeNotSupported(DownloadError):
+    pass
+
+
+def data_url(file_id):
+    return get_setting_value('GDC_API_ENDPOINT').format(endpoint='data') + '/' + file_id
+
+
+def auth_headers():
+    """ Header giving the token at setting `GDC_TOKEN_PATH`, if any (needed for controlled-access files)
+    """
+    try:
+        token_path = get_setting_value('GDC_TOKEN_PATH')
+    except ValueError:
+        return {}
+    if not token_path or not os.path.exists(token_path):
+        return {}
+    with open(token_path) as f:
+        return {'X-Auth-Token': f.read().strip()}
+
+
+def make_session(max_connections):
+    """ Session (without http cache) keeping up to `max_connections` connections open
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=int(max_connections))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def file_path(data_dir, file_id, filename):
+    return os.path.join(data_dir, file_id, filename)
+
+
+def _partial_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, IOError):
+        return 0
+
+
+def _stream_to_file(response, path, append, progress=None):
+    with open(path, 'ab' if append else 'wb') as f:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            f.write(chunk)
+            if progress:
+                progress(len(chunk))
+
+
+def download_file(file_id, filename, data_dir, size=None, session=None, headers=None,
+                  policy=None, progress=None, sleep=time.sleep):
+    """ Download file `file_id` to data_dir/<file_id>/<filename>, resuming from a partial
+        download if there is one. Returns the path to the file.
+
+        `size` (if known, e.g. from the manifest) is used to check the download is complete.
+        `progress` is called with the number of bytes received as they are written.
+        Requests are subject to the shared rate limit & retried according to `policy`
+        (default: a new `cache.RetryPolicy`), resuming from the bytes received so far.
+    """
+    session = session or make_session(1)
+    policy = policy or cache.RetryPolicy()
+    path = file_path(data_dir, file_id, filename)
+    partial = path + PARTIAL_SUFFIX
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    size = int(size) if size is not None else None
+    while True:
+        offset = _partial_size(partial)
+        request_headers = dict(headers if headers is not None else auth_headers())
+        if offset and (size is None or offset < size):
+            request_headers['Range'] = 'bytes={}-'.format(offset)
+        try:
+            if size is None or offset < size:
+                cache.get_rate_limiter().acquire()
+                response = session.get(data_url(file_id), headers=request_headers, stream=True, timeout=TIMEOUT)
+                try:
+                    if response.status_code == 416:
+                        ## partial file is not a prefix of this file; start again
+                        logging.warning('Cannot resume download of {}; starting again'.format(path))
+                        os.remove(partial)
+                        continue
+                    wait = policy.next_wait(response=response)
+                    if wait is not None:
+                        sleep(wait)
+                        continue
+                    response.raise_for_status()
+                    if offset and response.status_code != 206:
+                        logging.debug('Server ignored range request for {}; starting again'.format(path))
+                    _stream_to_file(response, partial, append=response.status_code == 206, progress=progress)
+                finally:
+                    response.close()
+            received = _partial_size(partial)
+            if size is not None and received < size:
+                raise requests.ConnectionError('Received {} of {} bytes'.format(received, size))
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            wait = policy.next_wait(error=requests.ConnectionError(e))
+            if wait is None:
+                raise
+            sleep(wait)
+            continue
+        if size is not None and received > size:
+            os.remove(partial)
+            raise DownloadError('Received {} bytes for {}; expected {}'.format(received, path, size))
+        os.rename(partial, path)
+        return path
+
+
+def _pwrite(fd, data, offset, lock):
+    if hasattr(os, 'pwrite'):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+        return
+    with lock: # no pwrite (e.g. on Windows)
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+
+def _preallocate(path, size):
+    with open(path, 'wb') as f:
+        if hasattr(os, 'posix_fallocate') and size > 0:
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError: # not supported by this filesystem
+                pass
+        f.truncate(size)
+
+
+class SegmentedDownload(object):
+    """ State of a download of `size` bytes split into segments of `segment_size` bytes,
+        recording the bytes received so far for each segment (keyed by its start)
+        in a sidecar file at `state_path`.
+    """
+    def __init__(self, state_path, size, segment_size):
+        self.state_path = state_path
+        self.size = int(size)
+        self.segment_size = int(segment_size)
+        self.received = dict((start, 0) for start in range(0, self.size, self.segment_size))
+        self._lock = threading.Lock()
+        self._saved_at = 0
+
+    @classmethod
+    def load(cls, state_path, size, segment_size):
+        """ Resume the download recorded at `state_path`, if it was for the same size & segments.
+            Returns None otherwise.
+        """
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if (state.get('size'), state.get('segment_size')) != (int(size), int(segment_size)):
+            return None
+        download = cls(state_path, size, segment_size)
+        download.received.update((int(start), int(n)) for (start, n) in state['received'].items())
+        return download
+
+    def segment_end(self, start):
+        return min(start + self.segment_size, self.size)
+
+    def pending(self):
+        """ Starts of segments not yet fully received
+        """
+        with self._lock:
+            return [start for (start, n) in sorted(self.received.items())
+                    if start + n < self.segment_end(start)]
+
+    def add(self, start, n):
+        """ Record `n` more bytes received for the segment starting at `start`
+        """
+        with self._lock:
+            self.received[start] += n
+            if time.time() - self._saved_at < STATE_INTERVAL:
+                return
+        self.save()
+
+    def save(self):
+        with self._lock:
+            state = {'size': self.size, 'segment_size': self.segment_size,
+                     'received': dict((str(start), n) for (start, n) in self.received.items())}
+            self._saved_at = time.time()
+            with open(self.state_path + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.rename(self.state_path + '.tmp', self.state_path)
+
+
+def _download_segment(url, fd, download, start, end, session, headers, progress, sleep, lock):
+    """ Fetch bytes [start, end) of the segment starting at `start` (resuming it if
+        partly received) & write them in place, retrying according to a new `cache.RetryPolicy`
+    """
+    policy = cache.RetryPolicy()
+    while True:
+        received = download.received[start]
+        offset = start + received
+        if offset >= end:
+            return
+        request_headers = dict(headers)
+        request_headers['Range'] = 'bytes={}-{}'.format(offset, end - 1)
+        try:
+            cache.get_rate_limiter().acquire()
+            response = session.get(url, headers=request_headers, stream=True, timeout=TIMEOUT)
+            try:
+                wait = policy.next_wait(response=response)
+                if wait is not None:
+                    sleep(wait)
+                    continue
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise RangeNotSupported('Server ignored range request for {}'.format(url))
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    chunk = chunk[:end - offset]
+                    _pwrite(fd, chunk, offset, lock)
+                    offset += len(chunk)
+                    download.add(start, len(chunk))
+                    if progress:
+                        progress(len(chunk))
+            finally:
+                response.close()
+            if offset < end:
+                raise requests.ConnectionError('Received {} of {} bytes'.format(offset - start, end - start))
+            return
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            wait = policy.next_wait(error=requests.ConnectionError(e))
+            if wait is None:
+                raise
+            sleep(wait)
+
+
+def download_file_segmented(file_id, filename, data_dir, size, md5=None, session=None, headers=None,
+                            segment_size=None, max_workers=None, progress=None, sleep=time.sleep):
+    """ Download file `file_id` of `size` bytes to data_dir/<file_id>/<filename>, in segments of
+        `segment_size` bytes (default: setting `SEGMENT_SIZE`) fetched from up to `max_workers`
+        (default: setting `SEGMENT_WORKERS`) threads at once, resuming an interrupted download
+        from its .state file. The file is checked against `md5`, if given. Returns the path to the file.
+
+        Falls back to `download_file` if the server does not support range requests.
+    """
+    size = int(size)
+    segment_size = int(segment_size or get_setting_value('SEGMENT_SIZE'))
+    max_workers = int(max_workers or get_setting_value('SEGMENT_WORKERS'))
+    session = session or make_session(max_workers)
+    headers = dict(headers if headers is not None else auth_headers())
+    path = file_path(data_dir, file_id, filename)
+    partial = path + PARTIAL_SUFFIX
+    state_path = path + STATE_SUFFIX
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    download = None
+    if os.path.exists(partial) and _partial_size(partial) == size:
+        download = SegmentedDownload.load(state_path, size=size, segment_size=segment_size)
+    if download is None:
+        _preallocate(partial, size)
+        download = SegmentedDownload(state_path, size=size, segment_size=segment_size)
+        download.save()
+    pending = download.pending()
+    logging.debug('Downloading {} of {} segments of {}'.format(len(pending), len(download.received), path))
+
+    url = data_url(file_id)
+    lock = threading.Lock()
+    fd = os.open(partial, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+                futures = [executor.submit(_download_segment, url, fd, download, start, download.segment_end(start),
+                                           session=session, headers=headers, progress=progress,
+                                           sleep=sleep, lock=lock)
+                           for start in pending]
+                for future in futures:
+                    future.result()
+        finally:
+            os.close(fd)
+            download.save()
+    except RangeNotSupported:
+        logging.warning('Server does not support range requests; downloading {} in one stream'.format(path))
+        for stale in (partial, state_path):
+            os.remove(stale)
+        return download_file(file_id, filename, data_dir=data_dir, size=size, session=session,
+                             headers=headers, progress=progress, sleep=sleep)
+
+    if md5:
+        digest = integrity.file_md5(partial)
+        if digest != md5:
+            for stale in (partial, state_path):
+                os.remove(stale)
+            raise DownloadError('md5 of {} is {}; expected {}'.format(path, digest, md5))
+    os.rename(partial, path)
+    os.remove(state_path)
+    if md5:
+        ## record the md5, so that verifying the download does not hash the file again
+        stat = os.stat(path)
+        integrity.get_hash_store().put([(os.path.abspath(path), stat.st_size, stat.st_mtime, md5)])
+    return path
+
+
+def _segment_threshold():
+    threshold = get_setting_value('SEGMENT_THRESHOLD')
+    return int(threshold) if threshold not in (None, 'None', '') else None
+
+
+def schedule(rows, max_workers=1, pack_bytes=PACK_BYTES):
+    """ Order `rows` (tuples whose 3rd item is the file size, or None) for download by
+        `max_workers` workers: returns list of batches, each a list of indices into `rows`,
+        largest batch first. Files of at least `pack_bytes` are a batch of their own; smaller
+        files are packed, smallest first, into batches of up to `pack_bytes` bytes (or less,
+        so that there are batches for each worker).
+
+    >>> schedule([('a', 'a.xml', 10), ('b', 'b.bam', 10**9), ('c', 'c.xml', 20)], pack_bytes=100)
+    [[1], [0, 2]]
+    """
+    sizes = [int(row[2]) if row[2] is not None else 0 for row in rows]
+    batches = [[i] for i in range(len(rows)) if sizes[i] >= pack_bytes]
+    small = sorted((i for i in range(len(rows)) if sizes[i] < pack_bytes), key=lambda i: sizes[i])
+    pack_bytes = min(pack_bytes, -(-sum(sizes[i] for i in small) // max(1, max_workers)))
+    batch = list()
+    batch_bytes = 0
+    for i in small:
+        ## files of unknown size (if all are) are not packed
+        if batch and (batch_bytes + sizes[i] > pack_bytes or not pack_bytes):
+            batches.append(batch)
+            batch = list()
+            batch_bytes = 0
+        batch.append(i)
+        batch_bytes += sizes[i]
+    if batch:
+        batches.append(batch)
+    return sorted(batches, key=lambda batch: -sum(sizes[i] for i in batch))
+
+
+class DownloadProgress(object):
+    """ Thread-safe count of bytes & files downloaded, out of `total_bytes` & `total_files`,
+        logging throughput & an estimate of the time remaining every `interval` seconds.
+    """
+    def __init__(self, total_bytes, total_files, interval=PROGRESS_INTERVAL, clock=cache._monotonic):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.interval = interval
+        self.received = 0
+        self.files = 0
+        self._clock = clock
+        self._started = clock()
+        self._reported = self._started
+        self._lock = threading.Lock()
+
+    def add(self, n_bytes=0, n_files=0):
+        with self._lock:
+            self.received += n_bytes
+            self.files += n_files
+            now = self._clock()
+            if now - self._reported < self.interval:
+                return
+            self._reported = now
+        logging.info(self.report())
+
+    def throughput(self):
+        """ Bytes received per second
+        """
+        elapsed = self._clock() - self._started
+        return self.received / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """ Estimated seconds until all bytes are received, or None if unknown
+        """
+        throughput = self.throughput()
+        if not throughput:
+            return None
+        return max(0, self.total_bytes - self.received) / throughput
+
+    def report(self):
+        eta = self.eta()
+        return 'Downloaded {:.1f} of {:.1f} MB ({} of {} files) at {:.2f} MB/s; {} remaining'.format(
+            self.received / 1e6, self.total_bytes / 1e6, self.files, self.total_files,
+            self.throughput() / 1e6, 'unknown time' if eta is None else '{:.0f}s'.format(eta))
+
+
+def get_bandwidth_limiter():
+    """ Token bucket limiting bytes downloaded per second to setting `DOWNLOAD_BANDWIDTH`, or None
+    """
+    bandwidth = get_setting_value('DOWNLOAD_BANDWIDTH')
+    if bandwidth in (None, 'None', ''):
+        return None
+    return cache.TokenBucket(rate=float(bandwidth), burst=float(bandwidth))
+
+
+def _remaining_bytes(data_dir, rows):
+    """ Bytes needed on disk to complete downloads of `rows`, allowing for partial downloads
+    """
+    needed = 0
+    for (file_id, filename, size) in (row[:3] for row in rows):
+        if size is not None:
+            needed += max(0, int(size) - _partial_size(file_path(data_dir, file_id, filename) + PARTIAL_SUFFIX))
+    return needed
+
+
+def check_disk_space(data_dir, rows):
+    """ Raise `DownloadError` if downloading `rows` would leave less than
+        setting `DISK_SPACE_RESERVE` bytes free on the filesystem holding data_dir
+    """
+    needed = _remaining_bytes(data_dir, rows)
+    reserve = int(get_setting_value('DISK_SPACE_RESERVE') or 0)
+    free = shutil.disk_usage(data_dir).free
+    if needed + reserve > free:
+        raise DownloadError('Not enough disk space in {}: downloads need {:.1f} MB, {:.1f} MB are free '
+                            '& {:.1f} MB are to be kept free (setting DISK_SPACE_RESERVE)'.format(
+                                data_dir, needed / 1e6, free / 1e6, reserve / 1e6))
+    return needed
+
+
+def download_manifest(manifest_data, data_dir, max_workers=None, progress=None):
+    """ Download files listed in `manifest_data` (a manifest, as a pandas.DataFrame) to data_dir,
+        streaming up to `max_workers` (default: setting `DOWNLOAD_WORKERS`) files at once.
+        Files of at least `SEGMENT_THRESHOLD` bytes are downloaded in segments (see `download_file_segmented`).
+
+        Files are scheduled by size (see `schedule`), subject to a bandwidth cap (setting
+        `DOWNLOAD_BANDWIDTH`), after checking there is enough disk space for them (see `check_disk_space`).
+        `progress` is called with the number of bytes received as they are written.
+
+        Returns list of paths to files downloaded, in manifest order. Files which could
+        not be downloaded are logged & left out (with any partial download kept, to resume later).
+    """
+    if not max_workers:
+        max_workers = int(get_setting_value('DOWNLOAD_WORKERS'))
+    n_rows = len(manifest_data.index)
+    rows = list(zip(manifest_data['id'], manifest_data['filename'],
+                    manifest_data['size'] if 'size' in manifest_data.columns else [None]*n_rows,
+                    manifest_data['md5'] if 'md5' in manifest_data.columns else [None]*n_rows))
+    if not rows:
+        return list()
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    needed = check_disk_space(data_dir, rows)
+    batches = schedule(rows, max_workers=max_workers)
+    max_workers = max(1, min(max_workers, len(batches)))
+    threshold = _segment_threshold()
+    segment_workers = int(get_setting_value('SEGMENT_WORKERS'))
+    session = make_session(max_workers * max(1, segment_workers))
+    headers = auth_headers()
+    bandwidth = get_bandwidth_limiter()
+    tracker = DownloadProgress(total_bytes=needed, total_files=len(rows))
+    paths = [None] * len(rows)
+
+    def _received(n_bytes):
+        if bandwidth is not None:
+            bandwidth.acquire(n_bytes)
+        tracker.add(n_bytes=n_bytes)
+        if progress:
+            progress(n_bytes)
+
+    def _download(i):
+        (file_id, filename, size, md5) = rows[i]
+        started = time.time()
+        try:
+            if threshold is not None and size is not None and int(size) >= threshold:
+                path = download_file_segmented(file_id, filename, data_dir=data_dir, size=size, md5=md5,
+                                               session=session, headers=headers, progress=_received)
+            else:
+                path = download_file(file_id, filename, data_dir=data_dir, size=size, session=session,
+                                     headers=headers, progress=_received)
+        except Exception as e:
+            logging.warning('Failed to download {}: {}'.format(file_id, e))
+            return
+        paths[i] = path
+        tracker.add(n_files=1)
+        logging.debug('Downloaded {} in {:.1f}s'.format(path, time.time() - started))
+
+    def _download_batch(batch):
+        for i in batch:
+            _download(i)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(_download_batch, batches))
+    finally:
+        session.close()
+    logging.info(tracker.report())
+    failed = len([path for path in paths if path is None])
+    if failed:
+        logging.warning('{} of {} files could not be downloaded'.format(failed, len(rows)))
+    return [path for path in paths if path is not None]
@@ -1,13 +1,19 @@
 from __future__ import absolute_import
 from .log_with import log_with
+from .config import get_setting_value
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import os 
 
 @log_with()
 def compute_start_given_page(page, size):
-    """ compute start / from position given page & size
+    """ compute start / from position given page & size.
+        Pages are numbered from 0, as is the GDC `from` parameter.
+
+    >>> compute_start_given_page(page=2, size=10)
+    20
     """
-    return (int(page)*int(size)+1)
+    return (int(page)*int(size))
 
 @log_with()
 def convert_to_list(x):
@@ -39,3 +45,17 @@ def convert_to_list(x):
 def convert_to_file_id(file_paths):
     ## merge in file_source to get meta-data for the file
     return [os.path.split(os.path.dirname(f))[1] for f in convert_to_list(file_paths)]
+
+
+def map_concurrently(func, items, max_workers=None):
+    """ Same as `[func(item) for item in items]`, but with calls made from
+        up to `max_workers` threads (default: setting `MAX_WORKERS`).
+        Results are returned in the order of `items`.
+    """
+    items = list(items)
+    if not max_workers:
+        max_workers = int(get_setting_value('MAX_WORKERS'))
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(func, items))
@@ -0,0 +1,185 @@
+from __future__ import absolute_import
+import contextlib
+import hashlib
+import mmap
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from .config import get_setting_value
+from .helpers import map_concurrently
+
+#### ---- integrity checks of downloaded files ----
+## Files are checked against the size & md5 given in the manifest. The size is checked
+## first, since it only needs a stat; files of the expected size are then hashed, reading
+## each file in memory-mapped chunks from a pool of threads (hashlib releases the GIL
+## while hashing, so threads hash in parallel). Computed md5s are kept in a local store,
+## keyed by path, size & mtime, so a file is only hashed again once it has changed.
+
+## modes of checking downloaded files, in increasing order of cost
+CHECKS = ['exists', 'size', 'md5']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    md5 TEXT NOT NULL,
+    hashed_at REAL NOT NULL
+);
+"""
+
+## files are hashed this many bytes at a time
+CHUNK_SIZE = 16*1024*1024
+
+
+def file_md5(path, chunk_size=CHUNK_SIZE):
+    """ md5 (hex digest) of the file at `path`, read in memory-mapped chunks of `chunk_size` bytes
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            ## empty files cannot be memory-mapped
+            return md5.hexdigest()
+        with contextlib.closing(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) as data:
+            view = memoryview(data)
+            try:
+                for start in range(0, len(data), chunk_size):
+                    md5.update(view[start:start+chunk_size])
+            finally:
+                view.release()
+    return md5.hexdigest()
+
+
+class HashStore(object):
+    """ SQLite-backed store of md5s computed for local files, keyed by path.
+        A stored md5 is only returned while the file keeps the size & mtime it had when hashed.
+
+    >>> store = HashStore('verified.sqlite')
+    >>> store.put([('/data/f1/a.xml', 1024, 1476700000.0, 'd41d8cd9...')])
+    >>> store.get([('/data/f1/a.xml', 1024, 1476700000.0)])
+    {'/data/f1/a.xml': 'd41d8cd9...'}
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        dir_name = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, files):
+        """ Look up md5s for `files`, a list of (path, size, mtime).
+            Returns dict of path -> md5, for files hashed with the same size & mtime.
+        """
+        found = dict()
+        with self._lock, self._connect() as conn:
+            for (path, size, mtime) in files:
+                row = conn.execute('SELECT md5 FROM hashes WHERE path = ? AND size = ? AND mtime = ?',
+                                   (path, size, mtime)).fetchone()
+                if row:
+                    found[path] = row[0]
+        return found
+
+    def put(self, hashes):
+        """ Record `hashes`, a list of (path, size, mtime, md5)
+        """
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)',
+                             [(path, size, mtime, md5, now) for (path, size, mtime, md5) in hashes])
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute('DELETE FROM hashes')
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+def get_hash_store():
+    """ Return the store of md5s at setting `VERIFY_CACHE_PATH` (default: verified.sqlite in `GDC_DATA_DIR`)
+    """
+    global _STORE
+    path = get_setting_value('VERIFY_CACHE_PATH')
+    if not path:
+        path = os.path.join(get_setting_value('GDC_DATA_DIR'), 'verified.sqlite')
+    with _STORE_LOCK:
+        if _STORE is None or _STORE.path != path:
+            logging.debug('Using store of verified md5s at {}'.format(path))
+            _STORE = HashStore(path=path)
+        return _STORE
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except (OSError, IOError):
+        return None
+    return (stat.st_size, stat.st_mtime)
+
+
+def file_md5s(paths, stats=None, store=None):
+    """ md5 of each file in `paths`, as a list in the same order.
+
+        md5s are looked up in (& added to) `store` (default: `get_hash_store()`), by path, size
+        & mtime (given in `stats`, as (size, mtime) for each path, or read from the files),
+        & files missing from the store are hashed from up to setting `HASH_WORKERS` threads
+        (default: number of cpus).
+    """
+    paths = [os.path.abspath(path) for path in paths]
+    if stats is None:
+        stats = [_stat(path) for path in paths]
+    store = store or get_hash_store()
+    files = [(path,) + tuple(stat) for (path, stat) in zip(paths, stats)]
+    found = store.get(files)
+    missing = [f for f in files if f[0] not in found]
+    if missing:
+        logging.info('Hashing {n} of {total} files'.format(n=len(missing), total=len(files)))
+        hash_workers = get_setting_value('HASH_WORKERS')
+        hash_workers = int(hash_workers) if hash_workers else multiprocessing.cpu_count()
+        with ThreadPoolExecutor(max_workers=max(1, min(hash_workers, len(missing)))) as executor:
+            computed = list(executor.map(file_md5, [f[0] for f in missing]))
+        store.put([f + (md5,) for (f, md5) in zip(missing, computed)])
+        found.update((f[0], md5) for (f, md5) in zip(missing, computed))
+    return [found[path] for path in paths]
+
+
+def check_files(paths, sizes, md5s=None, check='size', max_workers=None, store=None):
+    """ Check that each file in `paths` has the expected size (from `sizes`) and, if `check='md5'`,
+        the expected md5 (from `md5s`). Returns list of booleans, in the order of `paths`.
+
+        Files are stat-ed from up to `max_workers` threads (default: setting `VERIFY_WORKERS`)
+        & hashed as described in `file_md5s`.
+    """
+    if check not in CHECKS:
+        raise ValueError('Unknown check {}. Use one of: {}'.format(check, ', '.join(CHECKS)))
+    paths = list(paths)
+    if check == 'exists':
+        return [os.path.exists(path) for path in paths]
+    if not max_workers:
+        max_workers = int(get_setting_value('VERIFY_WORKERS'))
+    stats = map_concurrently(_stat, paths, max_workers=max_workers)
+    ok = [stat is not None and stat[0] == int(size) for (stat, size) in zip(stats, sizes)]
+    if check == 'size':
+        return ok
+
+    to_hash = [i for i in range(len(paths)) if ok[i]]
+    computed = file_md5s([paths[i] for i in to_hash], stats=[stats[i] for i in to_hash], store=store)
+    md5s = list(md5s)
+    for (i, md5) in zip(to_hash, computed):
+        ok[i] = md5 == md5s[i]
+    return ok
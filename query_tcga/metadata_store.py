@@ -0,0 +1,277 @@
+from __future__ import absolute_import
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from .config import get_setting_value
+
+#### ---- local store of metadata (e.g. fileinfo) fetched from the GDC api ----
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    endpoint TEXT NOT NULL,
+    id TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_datetime TEXT,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (endpoint, id, fields)
+);
+CREATE TABLE IF NOT EXISTS links (
+    endpoint TEXT NOT NULL,
+    id TEXT NOT NULL,
+    case_id TEXT,
+    sample_id TEXT
+);
+CREATE INDEX IF NOT EXISTS links_id ON links (endpoint, id);
+CREATE INDEX IF NOT EXISTS links_case_id ON links (case_id);
+CREATE INDEX IF NOT EXISTS links_sample_id ON links (sample_id);
+"""
+
+## max number of ids per `IN (...)` clause, below sqlite's limit on variables
+_MAX_VARIABLES = 500
+
+
+def _fields_key(fields):
+    if not fields:
+        return ''
+    return ','.join(sorted(set(fields)))
+
+
+def _chunks(items, size=_MAX_VARIABLES):
+    for x in range(0, len(items), size):
+        yield items[x:x+size]
+
+
+def _unique(items):
+    """ Yield items, skipping any seen before
+    """
+    seen = set()
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            yield item
+
+
+def _iter_links(record):
+    """ Yield (case_id, sample_id) pairs described in a hit for the files or cases endpoint
+    """
+    if 'cases' in record:
+        cases = record['cases'] or []
+    elif 'case_id' in record:
+        ## a hit for the cases endpoint describes one case, listing its samples at the top level,
+        ## or under each of its files (as requested with `api.SAMPLE_FIELDS`)
+        samples = list(record.get('samples') or [])
+        for file_record in record.get('files') or []:
+            for case in file_record.get('cases') or []:
+                samples.extend(case.get('samples') or [])
+        cases = [{'case_id': record['case_id'], 'samples': samples}]
+    else:
+        cases = []
+    links = list()
+    for case in cases:
+        samples = case.get('samples') or []
+        if not samples:
+            links.append((case.get('case_id'), None))
+        links.extend((case.get('case_id'), sample.get('sample_id')) for sample in samples)
+    return _unique(links)
+
+
+class MetadataStore(object):
+    """ SQLite-backed store of hits returned by the GDC api, keyed by endpoint,
+        record id & the set of fields requested.
+
+        Records older than `ttl` seconds are reported as stale, along with the
+        `updated_datetime` they had when fetched, so callers can check whether
+        they have changed on the server before fetching them again.
+
+    >>> store = MetadataStore('metadata.sqlite', ttl=86400)
+    >>> store.put('files', hits, fields=['file_id', 'file_name'], id_field='file_id')
+    >>> found, missing, stale = store.get('files', ['file-1', 'file-2'], fields=['file_id', 'file_name'])
+    """
+    def __init__(self, path, ttl=None):
+        self.path = path
+        self.ttl = float(ttl) if ttl else None
+        self._lock = threading.Lock()
+        dir_name = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, endpoint, ids, fields=None):
+        """ Look up records for `ids`.
+
+            Returns a tuple of (found, missing, stale):
+              found: dict of id -> record, for all records in the store
+              missing: list of ids not in the store
+              stale: dict of id -> updated_datetime, for found records older than ttl
+        """
+        ids = list(ids)
+        key = _fields_key(fields)
+        oldest = time.time() - self.ttl if self.ttl else None
+        found = dict()
+        stale = dict()
+        with self._lock, self._connect() as conn:
+            for chunk in _chunks(ids):
+                rows = conn.execute(
+                    'SELECT id, data, updated_datetime, fetched_at FROM records '
+                    'WHERE endpoint = ? AND fields = ? AND id IN ({})'.format(','.join('?'*len(chunk))),
+                    [endpoint, key] + chunk)
+                for (record_id, data, updated_datetime, fetched_at) in rows:
+                    found[record_id] = json.loads(data)
+                    if oldest is not None and fetched_at < oldest:
+                        stale[record_id] = updated_datetime
+        missing = [record_id for record_id in ids if record_id not in found]
+        return found, missing, stale
+
+    def put(self, endpoint, records, fields=None, id_field='id'):
+        """ Add (or replace) `records`, each identified by its value of `id_field`.
+            The record's `updated_datetime` is kept, but dropped from the stored
+            record unless it was among the `fields` requested.
+        """
+        key = _fields_key(fields)
+        now = time.time()
+        rows = list()
+        links = list()
+        for record in records:
+            record = dict(record)
+            record_id = record[id_field]
+            if fields and 'updated_datetime' not in fields:
+                updated_datetime = record.pop('updated_datetime', None)
+            else:
+                updated_datetime = record.get('updated_datetime')
+            rows.append((endpoint, record_id, key, json.dumps(record), updated_datetime, now))
+            links.extend((endpoint, record_id, case_id, sample_id)
+                         for (case_id, sample_id) in _iter_links(record))
+        with self._lock, self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)', rows)
+            for chunk in _chunks([row[1] for row in rows]):
+                conn.execute('DELETE FROM links WHERE endpoint = ? AND id IN ({})'.format(','.join('?'*len(chunk))),
+                             [endpoint] + chunk)
+            conn.executemany('INSERT INTO links VALUES (?, ?, ?, ?)', links)
+
+    def touch(self, endpoint, ids, fields=None):
+        """ Mark records for `ids` as freshly fetched (e.g. once confirmed unchanged)
+        """
+        key = _fields_key(fields)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            for chunk in _chunks(list(ids)):
+                conn.execute('UPDATE records SET fetched_at = ? WHERE endpoint = ? AND fields = ? '
+                             'AND id IN ({})'.format(','.join('?'*len(chunk))),
+                             [now, endpoint, key] + chunk)
+
+    def find_ids(self, endpoint, case_ids=None, sample_ids=None):
+        """ List ids of records in `endpoint` related to any of `case_ids` or `sample_ids`
+
+        >>> store.find_ids('files', case_ids=['0ba6dbb7-...'])
+        ['6082fbb4-1f13-4e58-a0fb-33574354b74b', ...]
+        """
+        ids = list()
+        with self._lock, self._connect() as conn:
+            for (column, values) in [('case_id', case_ids), ('sample_id', sample_ids)]:
+                for chunk in _chunks(list(values or [])):
+                    rows = conn.execute('SELECT DISTINCT id FROM links WHERE endpoint = ? '
+                                        'AND {} IN ({})'.format(column, ','.join('?'*len(chunk))),
+                                        [endpoint] + chunk)
+                    ids.extend(row[0] for row in rows)
+        return sorted(set(ids))
+
+    def invalidate(self, endpoint=None, ids=None):
+        """ Remove records from the store, for given endpoint and/or ids (default: all records)
+        """
+        clause = list()
+        args = list()
+        if endpoint:
+            clause.append('endpoint = ?')
+            args.append(endpoint)
+        with self._lock, self._connect() as conn:
+            if ids is None:
+                where = ' WHERE ' + ' AND '.join(clause) if clause else ''
+                conn.execute('DELETE FROM records' + where, args)
+                conn.execute('DELETE FROM links' + where, args)
+                return
+            for chunk in _chunks(list(ids)):
+                where = ' WHERE ' + ' AND '.join(clause + ['id IN ({})'.format(','.join('?'*len(chunk)))])
+                conn.execute('DELETE FROM records' + where, args + chunk)
+                conn.execute('DELETE FROM links' + where, args + chunk)
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+def get_store():
+    """ Return the metadata store configured by settings `USE_METADATA_STORE`,
+        `METADATA_STORE_PATH` (default: metadata.sqlite in `GDC_DATA_DIR`) & `METADATA_TTL`,
+        or None if the store is not in use.
+    """
+    global _STORE
+    use_store = get_setting_value('USE_METADATA_STORE')
+    if not use_store or str(use_store).lower() in ('false', '0', 'no'):
+        return None
+    path = get_setting_value('METADATA_STORE_PATH')
+    if not path:
+        path = os.path.join(get_setting_value('GDC_DATA_DIR'), 'metadata.sqlite')
+    ttl = get_setting_value('METADATA_TTL')
+    with _STORE_LOCK:
+        if _STORE is None or _STORE.path != path or _STORE.ttl != (float(ttl) if ttl else None):
+            logging.debug('Using metadata store at {}'.format(path))
+            _STORE = MetadataStore(path=path, ttl=ttl)
+        return _STORE
+
+
+def fetch_through_store(endpoint_name, ids, fields, id_field, fetch, use_store=None):
+    """ Get records for `ids` from the metadata store, calling `fetch(ids, fields)`
+        for those which are missing, or which are stale & have changed on the server.
+        Returns list of records in the order of `ids` (excluding any not found).
+
+        Stale records are checked by fetching only `id_field` & `updated_datetime`;
+        those with unchanged `updated_datetime` are kept. Files stored for cases which
+        have changed are removed from the store (see `MetadataStore.find_ids`).
+    """
+    ids = list(_unique(ids))
+    store = get_store() if use_store in (None, True) else None
+    if store is None:
+        return fetch(ids, fields)
+    found, missing, stale = store.get(endpoint_name, ids, fields=fields)
+    if stale:
+        current = fetch(list(stale), [id_field, 'updated_datetime'])
+        current = dict((record[id_field], record.get('updated_datetime')) for record in current)
+        unchanged = [record_id for (record_id, updated_datetime) in stale.items()
+                     if updated_datetime is not None and current.get(record_id) == updated_datetime]
+        store.touch(endpoint_name, unchanged, fields=fields)
+        changed = [record_id for record_id in stale if record_id not in unchanged]
+        for record_id in changed:
+            del found[record_id]
+        missing.extend(changed)
+        if endpoint_name == 'cases' and changed:
+            ## files describe their cases & samples, so those stored for changed cases are fetched again
+            store.invalidate('files', ids=store.find_ids('files', case_ids=changed))
+    if missing:
+        logging.info('Fetching {n} of {total} {endpoint} records missing from metadata store'.format(
+            n=len(missing), total=len(ids), endpoint=endpoint_name))
+        fetch_fields = list(fields or [])
+        if fields:
+            fetch_fields.extend(field for field in [id_field, 'updated_datetime'] if field not in fields)
+        records = fetch(missing, fetch_fields or fields)
+        store.put(endpoint_name, records, fields=fields, id_field=id_field)
+        for record in records:
+            record = dict(record)
+            if fields and 'updated_datetime' not in fields:
+                record.pop('updated_datetime', None)
+            found[record[id_field]] = record
+    return [found[record_id] for record_id in ids if record_id in found]
+
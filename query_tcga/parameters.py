@@ -1,9 +1,11 @@
 from __future__ import absolute_import
 import json
+import threading
 from .log_with import log_with
 from .config import get_setting_value
 from . import error_handling as _errors
 from .cache import requests_get
+from . import cache as _cache
 from . import helpers # import _convert_to_list
 
 #### ---- tools for constructing parameters ---- 
@@ -88,6 +90,25 @@ def construct_parameters(project_name=None, data_category=None, query_args={}, v
 
     return params
 
+@log_with()
+def construct_post_body(project_name=None, data_category=None, query_args={}, verify=False, **kwargs):
+    """ Construct json body for a POST query given project name & list of data categories.
+        Same as `construct_parameters`, except that filters are given as a dict rather than
+        as an encoded string.
+
+    >>> construct_post_body(project_name='TCGA-BLCA', size=5)
+    {'filters': {'content': [{'content': {'field': 'cases.project.project_id', 'value': ['TCGA-BLCA']}, 'op': 'in'}], 'op': 'and'},
+     'size': 5}
+    """
+    body = {}
+    if any([project_name, data_category, query_args]):
+        body['filters'] = _construct_filter_parameters(project_name=project_name,
+                                                       data_category=data_category,
+                                                       query_args=query_args,
+                                                       verify=verify)
+    body.update(kwargs)
+    return body
+
 #### ---- tools for field validation ----
 
 @log_with()
@@ -102,12 +123,18 @@ def _list_valid_fields(endpoint_name):
     ['files.access', 'files.acl', 'files.analysis.analysis_id']
 
     """
-    _verify_data_list(data_list=[endpoint_name], allowed_values=get_setting_value('VALID_ENDPOINTS'))
-    endpoint = get_setting_value('GDC_API_ENDPOINT').format(endpoint=endpoint_name)+'/_mapping'
-    response = requests_get(endpoint)
+    response = requests_get(_valid_fields_endpoint(endpoint_name))
     response.raise_for_status()
-    field_names = response.json()['_mapping'].keys()
-    return field_names
+    return _parse_valid_fields(response)
+
+
+def _valid_fields_endpoint(endpoint_name):
+    _verify_data_list(data_list=[endpoint_name], allowed_values=get_setting_value('VALID_ENDPOINTS'))
+    return get_setting_value('GDC_API_ENDPOINT').format(endpoint=endpoint_name)+'/_mapping'
+
+
+def _parse_valid_fields(response):
+    return response.json()['_mapping'].keys()
 
 
 @log_with()
@@ -138,12 +165,26 @@ def _list_valid_options(field_name,
     """
     # according to https://gdc-docs.nci.nih.gov/API/Users_Guide/Search_and_Retrieval/#filters-specifying-the-query
     # this is the best way to query the endpoint for values
+    endpoint, params, field_name = _valid_options_request(field_name=field_name,
+                                                          endpoint_name=endpoint_name,
+                                                          project_name=project_name,
+                                                          strip_endpoint_from_field_name=strip_endpoint_from_field_name)
+    response = requests_get(endpoint, params=params)
+    response.raise_for_status()
+    return _parse_valid_options(response, field_name=field_name)
+
+
+def _valid_options_request(field_name, endpoint_name, project_name=None, strip_endpoint_from_field_name=True):
+    """ Returns (endpoint, params, facet name) of request listing valid options for a field
+    """
     endpoint = get_setting_value('GDC_API_ENDPOINT').format(endpoint=endpoint_name)
     if strip_endpoint_from_field_name:
         field_name = field_name.replace('{}.'.format(endpoint_name), '')
     params = construct_parameters(project_name=project_name, facets=field_name, size=0)
-    response = requests_get(endpoint, params=params)
-    response.raise_for_status()
+    return endpoint, params, field_name
+
+
+def _parse_valid_options(response, field_name):
     try:
         items = [item['key'] for item in response.json()['data']['aggregations'][field_name]['buckets']]
     except:
@@ -151,6 +192,58 @@ def _list_valid_options(field_name,
     return items
 
 
+class SchemaRegistry(object):
+    """ In-process memo of valid fields for each endpoint & valid options (values) for
+        each field, as frozensets, so that verifying a query needs no requests once
+        these have been loaded. Entries are reloaded once older than `ttl` seconds
+        (default: setting `SCHEMA_TTL`).
+
+    >>> 'files.data_category' in SCHEMA.fields('files')
+    True
+    """
+    def __init__(self, ttl=None, clock=_cache._monotonic):
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = dict()
+        self._locks = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        return float(self._ttl if self._ttl is not None else get_setting_value('SCHEMA_TTL'))
+
+    def _get(self, key, load):
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        ## one load per key at a time, so concurrent callers share the result
+        with key_lock:
+            entry = self._entries.get(key)
+            if entry is None or self._clock() - entry[0] > self.ttl:
+                entry = (self._clock(), frozenset(load()))
+                self._entries[key] = entry
+            return entry[1]
+
+    def fields(self, endpoint_name):
+        """ Valid field names for `endpoint_name` (see `_list_valid_fields`)
+        """
+        return self._get(('fields', endpoint_name),
+                         lambda: _list_valid_fields(endpoint_name=endpoint_name))
+
+    def options(self, field_name, endpoint_name, project_name=None):
+        """ Valid values for `field_name` (see `_list_valid_options`)
+        """
+        return self._get(('options', endpoint_name, field_name, project_name),
+                         lambda: _list_valid_options(field_name=field_name, endpoint_name=endpoint_name,
+                                                     project_name=project_name))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+SCHEMA = SchemaRegistry()
+
+
 @log_with()
 def _verify_field_name(field_name, endpoint_name):
     """ Verify that field exists for this endpoint
@@ -166,7 +259,7 @@ def _verify_field_name(field_name, endpoint_name):
             files.downstream_analyses.output_files.data_category
     """
     try:
-        found = _verify_data_list(field_name, allowed_values=_list_valid_fields(endpoint_name=endpoint_name))
+        found = _verify_data_list(field_name, allowed_values=SCHEMA.fields(endpoint_name))
     except ValueError:
         possible_matches = _search_for_field(field_name, endpoint_name=endpoint_name)
         raise ValueError('Field given was not valid: {given}. \n Some close matches: \n\t{matches}'.format(given=field_name,
@@ -176,8 +269,8 @@ def _verify_field_name(field_name, endpoint_name):
 
 @log_with()
 def _search_for_field(search_string, endpoint_name):
-    fields = _list_valid_fields(endpoint_name=endpoint_name)
-    return [field for field in fields if field.find(search_string)>0]
+    fields = SCHEMA.fields(endpoint_name)
+    return sorted(field for field in fields if field.find(search_string)>0)
 
 
 @log_with()
@@ -215,7 +308,7 @@ def _verify_field_values(data_list, field_name, endpoint_name, project_name=None
             files.downstream_analyses.output_files.data_category
     """
     _verify_field_name(field_name=field_name, endpoint_name=endpoint_name)
-    valid_options = _list_valid_options(field_name=field_name, endpoint_name=endpoint_name, project_name=project_name)
+    valid_options = SCHEMA.options(field_name=field_name, endpoint_name=endpoint_name, project_name=project_name)
     return _verify_data_list(data_list=data_list, allowed_values=valid_options)
 
 
@@ -3,22 +3,25 @@ import os
 import subprocess
 import pandas as pd
 import io
+import collections
 import numpy as np
 import tempfile
 import bs4
 import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from .log_with import log_with
 from .config import get_setting_value 
 from . import parameters as _params
-from . import cache
-from .cache import requests_get
+from .cache import requests_post
 from . import helpers # import _compute_start_given_page, _convert
 from . import api
+from . import clinical_xml
+from . import integrity
+from . import download
 from .super_list import L
 
-## cache recquets depending on value of 
-cache.setup_cache()
 ## -- DO -- :
 ## 1. generate manifest / list of files to download
 ## 2. use gdc-client to download files to cwd
@@ -29,7 +32,31 @@ cache.setup_cache()
 
 
 @log_with()
-def _get_num_pages(project_name, endpoint_name, size=None,
+def _count_files(project_name=None, data_category=None, query_args={}, verify=False):
+    """ Count files matching given criteria, using a single request for no records (size=0)
+
+    >>> _count_files('TCGA-BLCA', data_category=['Clinical'])
+    412
+    """
+    endpoint, body = _count_files_request(project_name=project_name, data_category=data_category,
+                                          query_args=query_args, verify=verify)
+    response = requests_post(endpoint, json=body)
+    response.raise_for_status()
+    return int(response.json()['data']['pagination']['total'])
+
+
+def _count_files_request(project_name=None, data_category=None, query_args={}, verify=False):
+    endpoint = get_setting_value('GDC_API_ENDPOINT').format(endpoint='files')
+    body = _params.construct_post_body(project_name=project_name,
+                                       data_category=data_category,
+                                       query_args=query_args,
+                                       verify=verify,
+                                       size=0)
+    return endpoint, body
+
+
+@log_with()
+def _get_num_pages(project_name, endpoint_name='files', size=None,
                  n=None, data_category=None, query_args={}, verify=False):
     """ Get total number of pages for given criteria
 
@@ -39,38 +66,77 @@ def _get_num_pages(project_name, endpoint_name, size=None,
     """
     if not size:
         size = get_setting_value('DEFAULT_SIZE')
-    if n and size >= n:
-        return 1
-    elif n and size:
-        return np.floor(n / size)+1
-    else:
-        endpoint = get_setting_value('GDC_API_ENDPOINT').format(endpoint='files')
-        params = _params.construct_parameters(project_name=project_name,
-                                               endpoint_name=endpoint_name,
-                                               size=size,
-                                               data_category=data_category,
-                                               query_args=query_args,
-                                               verify=verify,
-                                               )
-        response = requests_get(endpoint, params=params)
-        response.raise_for_status()
-        pages = response.json()['data']['pagination']['pages']
-    return pages
+    if not n:
+        n = _count_files(project_name=project_name, data_category=data_category,
+                         query_args=query_args, verify=verify)
+    return int(np.ceil(float(n) / size))
+
+
+@log_with()
+def _plan_manifest_pages(project_name=None, n=None, data_category=None, query_args={}, verify=False,
+                         size=None, pages=None):
+    """ Decide how many pages of what size to request for a manifest.
+        Returns a tuple of (pages, size).
+
+        If `pages` is given, pages of `size` records are requested as-is. Otherwise
+        we request as few pages as possible, each of at most `size` records (default:
+        setting `MAX_PAGE_SIZE`). The total is only counted (with a single size=0
+        request) when `n` is not given or is larger than one page.
+    """
+    plan = _manifest_page_plan(n=n, size=size, pages=pages)
+    if plan is None:
+        total = _count_files(project_name=project_name, data_category=data_category,
+                             query_args=query_args, verify=verify)
+        plan = _manifest_page_plan(n=n, size=size, pages=pages, total=total)
+    return plan
+
+
+def _manifest_page_plan(n=None, size=None, pages=None, total=None):
+    """ (pages, size) to request, as described in `_plan_manifest_pages`,
+        or None if that depends on the `total` number of files & it is not given.
+    """
+    if pages:
+        return int(pages), int(size or get_setting_value('DEFAULT_SIZE'))
+    max_size = int(size or get_setting_value('MAX_PAGE_SIZE'))
+    if n and n <= max_size:
+        return 1, int(n)
+    if total is None:
+        return None
+    if n:
+        total = min(total, n)
+    if total == 0:
+        return 0, max_size
+    pages = int(np.ceil(float(total) / max_size))
+    ## spread records evenly over the pages needed
+    return pages, int(np.ceil(float(total) / pages))
 
 
 @log_with()
 def _get_manifest_once(project_name, size=None, page=0,
                        data_category=None, query_args={}, verify=False):
-    """ Single get for manifest of files matching project_name & categories
+    """ Single request for manifest of files matching project_name & categories.
+        Filters are sent in the body of a POST, so the manifest can be large.
 
-    >>> _get_manifest_once('TCGA-BLCA', query_args=dict(data_category=['Clinical']), size=5)
+    >>> _get_manifest_once('TCGA-BLCA', data_category=['Clinical'], size=5)
     <Response [200]>
     """
+    endpoint, body = _manifest_request(project_name=project_name, size=size, page=page,
+                                       data_category=data_category, query_args=query_args,
+                                       verify=verify)
+    response = requests_post(endpoint, json=body)
+    response.raise_for_status()
+    return response
+
+
+def _manifest_request(project_name, size=None, page=0,
+                      data_category=None, query_args={}, verify=False):
+    """ Returns (endpoint, json body) of request for a single page of the manifest
+    """
     if not size:
         size = get_setting_value('DEFAULT_SIZE')
     endpoint = get_setting_value('GDC_API_ENDPOINT').format(endpoint='files')
     from_param = helpers.compute_start_given_page(page=page, size=size)
-    params = _params.construct_parameters(project_name=project_name,
+    body = _params.construct_post_body(project_name=project_name,
                                        size=size,
                                        data_category=data_category,
                                        query_args=query_args,
@@ -78,55 +144,154 @@ def _get_manifest_once(project_name, size=None, page=0,
                                        **{'return_type': 'manifest',
                                        'from': from_param,  ## wrapper to avoid reserved word
                                        'sort': 'file_name:asc'})
-    # requests URL-encodes automatically
-    response = requests_get(endpoint, params=params)
-    response.raise_for_status()
-    return response
+    return endpoint, body
+
+
+@log_with()
+def _get_manifest_page(page, **kwargs):
+    """ Get text of a single page of the manifest. Other parameters are passed to `_get_manifest_once`.
+        (Failed requests are retried as described in `cache.RetryPolicy`.)
+    """
+    return _get_manifest_once(page=page, **kwargs).text
+
+
+def _iter_manifest_pages(fetch_page, pages, max_workers=1):
+    """ Yield the text of each page of the manifest, in page order, as it arrives.
+
+        With `max_workers` > 1, up to `max_workers` pages are fetched ahead of the
+        consumer. Pages not yet consumed are cancelled if the generator is closed early.
+    """
+    if max_workers <= 1 or pages <= 1:
+        for page in range(pages):
+            yield fetch_page(page)
+        return
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, pages))
+    pending = collections.deque()
+    next_page = 0
+    try:
+        while next_page < pages or pending:
+            while next_page < pages and len(pending) < max_workers:
+                pending.append(executor.submit(fetch_page, next_page))
+                next_page += 1
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def _iter_manifest_records(project_name=None, n=None, data_category=None, query_args={}, verify=False,
+                           size=None, pages=None, max_workers=None):
+    """ Yield (header, records) for each page of the manifest, where records is the
+        list of (unparsed) lines on that page. Stops fetching pages once `n` records are found.
+    """
+    if not max_workers:
+        max_workers = int(get_setting_value('MAX_WORKERS'))
+    ## manifest doesn't have 'pagination' json, so plan pages from the count of files
+    pages, size = _plan_manifest_pages(project_name=project_name, n=n,
+                                       data_category=data_category,
+                                       query_args=query_args, verify=verify,
+                                       size=size, pages=pages)
+
+    def fetch_page(page):
+        return _get_manifest_page(project_name=project_name,
+                                  data_category=data_category,
+                                  page=page,
+                                  size=size,
+                                  query_args=query_args,
+                                  verify=verify)
+
+    page_texts = _iter_manifest_pages(fetch_page, pages=pages, max_workers=max_workers)
+    try:
+        for (header, records) in _split_manifest_pages(page_texts, size=size, n=n):
+            yield header, records
+    finally:
+        page_texts.close()
+
+
+def _split_manifest_pages(page_texts, size, n=None):
+    """ Yield (header, records) for each of `page_texts` (in page order), stopping once `n` records are found
+    """
+    found = 0
+    short_page = None
+    for (page, page_text) in enumerate(page_texts):
+        lines = page_text.splitlines()
+        if not lines:
+            continue
+        records = lines[1:]
+        ## a short page followed by more records means the server capped our page size
+        if short_page is not None and records:
+            raise ValueError('Server returned fewer than {size} records for page {page} of the manifest. '
+                             'Try a smaller value of setting MAX_PAGE_SIZE.'.format(size=size, page=short_page))
+        if len(records) < size:
+            short_page = page
+        ## truncate to n results
+        if n:
+            records = records[0:n-found]
+        found += len(records)
+        yield lines[0], records
+        if n and found >= n:
+            break
+
+
+def _join_manifest(header_records):
+    """ Join (header, records) pairs into the text of a single manifest
+    """
+    output = list()
+    for (header, records) in header_records:
+        if not output:
+            output.append(header)
+        output.extend(records)
+    return '\n'.join(output)
 
 
 @log_with()
 def get_manifest(project_name=None, n=None, data_category=None, query_args={}, verify=False,
-                 size=None, pages=None):
+                 size=None, pages=None, max_workers=None):
     """ Get manifest containing files to be downloaded. 
 
         By default returns a manifest for all files, up to n files. Otherwise users 
         can filter by combinations of project_name, data_category, and/or query_args.
 
+        By default, as few pages as possible are requested, each of up to `size` records
+        (default: setting `MAX_PAGE_SIZE`); pass `pages` to request exactly that many pages
+        of `size` records. Pages are fetched concurrently by up to `max_workers` threads
+        (default: setting `MAX_WORKERS`), subject to the shared rate limit, and joined in page order.
+
     >>> get_manifest(project_name='TCGA-BLCA', query_args=dict(data_category=['Clinical']), pages=2, size=2)
     'id\tfilename\tmd5\tsize\tstate\n...'
     """
-    if not size:
-        size = get_setting_value('DEFAULT_SIZE')
-    output = io.StringIO()
-    ## manifest doesn't have 'pagination' json, so iterate through result manually
-    ## determine number of pages
-    if not(pages):
-        pages = _get_num_pages(project_name=project_name, endpoint_name='files',
-                               data_category=data_category, n=n,
-                               size=size, query_args=query_args, verify=verify)
-    if n and pages == 1:
-        size = n+1
-
-    ## loop through number of pages
-    for page in np.arange(pages):
-        response = _get_manifest_once(project_name=project_name,
-                                     data_category=data_category,
-                                     page=page,
-                                     size=size,
-                                     query_args=query_args,
-                                     verify=verify)
-        response_text = response.text.splitlines()
-        if page>0:
-            del response_text[0]
-            output.write('\n')
-        output.write('\n'.join(response_text))
-
-    ## truncate to n results
-    manifest = output.getvalue()
-    if n:
-        manifest = output.getvalue().splitlines()
-        manifest = '\n'.join(manifest[0:n+1])
-    return manifest
+    return _join_manifest(_iter_manifest_records(project_name=project_name, n=n,
+                                                 data_category=data_category,
+                                                 query_args=query_args, verify=verify,
+                                                 size=size, pages=pages,
+                                                 max_workers=max_workers))
+
+
+MANIFEST_DTYPES = {'id': str, 'filename': str, 'md5': str, 'state': str}
+
+
+def iter_manifest(project_name=None, n=None, data_category=None, query_args={}, verify=False,
+                  size=None, pages=None, max_workers=None):
+    """ Iterate over manifest of files to be downloaded, yielding one pandas.DataFrame
+        per page of results as soon as that page arrives.
+
+        Stops requesting pages once `n` files have been yielded. See `get_manifest`
+        for other parameters.
+
+    >>> for chunk in iter_manifest(project_name='TCGA-BLCA', data_category=['Clinical'], n=4, size=2):
+    ...     print(len(chunk))
+    2
+    2
+    """
+    for (header, records) in _iter_manifest_records(project_name=project_name, n=n,
+                                                     data_category=data_category,
+                                                     query_args=query_args, verify=verify,
+                                                     size=size, pages=pages,
+                                                     max_workers=max_workers):
+        if not records:
+            continue
+        yield pd.read_csv(io.StringIO('\n'.join([header] + records)), sep='\t', dtype=MANIFEST_DTYPES)
 
 
 @log_with()
@@ -134,9 +299,9 @@ def get_manifest_data(*args, **kwargs):
     """ Get manifest containing files to be downloaded, as a Pandas DataFrame.
         See `get_manifest` for more details.
     """
-    manifest_contents = get_manifest(*args, **kwargs)
-    if manifest_contents != '':
-        return pd.read_csv(io.StringIO(manifest_contents), sep='\t')
+    chunks = list(iter_manifest(*args, **kwargs))
+    if chunks:
+        return pd.concat(chunks, ignore_index=True)
     else:
         return None
 
@@ -169,23 +334,27 @@ def _mkdir_if_not_exists(dir):
                 os.mkdir(sub_dir)
 
 
-def _filter_manifest_updates(manifest_contents, data_dir, only_updates=True):
-    """ Filter manifest contents, keeping only files
-        that have not been downloaded
+def _filter_manifest_updates(manifest_contents, data_dir, only_updates=True, check=None):
+    """ Filter manifest contents (string or pd.DataFrame), keeping only files
+        that have not been downloaded (or fail `check`, see `_characterize_downloads`).
+        Files are identified by (id, filename), as they are saved in data_dir/<id>/<filename>.
     """ 
     _mkdir_if_not_exists(data_dir)
     if not(only_updates):
         return(manifest_contents)
-    logging.debug('manifest_contents: {}'.format(manifest_contents))
-    # identify files that have not yet downloaded
-    failed_downloads = _list_failed_downloads(manifest_contents=manifest_contents,
-                                              data_dir=data_dir)
-    failed_files = [os.path.basename(f) for f in failed_downloads]
-    # filter failed files from manifest
-    manifest_contents = [row 
-                    for row in manifest_contents.splitlines() 
-                    if row.split('\t')[1] in failed_files 
-                    or row.split('\t')[0] == 'id']
+    manifest_data = _read_manifest(manifest_contents=manifest_contents)
+    # identify files that have already downloaded
+    ok = _check_downloads(data_dir=data_dir, manifest_data=manifest_data, check=check)[2]
+    downloaded = set((file_id, filename)
+                     for (file_id, filename, passed) in zip(manifest_data['id'].astype(str).tolist(),
+                                                            manifest_data['filename'].astype(str).tolist(), ok)
+                     if passed)
+    if isinstance(manifest_contents, pd.DataFrame):
+        return manifest_data.loc[[not passed for passed in ok]]
+    # filter downloaded files from manifest, keeping rows as given
+    rows = [row for row in manifest_contents.splitlines() if row.strip()]
+    manifest_contents = [rows[0]] + [row for row in rows[1:]
+                                     if tuple(row.split('\t', 2)[:2]) not in downloaded]
     manifest_contents = '\n'.join(manifest_contents)
     return manifest_contents
 
@@ -202,6 +371,37 @@ def _truncate_manifest_contents(manifest_contents, n):
     ## TODO truncate manifest contents
     return manifest_contents
 
+def _download_with_gdc_client(manifest_contents, data_dir):
+    ## prepare to write manifest data to file
+    ## and execute gdc-client
+    manifest_file = tempfile.NamedTemporaryFile()
+    try:
+        # write manifest contents to disk
+        _write_manifest_to_disk(manifest_contents=manifest_contents,
+                                manifest_file=manifest_file)
+        manifest_file.flush()
+        # call gdc-client to download contents
+        # {gdc_client} download -m {manifest_file} -t {auth_token}
+        exe_bash = [get_setting_value('GDC_CLIENT_PATH'), 'download', '-m', manifest_file.name, '-t', get_setting_value('GDC_TOKEN_PATH')]
+        if subprocess.check_call(exe_bash, cwd=data_dir):
+            subprocess.call(exe_bash, cwd=data_dir)
+    finally:
+        manifest_file.close()
+
+
+def _download_manifest_contents(manifest_contents, data_dir):
+    """ Download files listed in manifest_contents to data_dir/<id>/<filename>,
+        using the client given by setting `DOWNLOAD_CLIENT`: 'gdc-client' or 'native' (see `download`)
+    """
+    client = get_setting_value('DOWNLOAD_CLIENT')
+    if client == 'native':
+        download.download_manifest(_read_manifest(manifest_contents=manifest_contents), data_dir=data_dir)
+    elif client == 'gdc-client':
+        _download_with_gdc_client(manifest_contents=manifest_contents, data_dir=data_dir)
+    else:
+        raise ValueError('Unknown DOWNLOAD_CLIENT {}. Use one of: gdc-client, native'.format(client))
+
+
 @log_with()
 def download_from_manifest(manifest_file=None, manifest_contents=None,
                             n=None,
@@ -230,23 +430,9 @@ def download_from_manifest(manifest_file=None, manifest_contents=None,
     if only_updates:
         manifest_contents = _filter_manifest_updates(manifest_contents, data_dir=data_dir)
 
-    ## prepare to write manifest data to file
-    ## and execute gdc-client
-    manifest_file = tempfile.NamedTemporaryFile()
-    try:
-        # write manifest contents to disk
-        _write_manifest_to_disk(manifest_contents=manifest_contents,
-                                manifest_file=manifest_file)
-        manifest_file.flush()
-        # call gdc-client to download contents
-        # {gdc_client} download -m {manifest_file} -t {auth_token}
-        exe_bash = [get_setting_value('GDC_CLIENT_PATH'), 'download', '-m', manifest_file.name, '-t', get_setting_value('GDC_TOKEN_PATH')]
-        if subprocess.check_call(exe_bash, cwd=data_dir):
-            subprocess.call(exe_bash, cwd=data_dir)
-        # verify that all files in original manifest have been downloaded
-        downloaded = _verify_download(manifest_contents=all_manifest_contents, data_dir=data_dir)
-    finally:
-        manifest_file.close()
+    _download_manifest_contents(manifest_contents=manifest_contents, data_dir=data_dir)
+    # verify that all files in original manifest have been downloaded
+    downloaded = _verify_download(manifest_contents=all_manifest_contents, data_dir=data_dir)
     return downloaded
 
 
@@ -273,8 +459,6 @@ def download_files(project_name, data_category, n=None,
     """
     if not data_dir:
          data_dir = get_setting_value('GDC_DATA_DIR')
-    if not size:
-         size = get_setting_value('DEFAULT_SIZE')
     # get all manifest data
     manifest_contents = get_manifest(project_name=project_name,
                                     data_category=data_category,
@@ -290,29 +474,16 @@ def download_files(project_name, data_category, n=None,
     new_manifest_contents = _filter_manifest_updates(manifest_contents=manifest_contents,
                                                      data_dir=data_dir,
                                                      only_updates=only_updates)
-    ## exit if no files need to be updated
+    ## skip download if no files need to be updated
     if new_manifest_contents.strip() == '' or len(new_manifest_contents)==0:
-        return _verify_download(manifest_contents=manifest_contents, data_dir=data_dir)
-
-    ## prepare to write manifest data to file
-    ## and execute gdc-client
-    manifest_file = tempfile.NamedTemporaryFile()
-    try:
-        # write manifest contents to disk
-        _write_manifest_to_disk(manifest_contents=new_manifest_contents,
-                                manifest_file=manifest_file)
-        manifest_file.flush()
-        # call gdc-client to download contents
-        # {gdc_client} download -m {manifest_file} -t {auth_token}
-        exe_bash = [get_setting_value('GDC_CLIENT_PATH'), 'download', '-m', manifest_file.name, '-t', get_setting_value('GDC_TOKEN_PATH')]
-        if subprocess.check_call(exe_bash, cwd=data_dir):
-            subprocess.call(exe_bash, cwd=data_dir)
+        downloaded = L(_verify_download(manifest_contents=manifest_contents, data_dir=data_dir))
+    else:
+        _download_manifest_contents(manifest_contents=new_manifest_contents, data_dir=data_dir)
         # verify that all files in original manifest have been downloaded
         downloaded = L(_verify_download(manifest_contents=manifest_contents, data_dir=data_dir))
-    finally:
-        manifest_file.close()
     fileinfo = api.get_fileinfo_data(file_id=helpers.convert_to_file_id(downloaded))
     downloaded.fileinfo = fileinfo ## set attribute on returned list
+    downloaded.manifest = _read_manifest(manifest_contents=manifest_contents)
     return downloaded
 
 
@@ -333,7 +504,7 @@ def download_clinical_files(project_name, n=None, data_dir=None, **kwargs):
     Other parameters (mostly useful for testing)
     -----------
       verify (boolean, optional): if True, verify each name-value pair in the query_args dict
-      size (int, optional): how many records to list per page (default 50)
+      size (int, optional): how many records to list per page (default: as many as the server allows, setting MAX_PAGE_SIZE)
       pages (int, optional): how many pages of records to download (default: all, by specifying value of None)
 
     """
@@ -352,18 +523,6 @@ def _read_manifest_data(manifest_file):
     return manifest_data
 
 
-@log_with()
-def _verify_download_single_file(row, data_dir):
-    """ Verify that the file indicated in the manifest exists in data_dir
-    """
-    file_name = os.path.join(data_dir, row['id'], row['filename'])
-    if not(os.path.exists(file_name)):
-        logging.warn('Some files were not found following download: {}'.format(file_name))
-        return file_name, False
-    else:
-        return file_name, True
-
-
 @log_with()
 def _read_manifest(manifest_file=None, manifest_contents=None):
     """ Read in a variety of inputs of manifest (string, pd.DataFrame or file).
@@ -381,37 +540,103 @@ def _read_manifest(manifest_file=None, manifest_contents=None):
 
 
 
+def _scan_dir(path):
+    """ Names of entries in directory `path` (empty if it does not exist), read with a single `os.scandir`.
+        Broken symlinks are left out, as they would fail `os.path.exists`.
+    """
+    try:
+        entries = list(os.scandir(path))
+    except (OSError, IOError):
+        return set()
+    return set(entry.name for entry in entries
+               if not(entry.is_symlink()) or os.path.exists(entry.path))
+
+
+def _list_present_files(data_dir, ids, max_workers=None):
+    """ Set of '<id>/<filename>' for files present in data_dir, looking only in subdirectories
+        named in `ids`. Each subdirectory is listed once; listings are made from up to
+        `max_workers` threads (default: setting `VERIFY_WORKERS`), which helps on network filesystems.
+    """
+    subdirs = sorted(_scan_dir(data_dir).intersection(ids))
+    if not max_workers:
+        max_workers = int(get_setting_value('VERIFY_WORKERS'))
+    listings = helpers.map_concurrently(lambda subdir: _scan_dir(os.path.join(data_dir, subdir)),
+                                subdirs, max_workers=max_workers)
+    return set('{}/{}'.format(subdir, name)
+               for (subdir, names) in zip(subdirs, listings)
+               for name in names)
+
+
+def _check_downloads(data_dir, manifest_data, max_workers=None, check=None):
+    """ Returns (file_names, present, ok): for each row of manifest_data, the path of the
+        file in data_dir, whether it exists & whether it passes `check` (see `_characterize_downloads`)
+    """
+    if not check:
+        check = get_setting_value('VERIFY_CHECK')
+    if check != 'exists' and not set(['size', 'md5']).issubset(manifest_data.columns):
+        logging.warning('Manifest has no size & md5; checking only that downloaded files exist')
+        check = 'exists'
+    ids = manifest_data['id'].astype(str).tolist()
+    filenames = manifest_data['filename'].astype(str).tolist()
+    present_files = _list_present_files(data_dir, ids=set(ids), max_workers=max_workers)
+    present = ['{}/{}'.format(file_id, filename) in present_files for (file_id, filename) in zip(ids, filenames)]
+    prefix = os.path.join(data_dir, '')
+    file_names = [prefix + file_id + os.sep + filename for (file_id, filename) in zip(ids, filenames)]
+    ok = present
+    if check != 'exists':
+        rows = [i for i in range(len(present)) if present[i]]
+        checked = integrity.check_files([file_names[i] for i in rows],
+                                        sizes=manifest_data['size'].values[rows],
+                                        md5s=manifest_data['md5'].values[rows],
+                                        check=check, max_workers=max_workers)
+        ok = list(present)
+        for (i, passed) in zip(rows, checked):
+            ok[i] = passed
+    return file_names, present, ok
+
+
 @log_with()
-def _characterize_downloads(data_dir, manifest_file=None, manifest_contents=None):
+def _characterize_downloads(data_dir, manifest_file=None, manifest_contents=None, max_workers=None, check=None):
+    """ Check which files in the manifest are present in data_dir (as data_dir/<id>/<filename>)
+        and, according to `check` (default: setting `VERIFY_CHECK`), have the size ('size')
+        or size & md5 ('md5') given in the manifest.
+        Returns dict of 'success' & 'failed' file paths, in manifest order, with those
+        files present but failing the check also listed as 'corrupt'.
+    """
+    if not check:
+        check = get_setting_value('VERIFY_CHECK')
     manifest_data = _read_manifest(manifest_file=manifest_file, manifest_contents=manifest_contents)
-    failed_downloads = list()
-    downloads = list()
-    for i, row in manifest_data.iterrows():
-        file_name, success = _verify_download_single_file(row=row, data_dir=data_dir)
-        if success:
-            downloads.append(file_name)
-        else:
-            failed_downloads.append(file_name)
-    return {'failed': failed_downloads, 'success': downloads}
+    (file_names, present, ok) = _check_downloads(data_dir=data_dir, manifest_data=manifest_data,
+                                                 max_workers=max_workers, check=check)
+    failed_downloads = [file_name for (file_name, passed) in zip(file_names, ok) if not passed]
+    downloads = [file_name for (file_name, passed) in zip(file_names, ok) if passed]
+    corrupt = [file_name for (file_name, found, passed) in zip(file_names, present, ok) if found and not passed]
+    if len(failed_downloads) > len(corrupt):
+        logging.warning('{} of {} files were not found in {}'.format(len(failed_downloads) - len(corrupt),
+                                                                     len(file_names), data_dir))
+    if corrupt:
+        logging.warning('{} of {} files do not match the {} in the manifest: {}'.format(
+            len(corrupt), len(file_names), check, corrupt[:10]))
+    return {'failed': failed_downloads, 'success': downloads, 'corrupt': corrupt}
 
 
 @log_with()
-def _list_failed_downloads(data_dir, manifest_file=None, manifest_contents=None):
+def _list_failed_downloads(data_dir, manifest_file=None, manifest_contents=None, check=None):
     """
     """
     res = _characterize_downloads(manifest_file=manifest_file,
                                   manifest_contents=manifest_contents,
-                                  data_dir=data_dir)
+                                  data_dir=data_dir, check=check)
     return res['failed']
 
 
 @log_with()
-def _verify_download(data_dir, manifest_file=None, manifest_contents=None):
+def _verify_download(data_dir, manifest_file=None, manifest_contents=None, check=None):
     """
     """
     res = _characterize_downloads(manifest_file=manifest_file,
                                   manifest_contents=manifest_contents,
-                                  data_dir=data_dir)
+                                  data_dir=data_dir, check=check)
     return res['success']
 
 
@@ -476,57 +701,195 @@ def _parse_clin_data_soup(soup, **kwargs):
 
 
 @log_with()
-def get_clinical_data_from_file(xml_file, fileinfo=None, **kwargs):
-    soup = _read_xml_bs(xml_file)
-    data = _parse_clin_data_soup(soup, **kwargs)
+def get_clinical_data_from_file(xml_file, fileinfo=None, parser='lxml', fetch_fileinfo=True, **kwargs):
+    """ Parse clinical data from a single XML file into a dict.
+
+        By default the file is parsed with a streaming `lxml` parser (see `clinical_xml`);
+        use `parser='bs4'` for the original BeautifulSoup parser, which gives the same result.
+
+        `fileinfo` may be a DataFrame, or a dict indexed by file_id (see `_index_fileinfo`).
+        When parsing many files, pass the dict, so fileinfo is indexed only once.
+        Fileinfo missing for this file is queried from the API, unless `fetch_fileinfo=False`.
+    """
+    if parser == 'bs4':
+        soup = _read_xml_bs(xml_file)
+        data = _parse_clin_data_soup(soup, **kwargs)
+        patient_id = soup.findChild('patient_id').text
+    else:
+        data, patient_id = clinical_xml.parse_clinical_xml(xml_file, **kwargs)
     file_id = helpers.convert_to_file_id(xml_file)
     data['_source_type'] = 'XML'
     data['_source_desc'] = xml_file
-    data['patient_id'] = soup.findChild('patient_id').text
+    data['patient_id'] = patient_id
     #data['submitter_id'] = soup.findChild('submitter_id').text
     data['_source_file_uuid'] = file_id
     ## get file meta-data (for case_id & submitter_id):
-    if fileinfo is None or len(fileinfo.index) == 0:
-        logger.debug('fileinfo is none - getting from file_id')
-        fileinfo = api.get_fileinfo_data(file_id=file_id)
-    try:
-        data['case_id'] = fileinfo.loc[fileinfo['file_id']==file_id[0], 'case_id'].values[0]
-        data['submitter_id'] = fileinfo.loc[fileinfo['file_id']==file_id[0], 'submitter_id'].values[0]
-    except:
+    if isinstance(fileinfo, pd.DataFrame):
+        fileinfo = _index_fileinfo(fileinfo)
+    ids = (fileinfo or {}).get(file_id[0])
+    if ids is None and fetch_fileinfo:
         logging.info('Unable to extract case & submitter ids from fileinfo for file {}. Trying again.'.format(file_id))
-        fileinfo = api.get_fileinfo_data(file_id=file_id)
-        try:
-            data['case_id'] = fileinfo.loc[fileinfo['file_id']==file_id[0], 'case_id'].values[0]
-            data['submitter_id'] = fileinfo.loc[fileinfo['file_id']==file_id[0], 'submitter_id'].values[0]
-        except:
-            import pdb
-            pdb.set_trace()
-            logging.warning('Unable to extract case & submitter ids from fileinfo for file {}. Using NaN'.format(file_id))
-            pass
+        ids = _index_fileinfo(api.get_fileinfo_data(file_id=file_id)).get(file_id[0])
+    if ids is None:
+        logging.warning('Unable to extract case & submitter ids from fileinfo for file {}. Using NaN'.format(file_id))
+    else:
+        data.update(ids)
     return data
 
+
+def _index_fileinfo(fileinfo):
+    """ Index fileinfo by file_id, for quick lookup of case & submitter ids.
+        Returns dict of file_id -> {'case_id': ..., 'submitter_id': ...}
+    """
+    if fileinfo is None or len(fileinfo.index) == 0:
+        return dict()
+    columns = [column for column in ['case_id', 'submitter_id'] if column in fileinfo.columns]
+    fileinfo = fileinfo.drop_duplicates(subset='file_id').set_index('file_id')
+    return fileinfo.loc[:, columns].to_dict('index')
+
+
+## fileinfo index shared by all tasks of a worker process, set once by `_init_clinical_worker`
+_WORKER_FILEINFO = None
+
+
+def _init_clinical_worker(fileinfo_index):
+    global _WORKER_FILEINFO
+    _WORKER_FILEINFO = fileinfo_index
+
+
+def _parse_clinical_file_worker(xml_file):
+    ## fileinfo is fetched by the parent process; workers never query the API,
+    ## since each would otherwise be rate-limited separately
+    return get_clinical_data_from_file(xml_file, fileinfo=_WORKER_FILEINFO, fetch_fileinfo=False)
+
+
+def _to_numeric_if_possible(series):
+    """ Convert series to numeric, leaving it unchanged if any value is not numeric
+    """
+    try:
+        return pd.to_numeric(series)
+    except (ValueError, TypeError):
+        return series
+
+
 def _convert_to_categorical(series, max_groups=5):
     """ Convert the series to categorical, if number of distinct groups <= `max_groups`
     """
-    if type(series) is not chr:
-        return series
-    if len(series.value_counts(dropna=True)) <= max_groups:
-        return series.astype('category')
-    else:
+    if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
         return series
+    try:
+        if len(series.value_counts(dropna=True)) <= max_groups:
+            return series.astype('category')
+    except TypeError: # unhashable values, e.g. lists
+        pass
+    return series
 
 
 @log_with()
-def get_clinical_data(project_name=None, xml_files=None, **kwargs):
+def get_clinical_data(project_name=None, xml_files=None, workers=None, **kwargs):
+    """ Parse clinical data for a project (or from a list of `xml_files`) into a DataFrame,
+        with one row per XML file.
+
+        Fileinfo (for case & submitter ids) is indexed by file_id once; fileinfo missing for
+        any of the files is queried from the API in a single request.
+
+        With `workers` > 1, files are parsed in a pool of that many processes (or one per
+        cpu, if `workers` < 1). Each worker is sent the file paths to parse & a single copy
+        of the fileinfo index. Rows are returned in the order of `xml_files`.
+    """
     if xml_files is None:
         xml_files = download_clinical_files(project_name=project_name, **kwargs)
-    data = list()
-    for xml_file in xml_files:
-        data.append(get_clinical_data_from_file(xml_file, fileinfo=xml_files.fileinfo))
-    df = pd.DataFrame(data)
+    fileinfo_index = _index_fileinfo(getattr(xml_files, 'fileinfo', None))
+    missing_ids = [file_id for file_id in helpers.convert_to_file_id(list(xml_files))
+                   if file_id not in fileinfo_index]
+    if missing_ids:
+        logging.info('Fetching fileinfo for {} clinical files'.format(len(missing_ids)))
+        fileinfo_index.update(_index_fileinfo(api.get_fileinfo_data(file_id=missing_ids)))
+    if workers is not None and workers < 1:
+        workers = multiprocessing.cpu_count()
+    if workers and workers > 1 and len(xml_files) > 1:
+        chunksize = max(1, len(xml_files) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_clinical_worker,
+                                 initargs=(fileinfo_index,)) as executor:
+            data = list(executor.map(_parse_clinical_file_worker, list(xml_files), chunksize=chunksize))
+    else:
+        data = list()
+        for xml_file in xml_files:
+            data.append(get_clinical_data_from_file(xml_file, fileinfo=fileinfo_index, fetch_fileinfo=False))
+    return _convert_clinical_dtypes(pd.DataFrame(data))
+
+
+def _convert_clinical_dtypes(df):
     ## convert numerical fields to numeric
-    df = df.apply(pd.to_numeric, errors='ignore')
+    df = df.apply(_to_numeric_if_possible)
     ## convert rest of fields to categories, if n_groups <= 5
     df = df.apply(_convert_to_categorical)
     return df
 
+
+CLINICAL_INDEX_COLUMNS = ['file_id', 'md5', 'parsed_at']
+
+
+@log_with()
+def update_clinical_data(xml_files, clinical_data=None, clinical_index=None, workers=None):
+    """ Update `clinical_data` (as returned by `get_clinical_data`) to describe `xml_files`,
+        parsing only those files which are new or have changed since they were last parsed.
+
+        `clinical_index` is a DataFrame with columns file_id, md5 & parsed_at, for the files
+        described in `clinical_data`. The md5 of each file is computed from the local copy
+        which is parsed (see `integrity.file_md5s`), so that a file is parsed again once a
+        changed version has been downloaded. Rows for files no longer among `xml_files` are dropped.
+
+        Returns a tuple of the updated (clinical_data, clinical_index).
+
+    >>> clinical_data, clinical_index = update_clinical_data(xml_files, clinical_data, clinical_index)
+    """
+    xml_files = L(xml_files) if not isinstance(xml_files, L) else xml_files
+    file_ids = helpers.convert_to_file_id(list(xml_files))
+    md5s = integrity.file_md5s(list(xml_files))
+    manifest = getattr(xml_files, 'manifest', None)
+    if manifest is not None and len(manifest.index) > 0:
+        md5_by_id = dict(zip(manifest['id'], manifest['md5']))
+        n_stale = len([file_id for (file_id, md5) in zip(file_ids, md5s)
+                       if md5_by_id.get(file_id, md5) != md5])
+        if n_stale:
+            logging.warning('{} clinical files differ from the versions in the manifest; '
+                            'set VERIFY_CHECK=\'md5\' to download them again'.format(n_stale))
+
+    ## files parsed previously, & still described in clinical_data
+    previous = dict()
+    if clinical_data is not None and clinical_index is not None and len(clinical_data.index) > 0:
+        described = set(helpers.convert_to_file_id(list(clinical_data['_source_desc'])))
+        previous = dict((file_id, md5) for (file_id, md5) in zip(clinical_index['file_id'], clinical_index['md5'])
+                        if file_id in described)
+    to_parse = [i for (i, file_id) in enumerate(file_ids) if previous.get(file_id) != md5s[i]]
+    logging.info('Parsing {n} of {total} clinical files (new or changed since last parsed)'.format(
+        n=len(to_parse), total=len(file_ids)))
+
+    parsed_ids = set(file_ids[i] for i in to_parse)
+    keep_ids = set(file_ids) - parsed_ids
+    frames = list()
+    if previous:
+        row_ids = helpers.convert_to_file_id(list(clinical_data['_source_desc']))
+        frames.append(clinical_data.loc[[file_id in keep_ids for file_id in row_ids]])
+    if to_parse:
+        new_files = L(xml_files[i] for i in to_parse)
+        fileinfo = getattr(xml_files, 'fileinfo', None)
+        if fileinfo is not None and len(fileinfo.index) > 0:
+            new_files.fileinfo = fileinfo.loc[fileinfo['file_id'].isin(parsed_ids)]
+        frames.append(get_clinical_data(xml_files=new_files, workers=workers))
+    if frames:
+        clinical_data = _convert_clinical_dtypes(pd.concat(frames, ignore_index=True, sort=False))
+    else:
+        clinical_data = pd.DataFrame()
+
+    now = pd.Timestamp.now().isoformat()
+    parsed_at = dict()
+    if clinical_index is not None:
+        parsed_at = dict(zip(clinical_index['file_id'], clinical_index['parsed_at']))
+    clinical_index = pd.DataFrame({
+        'file_id': file_ids,
+        'md5': md5s,
+        'parsed_at': [now if file_id in parsed_ids else parsed_at.get(file_id) for file_id in file_ids],
+        }, columns=CLINICAL_INDEX_COLUMNS)
+    return clinical_data, clinical_index
@@ -95,7 +95,7 @@ def summarize_vcf_files(files):
     if hasattr(files, 'fileinfo'):
         fileinfo = files.fileinfo
     else:
-        fileinfo = api.get_fileinfo_data(files)
+        fileinfo = api.get_fileinfo_data(helpers.convert_to_file_id(files))
     summary = pd.merge(file_summary, fileinfo, on='file_id')
     return summary
 
@@ -104,6 +104,6 @@ def summarize_wxs_files(files):
     if hasattr(files, 'fileinfo'):
         fileinfo = files.fileinfo
     else:
-        fileinfo = api.get_fileinfo_data(files)
+        fileinfo = api.get_fileinfo_data(helpers.convert_to_file_id(files))
     return fileinfo
 
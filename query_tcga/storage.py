@@ -0,0 +1,126 @@
+from __future__ import absolute_import
+import logging
+import os
+import pandas as pd
+from .config import get_setting_value
+
+#### ---- storage of project-level tables (e.g. clinical data, fileinfo) ----
+## Tables are saved in a columnar format (parquet or feather, via pyarrow) by default,
+## which keeps dtypes (incl. categories) & supports reading a subset of columns from
+## a memory-mapped file. Tables previously saved as pipe-delimited csv are converted
+## to the configured format the first time they are read.
+
+
+def _read_csv(file_path, columns=None):
+    return pd.read_csv(file_path, sep='|', usecols=columns)
+
+
+def _write_csv(dataframe, file_path):
+    dataframe.to_csv(file_path, sep='|', index=False)
+
+
+def _read_parquet(file_path, columns=None):
+    import pyarrow.parquet
+    return pyarrow.parquet.read_table(file_path, columns=columns, memory_map=True).to_pandas()
+
+
+def _write_parquet(dataframe, file_path):
+    _prepare_columnar(dataframe).to_parquet(file_path, engine='pyarrow', index=False)
+
+
+def _read_feather(file_path, columns=None):
+    import pyarrow.feather
+    return pyarrow.feather.read_table(file_path, columns=columns, memory_map=True).to_pandas()
+
+
+def _write_feather(dataframe, file_path):
+    import pyarrow.feather
+    ## uncompressed, so that reads can be memory-mapped
+    pyarrow.feather.write_feather(_prepare_columnar(dataframe).reset_index(drop=True), file_path,
+                                  compression='uncompressed')
+
+
+## format name -> (file extension, reader, writer)
+FORMATS = {
+    'csv': ('csv', _read_csv, _write_csv),
+    'parquet': ('parquet', _read_parquet, _write_parquet),
+    'feather': ('feather', _read_feather, _write_feather),
+}
+
+## formats which need pyarrow
+COLUMNAR_FORMATS = ['parquet', 'feather']
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
+
+
+def _prepare_columnar(dataframe):
+    """ Convert object columns holding values of more than one type (e.g. strings & numbers,
+        as in clinical data merged from csv) to strings, which columnar formats require
+    """
+    dataframe = dataframe.copy()
+    for column in dataframe.columns[dataframe.dtypes == object]:
+        values = dataframe[column].dropna()
+        if len(set(type(value) for value in values)) > 1:
+            dataframe[column] = dataframe[column].apply(lambda value: value if pd.isnull(value) else str(value))
+    return dataframe
+
+
+def get_format(format=None):
+    """ Storage format to use: `format`, if given, else setting `CACHE_FORMAT`.
+        Columnar formats fall back to csv if pyarrow is not installed.
+    """
+    format = format or get_setting_value('CACHE_FORMAT') or 'csv'
+    if format not in FORMATS:
+        raise ValueError('Unknown storage format {}. Use one of: {}'.format(format, ', '.join(sorted(FORMATS))))
+    if format in COLUMNAR_FORMATS and not _has_pyarrow():
+        logging.warning('pyarrow is not installed; saving tables as csv instead of {}'.format(format))
+        format = 'csv'
+    return format
+
+
+def get_file_path(data_dir, file_type, format=None):
+    extension = FORMATS[get_format(format)][0]
+    return os.path.join(data_dir, '{}.{}'.format(file_type, extension))
+
+
+def read_table(data_dir, file_type, columns=None, format=None):
+    """ Read table `file_type` saved in `data_dir`, or return None if it has not been saved.
+        Use `columns` to read only those columns.
+
+        A table saved as csv, while `format` is a columnar format, is read & re-saved in
+        that format (& the csv removed).
+
+    >>> clinical_data = read_table('data', 'clinical', columns=['patient_id', 'vital_status'])
+    """
+    format = get_format(format)
+    (extension, reader, writer) = FORMATS[format]
+    file_path = get_file_path(data_dir, file_type, format=format)
+    if os.path.exists(file_path):
+        return reader(file_path, columns=columns)
+    csv_path = get_file_path(data_dir, file_type, format='csv')
+    if format != 'csv' and os.path.exists(csv_path):
+        logging.info('Converting {} to {}'.format(csv_path, format))
+        dataframe = _read_csv(csv_path)
+        writer(dataframe, file_path)
+        os.remove(csv_path)
+        if columns is not None:
+            dataframe = dataframe.loc[:, columns]
+        return dataframe
+    return None
+
+
+def write_table(dataframe, data_dir, file_type, format=None):
+    """ Save `dataframe` as table `file_type` in `data_dir`. Returns path to the file written.
+    """
+    format = get_format(format)
+    file_path = get_file_path(data_dir, file_type, format=format)
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    FORMATS[format][2](dataframe, file_path)
+    return file_path
@@ -0,0 +1,300 @@
+""" Minimal local stand-in for the GDC api, for tests & benchmarks that should
+    not depend on the network.
+
+>>> with StubGDCServer() as server, settings(GDC_API_ENDPOINT=server.endpoint):
+...     api.get_data(endpoint_name='files')
+<Response [200]>
+"""
+from __future__ import absolute_import
+import contextlib
+import json
+import os
+import threading
+import time
+from query_tcga import config
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError: # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+
+@contextlib.contextmanager
+def settings(**kwargs):
+    """ Temporarily override query_tcga settings, restoring previous values on exit
+    """
+    previous = dict()
+    for key in kwargs:
+        try:
+            previous[key] = config.get_setting_value(key)
+        except (AttributeError, ValueError):
+            previous[key] = None
+    config.set_value(**kwargs)
+    try:
+        yield
+    finally:
+        config.set_value(**previous)
+
+
+def empty_hits(request):
+    """ Default route: a search result with no hits
+    """
+    body = {'data': {'hits': [], 'pagination': {'count': 0, 'total': 0, 'size': 0,
+                                                'from': 0, 'page': 1, 'pages': 1}},
+            'warnings': {}}
+    return 200, {'Content-Type': 'application/json'}, json.dumps(body)
+
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+MANIFEST_HEADER = 'id\tfilename\tmd5\tsize\tstate'
+
+
+def make_manifest_rows(n):
+    """ Fake manifest rows, sorted by filename
+    """
+    return ['{id:08d}-0000-0000-0000-000000000000\tfile_{id:06d}.xml\t{md5}\t{size}\tlive'.format(
+                id=i, md5='{:032x}'.format(i), size=1000+i)
+            for i in range(n)]
+
+
+def load_manifest_fixture(name='manifest_tcga_blca_clinical.tsv'):
+    """ Rows (excluding header) of a manifest recorded in test/fixtures
+    """
+    with open(os.path.join(FIXTURE_DIR, name)) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == MANIFEST_HEADER
+    return lines[1:]
+
+
+def files_route(rows, max_size=None):
+    """ Route for the 'files' endpoint serving `rows` as a manifest, honoring
+        the `from` (0-based) & `size` parameters like the GDC api does.
+        Pages are silently capped at `max_size` records, if given.
+    """
+    def route(request):
+        params = dict(request.params)
+        if request.method == 'POST' and request.body:
+            params.update(request.json())
+        start = int(params.get('from', 0))
+        size = int(params.get('size', 10))
+        if max_size:
+            size = min(size, max_size)
+        if params.get('return_type') == 'manifest':
+            body = '\n'.join([MANIFEST_HEADER] + rows[start:start+size]) + '\n'
+            return 200, {'Content-Type': 'text/tab-separated-values'}, body
+        pages = (len(rows) + size - 1) // size if size else 1
+        pagination = {'count': len(rows[start:start+size]), 'total': len(rows), 'size': size,
+                      'from': start, 'page': (start // size) + 1 if size else 1, 'pages': pages}
+        return 200, {'Content-Type': 'application/json'}, json.dumps(
+            {'data': {'hits': [], 'pagination': pagination}, 'warnings': {}})
+    return route
+
+
+def make_file_hit(file_id, n_cases=1, n_samples=1):
+    """ Fake hit for a file, in the shape returned for DEFAULT_FILE_FIELDS
+    """
+    cases = list()
+    for c in range(n_cases):
+        samples = [{'sample_id': '{}-case{}-sample{}'.format(file_id, c, s),
+                    'submitter_id': 'TCGA-XX-{:04d}-{:02d}A'.format(c, s),
+                    'sample_type': 'Primary Tumor' if s == 0 else 'Blood Derived Normal',
+                    'tissue_type': None,
+                    'tumor_descriptor': None}
+                   for s in range(n_samples)]
+        cases.append({'case_id': '{}-case{}'.format(file_id, c),
+                      'submitter_id': 'TCGA-XX-{:04d}'.format(c),
+                      'samples': samples})
+    return {'file_id': file_id,
+            'file_name': '{}.xml'.format(file_id),
+            'data_category': 'Clinical',
+            'data_type': 'Clinical Supplement',
+            'cases': cases,
+            'analysis': {'analysis_id': '{}-analysis'.format(file_id)}}
+
+
+def request_filter_values(request, field):
+    """ Values given for `field` in the filters of a GDC request (GET or POST)
+    """
+    params = dict(request.params)
+    if request.method == 'POST' and request.body:
+        params.update(request.json())
+    filters = params.get('filters')
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        filters = json.loads(filters)
+    for element in filters.get('content', []):
+        if element['content']['field'] == field:
+            return element['content']['value']
+    return None
+
+
+def hits_route(hits, field='files.file_id', key='file_id'):
+    """ Route returning those `hits` whose `key` matches the values
+        given for `field` in the request's filters (or all hits, if not filtered).
+    """
+    def route(request):
+        params = dict(request.params)
+        if request.method == 'POST' and request.body:
+            params.update(request.json())
+        values = request_filter_values(request, field)
+        if values is None:
+            selected = list(hits)
+        else:
+            values = set(values)
+            selected = [hit for hit in hits if hit[key] in values]
+        size = int(params.get('size', 10))
+        body = {'data': {'hits': selected[0:size],
+                         'pagination': {'count': len(selected[0:size]), 'total': len(selected),
+                                        'size': size, 'from': 0, 'page': 1, 'pages': 1}},
+                'warnings': {}}
+        return 200, {'Content-Type': 'application/json'}, json.dumps(body)
+    return route
+
+
+def data_route(contents, interrupt_after=None, ignore_range=False):
+    """ Route for the 'data' endpoint, serving `contents` (dict of file_id -> bytes) & honoring
+        single `Range: bytes=<start>-[<end>]` requests with a 206 response (unless `ignore_range`).
+        Responses to the first len(`interrupt_after`) requests are cut short after that many bytes.
+    """
+    interrupt_after = list(interrupt_after or [])
+    lock = threading.Lock()
+
+    def route(request):
+        file_id = request.path.strip('/').split('/')[-1]
+        if file_id not in contents:
+            return 404, {}, ''
+        content = contents[file_id]
+        status = 200
+        headers = {'Content-Type': 'application/octet-stream',
+                   'Content-Disposition': 'attachment; filename={}'.format(file_id)}
+        byte_range = request.headers.get('Range')
+        if byte_range and not ignore_range:
+            (start, end) = byte_range.split('=')[1].split('-')
+            start = int(start)
+            end = min(int(end), len(content) - 1) if end else len(content) - 1
+            if start >= len(content):
+                return 416, {'Content-Range': 'bytes */{}'.format(len(content))}, ''
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, len(content))
+            content = content[start:end + 1]
+            status = 206
+        with lock:
+            cut = interrupt_after.pop(0) if interrupt_after else None
+        if cut is not None:
+            headers['Content-Length'] = str(len(content))
+            content = content[:cut]
+        return status, headers, content
+    return route
+
+
+class StubRequest(object):
+    """ What a route sees of an incoming request
+    """
+    def __init__(self, method, path, params, body, headers):
+        self.method = method
+        self.path = path
+        self.params = params
+        self.body = body
+        self.headers = headers
+
+    def json(self):
+        return json.loads(self.body.decode('utf-8'))
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubGDCServer(object):
+    """ Threaded HTTP server answering GDC-style requests on 127.0.0.1.
+
+        `routes` maps an endpoint name (first path component, e.g. 'files')
+        to a callable taking a `StubRequest` and returning (status, headers, body).
+        Unknown endpoints fall back to `default`. Every request is recorded
+        in `requests`; `latency` (seconds) is added to each response.
+        The largest number of requests handled at once is kept in `max_in_flight`.
+    """
+    def __init__(self, routes=None, default=empty_hits, latency=0):
+        self.routes = dict(routes or {})
+        self.default = default
+        self.latency = latency
+        self.requests = list()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    @property
+    def endpoint(self):
+        """ Value to use for setting GDC_API_ENDPOINT
+        """
+        return self.url + '/{endpoint}'
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                params = dict((k, v[0]) for (k, v) in parse_qs(parsed.query).items())
+                request = StubRequest(method=self.command, path=parsed.path,
+                                      params=params, body=body, headers=self.headers)
+                with stub._lock:
+                    stub.requests.append(request)
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                endpoint_name = parsed.path.strip('/').split('/')[0]
+                route = stub.routes.get(endpoint_name, stub.default)
+                try:
+                    if stub.latency:
+                        time.sleep(stub.latency)
+                    status, headers, content = route(request)
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+                if not isinstance(content, bytes):
+                    content = content.encode('utf-8')
+                self.send_response(status)
+                for (k, v) in headers.items():
+                    self.send_header(k, v)
+                if 'Content-Length' not in headers:
+                    self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(content)
+
+            do_GET = _respond
+            do_POST = _respond
+            do_HEAD = _respond
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,99 @@
+""" Synthetic TCGA-style clinical XML files, for tests & benchmarks of the clinical parsers.
+"""
+from __future__ import absolute_import
+import random
+
+NAMESPACES = {
+    'blca': 'http://tcga.nci/bcr/xml/clinical/blca/2.7',
+    'admin': 'http://tcga.nci/bcr/xml/administration/2.7',
+    'shared': 'http://tcga.nci/bcr/xml/shared/2.7',
+    'clin_shared': 'http://tcga.nci/bcr/xml/clinical/shared/2.7',
+    'shared_stage': 'http://tcga.nci/bcr/xml/clinical/shared/stage/2.7',
+    'nte': 'http://tcga.nci/bcr/xml/clinical/shared/new_tumor_event/2.7',
+}
+
+FIELD_NAMES = ['gender', 'vital_status', 'birth_days_to', 'death_days_to', 'last_contact_days_to',
+               'race', 'ethnicity', 'tumor_tissue_site', 'pathologic_stage', 'pathologic_T',
+               'pathologic_N', 'new_tumor_event_dx_days_to', 'treatment_outcome_at_tcga_followup',
+               'histological_type', 'age_at_initial_pathologic_diagnosis', 'year_of_initial_pathologic_diagnosis']
+
+VALUES = ['MALE', 'FEMALE', 'Alive', 'Dead', '-23936', '1024', '0', 'WHITE', 'Stage IV', 'T3a',
+          'Complete Response', 'Progressive Disease', 'R&amp;D', '  padded  ', '<![CDATA[cdata <value>]]>']
+
+
+def _random_value(rng):
+    return rng.choice(VALUES)
+
+
+def _random_element(rng, depth, pretty, indent):
+    prefix = rng.choice(['clin_shared', 'shared', 'shared_stage', 'nte', 'blca'])
+    name = '{}:{}_{}'.format(prefix, rng.choice(['item', 'list', 'event', 'value']), rng.randint(0, 50))
+    attrs = ''
+    roll = rng.random()
+    if roll < 0.6:
+        attrs = ' preferred_name="{}"'.format(rng.choice(FIELD_NAMES))
+    elif roll < 0.7:
+        attrs = ' preferred_name=""'
+    if rng.random() < 0.3:
+        attrs += ' procurement_status="{}"'.format(rng.choice(['Completed', 'Not Available']))
+    kind = rng.random()
+    if kind < 0.1:
+        return '<{}{}/>'.format(name, attrs)
+    if depth >= 4 or kind < 0.55:
+        return '<{name}{attrs}>{value}</{name}>'.format(name=name, attrs=attrs, value=_random_value(rng))
+    nl = ('\n' + '    ' * (indent + 1)) if pretty else ''
+    parts = list()
+    if kind > 0.9:
+        parts.append(_random_value(rng))
+    for i in range(rng.randint(1, 4)):
+        if rng.random() < 0.1:
+            parts.append('<!-- {} -->'.format(rng.choice(FIELD_NAMES)))
+        parts.append(nl + _random_element(rng, depth + 1, pretty and rng.random() < 0.9, indent + 1))
+    if kind > 0.95:
+        parts.append(_random_value(rng))
+    closing = ('\n' + '    ' * indent) if pretty else ''
+    return '<{name}{attrs}>{content}{closing}</{name}>'.format(name=name, attrs=attrs,
+                                                               content=''.join(parts), closing=closing)
+
+
+def make_clinical_xml(seed, n_sections=30, patient_id=None):
+    """ Text of a synthetic clinical XML file. Same `seed` gives the same file.
+    """
+    rng = random.Random(seed)
+    if patient_id is None:
+        patient_id = '{:04X}'.format(rng.randint(0, 0xFFFF))
+    pretty = rng.random() < 0.8
+    nl = '\n        ' if pretty else ''
+    sections = [nl + _random_element(rng, 1, pretty, 2) for i in range(n_sections)]
+    if rng.random() < 0.5:
+        sections.insert(rng.randint(0, len(sections)), nl + '<!-- section comment -->')
+    xmlns = ' '.join('xmlns:{}="{}"'.format(k, v) for (k, v) in sorted(NAMESPACES.items()))
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<blca:tcga_bcr {xmlns} schemaVersion="2.7">\n'
+            '    <admin:admin>\n'
+            '        <admin:bcr xsd_ver="1.17">Nationwide Children\'s Hospital</admin:bcr>\n'
+            '        <admin:disease_code>BLCA</admin:disease_code>\n'
+            '    </admin:admin>\n'
+            '    <blca:patient>{nl}'
+            '<shared:bcr_patient_barcode preferred_name="">TCGA-XX-{patient_id}</shared:bcr_patient_barcode>{nl}'
+            '<shared:patient_id preferred_name="">{patient_id}</shared:patient_id>'
+            '{sections}\n'
+            '    </blca:patient>\n'
+            '</blca:tcga_bcr>\n').format(xmlns=xmlns, nl=nl, patient_id=patient_id,
+                                          sections=''.join(sections))
+
+
+def write_clinical_xml_files(data_dir, n_files, n_sections=30):
+    """ Write `n_files` synthetic clinical files to `data_dir`, in the
+        `data_dir/<file_id>/<filename>` layout used for downloads. Returns their paths.
+    """
+    import os
+    paths = list()
+    for i in range(n_files):
+        file_id = '{:08d}-0000-0000-0000-000000000000'.format(i)
+        os.makedirs(os.path.join(data_dir, file_id))
+        path = os.path.join(data_dir, file_id, 'nationwidechildrens.org_clinical.TCGA-XX-{:04d}.xml'.format(i))
+        with open(path, 'w') as f:
+            f.write(make_clinical_xml(seed=i, n_sections=n_sections, patient_id='{:04d}'.format(i)))
+        paths.append(path)
+    return paths
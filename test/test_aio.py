@@ -0,0 +1,105 @@
+from query_tcga import aio
+from query_tcga import api
+from query_tcga import query_tcga as qt
+from query_tcga import cache
+from test.gdc_stub import (StubGDCServer, settings, files_route, hits_route, make_file_hit,
+                           make_manifest_rows)
+import asyncio
+import json
+import pytest
+
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+def test_get_fileinfo_matches_sync():
+    hits = [make_file_hit('file-{}'.format(i)) for i in range(30)]
+    with StubGDCServer(routes={'files': hits_route(hits)}) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=1000, RATE_LIMIT_BURST=1000):
+        expected = api.get_fileinfo(['file-1', 'file-2'], format='json')
+
+        async def main():
+            async with aio.AsyncGDCClient(max_connections=5) as client:
+                return await asyncio.gather(*[client.get_fileinfo([hit['file_id']], format='json')
+                                              for hit in hits])
+        results = run(main())
+        async def pair():
+            async with aio.AsyncGDCClient() as client:
+                return await client.get_fileinfo(['file-1', 'file-2'], format='json')
+        assert run(pair()) == expected
+    assert [res[0]['file_id'] for res in results] == [hit['file_id'] for hit in hits]
+
+
+def test_requests_bounded_by_max_connections():
+    hits = [make_file_hit('file-{}'.format(i)) for i in range(20)]
+    with StubGDCServer(routes={'files': hits_route(hits)}, latency=0.05) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=1000, RATE_LIMIT_BURST=1000):
+        async def main():
+            async with aio.AsyncGDCClient(max_connections=3) as client:
+                await asyncio.gather(*[client.get_data('files', query_args={'files.file_id': hit['file_id']})
+                                       for hit in hits])
+        run(main())
+    assert len(server.requests) == 20
+    assert 1 < server.max_in_flight <= 3
+
+
+def test_get_manifest_matches_sync():
+    rows = make_manifest_rows(45)
+    with StubGDCServer(routes={'files': files_route(rows)}) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=1000, RATE_LIMIT_BURST=1000,
+                     MAX_PAGE_SIZE=10):
+        expected = qt.get_manifest(n=33, max_workers=1)
+
+        async def main():
+            async with aio.AsyncGDCClient() as client:
+                return await client.get_manifest(n=33)
+        assert run(main()) == expected
+    assert len(expected.splitlines()) == 34
+
+
+def test_list_valid_options():
+    def route(request):
+        facet = request.params['facets']
+        body = {'data': {'aggregations': {facet: {'buckets': [{'key': 'Clinical'}, {'key': 'Biospecimen'}]}}}}
+        return 200, {'Content-Type': 'application/json'}, json.dumps(body)
+    with StubGDCServer(routes={'files': route}) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=1000, RATE_LIMIT_BURST=1000):
+        async def main():
+            async with aio.AsyncGDCClient() as client:
+                return await client.list_valid_options('files.data_category', endpoint_name='files')
+        assert run(main()) == ['Clinical', 'Biospecimen']
+    assert server.requests[0].params['facets'] == 'data_category'
+
+
+def test_rate_limiter_waits_without_blocking():
+    bucket = cache.TokenBucket(rate=20, burst=1)
+    limiter = aio.AsyncRateLimiter(bucket)
+
+    async def main():
+        ticks = []
+        async def ticker():
+            for _ in range(5):
+                ticks.append(1)
+                await asyncio.sleep(0.01)
+        waits = await asyncio.gather(limiter.acquire(), limiter.acquire(), limiter.acquire(), ticker())
+        return waits[:3], ticks
+    waits, ticks = run(main())
+    assert waits[0] == 0
+    assert waits[2] == pytest.approx(0.1, abs=0.02)
+    assert len(ticks) == 5
+
+
+def test_cancelled_request_frees_connection():
+    hits = [make_file_hit('file-0')]
+    with StubGDCServer(routes={'files': hits_route(hits)}, latency=0.3) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=1000, RATE_LIMIT_BURST=1000):
+        async def main():
+            async with aio.AsyncGDCClient(max_connections=1) as client:
+                slow = asyncio.ensure_future(client.get_data('files'))
+                await asyncio.sleep(0.05)
+                slow.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await slow
+                return await asyncio.wait_for(client.get_fileinfo(['file-0'], format='json'), timeout=2)
+        assert run(main())[0]['file_id'] == 'file-0'
@@ -3,6 +3,7 @@ from query_tcga import query_tcga as qt
 from query_tcga import config
 import pandas as pd
 import logging
+from test.gdc_stub import StubGDCServer, settings, hits_route, make_file_hit
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -13,7 +14,8 @@ TEST_CLIN_FILE_ID='6082fbb4-1f13-4e58-a0fb-33574354b74b'
 TEST_DATA_DIR='test/test_data'
 config.set_value(
      GDC_DATA_DIR=TEST_DATA_DIR,
-     GDC_TOKEN_PATH='/Users/jacquelineburos/Downloads/gdc-user-token.2016-09-26T12-23-27-04-00.txt'
+     GDC_TOKEN_PATH='/Users/jacquelineburos/Downloads/gdc-user-token.2016-09-26T12-23-27-04-00.txt',
+     USE_METADATA_STORE=False,
      )
 
 
@@ -63,3 +65,131 @@ def test_get_fileinfo_data_file_details():
     assert len(res.index)==1
 
     
+
+
+def _stub_file_ids(n):
+    return ['{:08d}-aaaa-bbbb-cccc-000000000000'.format(i) for i in range(n)]
+
+
+def test_get_data_uses_get_for_small_filters():
+    with StubGDCServer() as server, settings(GDC_API_ENDPOINT=server.endpoint):
+        api.get_data(endpoint_name='files', query_args={'files.file_id': _stub_file_ids(2)})
+    assert [r.method for r in server.requests] == ['GET']
+
+
+def test_get_data_uses_post_for_large_filters():
+    file_ids = _stub_file_ids(500)
+    with StubGDCServer() as server, settings(GDC_API_ENDPOINT=server.endpoint):
+        api.get_data(endpoint_name='files', query_args={'files.file_id': file_ids}, size=500)
+    assert [r.method for r in server.requests] == ['POST']
+    body = server.requests[0].json()
+    assert body['filters']['content'][0]['content']['value'] == file_ids
+    assert body['size'] == 500
+
+
+def test_get_data_method_override():
+    with StubGDCServer() as server, settings(GDC_API_ENDPOINT=server.endpoint):
+        api.get_data(endpoint_name='files', query_args={'files.file_id': _stub_file_ids(1)}, method='POST')
+    assert [r.method for r in server.requests] == ['POST']
+
+
+def test_get_fileinfo_data_large_lookup_uses_few_requests():
+    file_ids = _stub_file_ids(10000)
+    hits = [make_file_hit(file_id) for file_id in file_ids]
+    with StubGDCServer(routes={'files': hits_route(hits)}) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=100, RATE_LIMIT_BURST=100):
+        res = api.get_fileinfo_data(file_id=file_ids, chunk_size=2000)
+    assert len(server.requests) == 5
+    assert sorted(res['file_id']) == file_ids
+
+
+def test_get_fileinfo_data_fetches_chunks_concurrently():
+    file_ids = _stub_file_ids(40)
+    hits = [make_file_hit(file_id) for file_id in file_ids]
+    with StubGDCServer(routes={'files': hits_route(hits)}, latency=0.2) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=100, RATE_LIMIT_BURST=100):
+        res = api.get_fileinfo_data(file_id=file_ids, chunk_size=10, max_workers=4)
+    assert server.max_in_flight > 1
+    assert list(res['file_id']) == file_ids
+    assert len(res.attrs['chunk_latency']) == 4
+
+
+def test_flatten_fileinfo_hits_first_case():
+    hits = [make_file_hit('f1', n_cases=2, n_samples=2), make_file_hit('f2')]
+    res = api._flatten_fileinfo_hits(hits)
+    assert list(res['file_id']) == ['f1', 'f2']
+    assert list(res['case_id']) == ['f1-case0', 'f2-case0']
+    assert list(res['analysis_id']) == ['f1-analysis', 'f2-analysis']
+    assert 'cases' not in res.columns
+
+
+def test_flatten_fileinfo_hits_explode():
+    hits = [make_file_hit('f1', n_cases=2, n_samples=3), make_file_hit('f2'), {'file_id': 'f3'}]
+    res = api._flatten_fileinfo_hits(hits, explode=True)
+    assert len(res.index) == 2*3 + 1 + 1
+    assert list(res['file_id']) == ['f1']*6 + ['f2', 'f3']
+    assert res.loc[res['file_id'] == 'f1', 'samples.sample_id'].nunique() == 6
+    assert res.loc[res['file_id'] == 'f3', 'case_id'].isnull().all()
+
+
+def _flatten_per_hit(hits):
+    """ Former (per-hit) flattening of fileinfo hits: later keys overwrite earlier ones
+    """
+    rows = list()
+    for hit in hits:
+        row = dict()
+        for (k, v) in hit.items():
+            if k == 'cases':
+                row.update(hit['cases'][0])
+            elif k == 'analysis':
+                row.update(hit['analysis'])
+            else:
+                row[k] = v
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def test_flatten_fileinfo_hits_overlapping_fields():
+    hits = [{'file_id': 'f1', 'state': 'live', 'updated_datetime': 'file-1',
+             'analysis': {'analysis_id': 'a1', 'updated_datetime': 'analysis-1'},
+             'cases': [{'case_id': 'c1', 'state': 'released', 'updated_datetime': 'case-1'}]},
+            ## nested records listed before the file's own fields
+            {'cases': [{'case_id': 'c2', 'state': 'released'}],
+             'analysis': {'analysis_id': 'a2', 'updated_datetime': 'analysis-2'},
+             'file_id': 'f2', 'state': 'live', 'updated_datetime': 'file-2'},
+            ## field missing from the case
+            {'file_id': 'f3', 'state': 'live', 'cases': [{'case_id': 'c3'}]}]
+    res = api._flatten_fileinfo_hits(hits)
+    expected = _flatten_per_hit(hits)
+    assert list(res['state']) == list(expected['state']) == ['released', 'live', 'live']
+    assert list(res['updated_datetime'].fillna('')) == list(expected['updated_datetime'].fillna('')) \
+        == ['case-1', 'file-2', '']
+    exploded = api._flatten_fileinfo_hits(hits, explode=True)
+    assert list(exploded['state']) == ['released', 'live', 'live']
+    assert list(exploded['case_id']) == ['c1', 'c2', 'c3']
+
+
+def _stub_case_hit(case_id, n_files=3, n_samples=2):
+    ## every file of a case lists the same samples, as the GDC does
+    samples = [{'sample_id': '{}-sample{}'.format(case_id, s), 'sample_type': 'Primary Tumor'}
+               for s in range(n_samples)]
+    return {'case_id': case_id, 'files': [{'cases': [{'samples': samples}]} for f in range(n_files)]}
+
+
+def test_describe_samples_batches_cases():
+    case_ids = ['case{:03d}'.format(i) for i in range(250)]
+    hits = [_stub_case_hit(case_id) for case_id in case_ids]
+    with StubGDCServer(routes={'cases': hits_route(hits, field='cases.case_id', key='case_id')}) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=100, RATE_LIMIT_BURST=100):
+        res = api._describe_samples(case_ids, chunk_size=100)
+    assert len(server.requests) == 3
+    assert len(res.index) == 250*2
+    assert res['sample_id'].is_unique
+
+
+def test_dedupe_case_samples():
+    hit = dict(_stub_case_hit('case0', n_files=3, n_samples=2), updated_datetime='2016-01-01')
+    res = api._dedupe_case_samples(hit)
+    assert [sample['sample_id'] for sample in api._iter_sample_records([res])] == ['case0-sample0', 'case0-sample1']
+    assert (res['case_id'], res['updated_datetime']) == ('case0', '2016-01-01')
+    assert len(hit['files']) == 3
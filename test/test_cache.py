@@ -0,0 +1,209 @@
+from query_tcga import cache
+from test.gdc_stub import StubGDCServer, settings
+import pytest
+
+
+class FakeClock(object):
+    """ Clock that only advances when `sleep` is called
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket_allows_burst():
+    clock = FakeClock()
+    bucket = cache.TokenBucket(rate=1, burst=3, clock=clock, sleep=clock.sleep)
+    waits = [bucket.acquire() for i in range(3)]
+    assert waits == [0, 0, 0]
+    assert clock() == 0
+
+
+def test_token_bucket_limits_sustained_rate():
+    clock = FakeClock()
+    bucket = cache.TokenBucket(rate=4, burst=2, clock=clock, sleep=clock.sleep)
+    [bucket.acquire() for i in range(10)]
+    ## 2 free from the burst, then 8 at 4 per second
+    assert clock() == pytest.approx(2.0)
+
+
+def test_token_bucket_refills_when_idle():
+    clock = FakeClock()
+    bucket = cache.TokenBucket(rate=1, burst=2, clock=clock, sleep=clock.sleep)
+    bucket.acquire(2)
+    clock.now += 10
+    assert bucket.acquire(2) == 0
+
+
+def test_token_bucket_rejects_bad_settings():
+    with pytest.raises(ValueError):
+        cache.TokenBucket(rate=0)
+    with pytest.raises(ValueError):
+        cache.TokenBucket(rate=1, burst=0.5)
+
+
+def test_rate_limiter_follows_settings():
+    with settings(RATE_LIMIT=7, RATE_LIMIT_BURST=3):
+        limiter = cache.get_rate_limiter()
+        assert (limiter.rate, limiter.burst) == (7, 3)
+        assert cache.get_rate_limiter() is limiter
+
+
+def test_requests_get_and_post_use_stub_server():
+    with StubGDCServer() as server:
+        url = server.endpoint.format(endpoint='files')
+        assert cache.requests_get(url).status_code == 200
+        assert cache.requests_post(url, json={}).status_code == 200
+    assert [r.method for r in server.requests] == ['GET', 'POST']
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def _policy(**kwargs):
+    kwargs.setdefault('max_retries', {'connection': 2, 'rate_limited': 3, 'server_error': 2})
+    return cache.RetryPolicy(backoff=1, max_backoff=3, metrics=cache.RetryMetrics(), jitter=lambda: 1, **kwargs)
+
+
+def test_retry_policy_backs_off_exponentially_with_cap():
+    policy = _policy()
+    waits = [policy.next_wait(response=FakeResponse(429)) for i in range(4)]
+    assert waits == [1, 2, 3, None]
+    assert policy.metrics.as_dict()['rate_limited'] == 3
+    assert policy.metrics.as_dict()['gave_up'] == 1
+    assert policy.metrics.as_dict()['wait_seconds'] == 6
+
+
+def test_retry_policy_counts_attempts_per_status_class():
+    policy = _policy()
+    assert policy.next_wait(response=FakeResponse(503)) == 1
+    assert policy.next_wait(error=cache.requests.ConnectionError()) == 1
+    assert policy.next_wait(response=FakeResponse(500)) == 2
+    assert policy.next_wait(response=FakeResponse(502)) is None
+    assert policy.next_wait(error=cache.requests.Timeout()) == 2
+
+
+def test_retry_policy_does_not_retry_other_errors():
+    policy = _policy()
+    assert policy.next_wait(response=FakeResponse(200)) is None
+    assert policy.next_wait(response=FakeResponse(404)) is None
+    assert policy.next_wait(error=cache.requests.exceptions.InvalidURL()) is None
+    assert policy.metrics.as_dict()['gave_up'] == 0
+
+
+def test_retry_policy_honors_retry_after():
+    policy = _policy()
+    assert policy.next_wait(response=FakeResponse(429, {'Retry-After': '7'})) == 7
+    when = cache.email.utils.formatdate(cache.time.time() + 30, usegmt=True)
+    assert policy.next_wait(response=FakeResponse(503, {'Retry-After': when})) == pytest.approx(30, abs=2)
+
+
+def test_send_with_retries_raises_last_connection_error():
+    calls = []
+    def send():
+        calls.append(1)
+        raise cache.requests.ConnectionError('reset')
+    sleeps = []
+    with pytest.raises(cache.requests.ConnectionError):
+        cache.send_with_retries(send, policy=_policy(), sleep=sleeps.append)
+    assert len(calls) == 3
+    assert sleeps == [1, 2]
+
+
+def test_requests_get_retries_server_errors():
+    statuses = [503, 429, 200]
+    def route(request):
+        return statuses.pop(0), {'Retry-After': '0'} if statuses else {}, '{}'
+    cache.reset_retry_metrics()
+    with StubGDCServer(routes={'files': route}) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=1000, RATE_LIMIT_BURST=1000,
+                     RETRY_BACKOFF=0.01, USE_CACHE=False):
+        response = cache.requests_get(server.url + '/files', params={'retry': 'test'})
+    assert response.status_code == 200
+    assert len(server.requests) == 3
+    metrics = cache.get_retry_metrics()
+    assert (metrics['server_error'], metrics['rate_limited'], metrics['gave_up']) == (1, 1, 0)
+
+
+def _counting_route(request):
+    return 200, {'Content-Type': 'application/json'}, '{"n": %d}' % len(request.path)
+
+
+def _cache_settings(server, **kwargs):
+    values = dict(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=1000, RATE_LIMIT_BURST=1000,
+                  USE_CACHE=True, CACHE_BACKEND='memory', CACHE_PATH='test_http_cache', CACHE_MAX_ENTRIES=100,
+                  CACHE_TTLS={'_mapping': None, 'files': 60, 'cases': 0, 'default': 60})
+    values.update(kwargs)
+    return settings(**values)
+
+
+def test_http_cache_ttls_by_endpoint():
+    routes = dict((name, _counting_route) for name in ['files', 'cases'])
+    with StubGDCServer(routes=routes) as server, _cache_settings(server):
+        cache.clear()
+        for i in range(2):
+            cache.requests_get(server.url + '/files', params={'size': 1})
+            cache.requests_get(server.url + '/files/_mapping')
+            cache.requests_get(server.url + '/cases', params={'size': 1})
+        paths = [request.path for request in server.requests]
+        assert paths == ['/files', '/files/_mapping', '/cases', '/cases']
+        assert cache.stats()['entries'] == 2
+
+
+def test_http_cache_skips_manifests_and_counts():
+    with StubGDCServer(routes={'files': _counting_route}) as server, _cache_settings(server):
+        cache.clear()
+        for i in range(2):
+            cache.requests_post(server.url + '/files', json={'return_type': 'manifest', 'size': 1})
+            cache.requests_post(server.url + '/files', json={'size': 0})
+            cache.requests_get(server.url + '/files', params={'return_type': 'manifest'})
+            cache.requests_get(server.url + '/files', params={'facets': 'data_type', 'size': 0})
+            cache.requests_post(server.url + '/files', json={'size': 1})
+        assert len(server.requests) == 9
+        assert cache.stats()['entries'] == 1
+
+
+def test_http_cache_clear_by_endpoint():
+    routes = dict((name, _counting_route) for name in ['files', 'projects'])
+    with StubGDCServer(routes=routes) as server, _cache_settings(server):
+        cache.clear()
+        cache.requests_get(server.url + '/files', params={'size': 1})
+        cache.requests_get(server.url + '/files/_mapping')
+        cache.requests_get(server.url + '/projects')
+        assert cache.clear(endpoint='_mapping') == 1
+        assert cache.clear(endpoint='files') == 1
+        assert cache.stats()['entries'] == 1
+
+
+def test_http_cache_evicts_least_recently_used():
+    with StubGDCServer(routes={'files': _counting_route}) as server, _cache_settings(server, CACHE_MAX_ENTRIES=10):
+        cache.clear()
+        evicted = cache.stats()['evicted']
+        for i in range(10):
+            cache.requests_get(server.url + '/files', params={'page': i})
+        cache.requests_get(server.url + '/files', params={'page': 0}) ## most recently used
+        cache.requests_get(server.url + '/files', params={'page': 10})
+        res = cache.stats()
+        assert res['entries'] == 9
+        assert res['evicted'] - evicted == 2
+        n_requests = len(server.requests)
+        cache.requests_get(server.url + '/files', params={'page': 0})
+        assert len(server.requests) == n_requests
+        cache.requests_get(server.url + '/files', params={'page': 1})
+        assert len(server.requests) == n_requests + 1
+
+
+def test_http_cache_disabled():
+    with StubGDCServer(routes={'files': _counting_route}) as server, _cache_settings(server, USE_CACHE=False):
+        cache.requests_get(server.url + '/files')
+        cache.requests_get(server.url + '/files')
+        assert len(server.requests) == 2
+        assert cache.stats()['enabled'] is False
@@ -0,0 +1,170 @@
+from query_tcga import clinical_xml
+from query_tcga import query_tcga as qt
+from test.synthetic_clinical import make_clinical_xml
+from test.gdc_stub import settings
+import pytest
+
+
+def _parse_both(tmp_path, text, **kwargs):
+    path = tmp_path / 'clinical.xml'
+    path.write_text(text)
+    data, patient_id = clinical_xml.parse_clinical_xml(str(path), **kwargs)
+    soup = qt._read_xml_bs(str(path))
+    expected = qt._parse_clin_data_soup(soup, **kwargs)
+    expected_patient_id = soup.findChild('patient_id').text
+    return (list(data.items()), patient_id), (list(expected.items()), expected_patient_id)
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_parse_clinical_xml_matches_bs4(tmp_path, seed):
+    res, expected = _parse_both(tmp_path, make_clinical_xml(seed=seed))
+    assert res == expected
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_parse_clinical_xml_matches_bs4_not_preferred_only(tmp_path, seed):
+    res, expected = _parse_both(tmp_path, make_clinical_xml(seed=seed), preferred_only=False)
+    assert res == expected
+
+
+def test_parse_clinical_xml_edge_cases(tmp_path):
+    text = '''<?xml version="1.0"?>
+<r xmlns:a="urn:a"><a:admin><a:patient_id>ignored</a:patient_id></a:admin>
+<a:patient>
+   <a:t preferred_name="t">  hello <!-- c --> world  <a:u preferred_name="u">x &amp; y</a:u>
+      tail  </a:t>
+   <a:s preferred_name="s"><![CDATA[cdata here]]></a:s>
+   <a:w preferred_name="w">   </a:w>
+   <a:e preferred_name="e"/>
+   <a:n preferred_name="n">a<a:m preferred_name="m">b</a:m></a:n>
+   <a:o preferred_name="o"><a:p preferred_name="p">only child</a:p></a:o>
+   <a:t preferred_name="t">overwritten</a:t>
+</a:patient></r>'''
+    res, expected = _parse_both(tmp_path, text)
+    assert res == expected
+    assert res[1] == 'ignored'
+    assert dict(res[0])['t'] == 'overwritten'
+    assert 'p' not in dict(res[0])
+
+
+def test_get_clinical_data_process_pool_matches_serial(tmp_path):
+    import pandas as pd
+    from query_tcga.super_list import L
+    from query_tcga import helpers
+    from test.synthetic_clinical import write_clinical_xml_files
+    xml_files = L(write_clinical_xml_files(str(tmp_path), n_files=12, n_sections=10))
+    file_ids = helpers.convert_to_file_id(xml_files)
+    xml_files.fileinfo = pd.DataFrame({'file_id': file_ids,
+                                       'case_id': ['case-{}'.format(i) for i in range(12)],
+                                       'submitter_id': ['TCGA-XX-{:04d}'.format(i) for i in range(12)]})
+    serial = qt.get_clinical_data(xml_files=xml_files)
+    pooled = qt.get_clinical_data(xml_files=xml_files, workers=3)
+    pd.testing.assert_frame_equal(serial, pooled)
+    assert list(pooled['case_id']) == ['case-{}'.format(i) for i in range(12)]
+
+
+def test_get_clinical_data_from_file_uses_fileinfo_index(tmp_path, monkeypatch):
+    from test.synthetic_clinical import write_clinical_xml_files
+    from query_tcga import helpers
+    (path,) = write_clinical_xml_files(str(tmp_path), n_files=1, n_sections=5)
+    file_id = helpers.convert_to_file_id(path)[0]
+    monkeypatch.setattr(qt.api, 'get_fileinfo_data', lambda **kwargs: pytest.fail('fileinfo re-fetched'))
+    data = qt.get_clinical_data_from_file(path, fileinfo={file_id: {'case_id': 'c0', 'submitter_id': 's0'}})
+    assert (data['case_id'], data['submitter_id']) == ('c0', 's0')
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_get_clinical_data_fetches_missing_fileinfo_once(tmp_path, monkeypatch, workers):
+    import pandas as pd
+    from query_tcga.super_list import L
+    from query_tcga import helpers
+    from test.synthetic_clinical import write_clinical_xml_files
+    xml_files = L(write_clinical_xml_files(str(tmp_path), n_files=4, n_sections=5))
+    file_ids = helpers.convert_to_file_id(xml_files)
+    fileinfo = pd.DataFrame({'file_id': file_ids,
+                             'case_id': ['case-{}'.format(i) for i in range(4)],
+                             'submitter_id': ['TCGA-XX-{:04d}'.format(i) for i in range(4)]})
+    xml_files.fileinfo = fileinfo.iloc[:2]
+    requests = list()
+    def get_fileinfo_data(file_id, **kwargs):
+        requests.append(file_id)
+        return fileinfo.loc[fileinfo['file_id'].isin(file_id)]
+    monkeypatch.setattr(qt.api, 'get_fileinfo_data', get_fileinfo_data)
+    data = qt.get_clinical_data(xml_files=xml_files, workers=workers)
+    assert requests == [file_ids[2:]]
+    assert list(data['case_id']) == ['case-{}'.format(i) for i in range(4)]
+
+def test_update_clinical_data_parses_only_new_or_changed_files(tmp_path, monkeypatch):
+    import pandas as pd
+    from test.synthetic_clinical import write_clinical_xml_files, make_clinical_xml
+    paths = write_clinical_xml_files(str(tmp_path / 'v1'), n_files=6, n_sections=5)
+    monkeypatch.setattr(qt.api, 'get_fileinfo_data', lambda **kwargs: pd.DataFrame())
+    monkeypatch.setattr(qt.integrity, 'get_hash_store',
+                        lambda: qt.integrity.HashStore(str(tmp_path / 'verified.sqlite')))
+    clinical_data, clinical_index = qt.update_clinical_data(paths[:5])
+    assert len(clinical_data.index) == 5
+    assert list(clinical_index.columns) == qt.CLINICAL_INDEX_COLUMNS
+
+    ## change one file, drop another & add a new one
+    with open(paths[1], 'w') as f:
+        f.write(make_clinical_xml(seed=100, n_sections=5, patient_id='changed'))
+    current = [paths[0], paths[1], paths[2], paths[3], paths[5]]
+    parsed = list()
+    parse = qt.get_clinical_data_from_file
+    monkeypatch.setattr(qt, 'get_clinical_data_from_file',
+                        lambda xml_file, **kwargs: parsed.append(xml_file) or parse(xml_file, **kwargs))
+    updated, updated_index = qt.update_clinical_data(current, clinical_data=clinical_data,
+                                                     clinical_index=clinical_index)
+    assert sorted(parsed) == sorted([paths[1], paths[5]])
+    assert list(updated_index['file_id']) == qt.helpers.convert_to_file_id(current)
+    assert (updated_index.set_index('file_id')['parsed_at'][qt.helpers.convert_to_file_id(paths[0])[0]]
+            == clinical_index.set_index('file_id')['parsed_at'][qt.helpers.convert_to_file_id(paths[0])[0]])
+
+    def normalize(df):
+        ## dtypes of mixed columns may differ between merged & rebuilt data, e.g. -1.0 vs '-1'
+        def value(x):
+            try:
+                return float(x)
+            except (TypeError, ValueError):
+                return str(x)
+        df = df.sort_values('_source_desc').reset_index(drop=True)
+        return df.loc[:, sorted(df.columns)].astype(object).apply(lambda column: column.map(value))
+
+    rebuilt = qt.get_clinical_data(xml_files=current)
+    pd.testing.assert_frame_equal(normalize(updated), normalize(rebuilt))
+    assert 'changed' in set(updated['patient_id'].astype(str))
+
+
+def test_update_clinical_data_records_md5_of_parsed_file(tmp_path, monkeypatch):
+    import pandas as pd
+    from query_tcga.super_list import L
+    from test.synthetic_clinical import write_clinical_xml_files
+    paths = L(write_clinical_xml_files(str(tmp_path / 'v1'), n_files=2, n_sections=5))
+    file_ids = qt.helpers.convert_to_file_id(list(paths))
+    ## the manifest lists a newer version of the 1st file than was downloaded
+    paths.manifest = pd.DataFrame({'id': file_ids, 'md5': ['0' * 32, qt.integrity.file_md5(paths[1])]})
+    monkeypatch.setattr(qt.api, 'get_fileinfo_data', lambda **kwargs: pd.DataFrame())
+    with settings(VERIFY_CACHE_PATH=str(tmp_path / 'verified.sqlite')):
+        clinical_data, clinical_index = qt.update_clinical_data(paths)
+        assert list(clinical_index['md5']) == [qt.integrity.file_md5(path) for path in paths]
+
+        ## once the newer version is downloaded, it is parsed again
+        with open(paths[0], 'a') as f:
+            f.write('\n')
+        parsed = list()
+        parse = qt.get_clinical_data_from_file
+        monkeypatch.setattr(qt, 'get_clinical_data_from_file',
+                            lambda xml_file, **kwargs: parsed.append(xml_file) or parse(xml_file, **kwargs))
+        qt.update_clinical_data(paths, clinical_data=clinical_data, clinical_index=clinical_index)
+    assert parsed == [paths[0]]
+
+
+def test_convert_to_categorical_handles_string_columns():
+    import pandas as pd
+    for dtype in [object, 'str']:
+        series = pd.Series(['Alive', 'Dead', 'Alive', None], dtype=dtype)
+        assert qt._convert_to_categorical(series).dtype == 'category'
+    many = pd.Series(['value-{}'.format(i) for i in range(10)], dtype='str')
+    assert qt._convert_to_categorical(many).dtype == many.dtype
+    numbers = pd.Series([1.0, 2.0])
+    assert qt._convert_to_categorical(numbers) is numbers
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('cohorts')
+from query_tcga import cohort
+
+nan = np.nan
+
+## (case_id, vital_status, treatment_outcome_at_tcga_followup,
+##  last_contact_days_to, death_days_to, new_tumor_event_dx_days_to)
+ROWS = [
+    ('alive-cr', 'Alive', 'Complete Response', 500, nan, nan),
+    ('dead-progressed-no-contact', 'Dead', 'Progressive Disease', nan, 300, 100),
+    ('dead-progressed-after-death', 'Dead', 'Progressive Disease', 400, 200, 600),
+    ('alive-stable-no-progression', 'Alive', 'Stable Disease', 700, nan, nan),
+    ('dead-only-death-known', 'Dead', 'Progressive Disease', nan, 250, nan),
+]
+
+## expected values, as computed by the former per-row `build_cohort_patient`:
+## case_id -> (deceased, progressed, os, pfs (capped at os), benefit, censor_time, uncapped pfs)
+EXPECTED = {
+    'alive-cr': (False, False, 500, 500, False, 500, 500),
+    'dead-progressed-no-contact': (True, True, 300, 100, True, 100, 100),
+    'dead-progressed-after-death': (True, True, 200, 200, True, 200, 600),
+    'alive-stable-no-progression': (False, True, 700, 700, False, 700, 700),
+    ## max(nan, 250, nan) keeps the leading nan, so censor_time is unknown
+    'dead-only-death-known': (True, True, 250, 250, True, nan, 250),
+}
+
+
+def make_clinical_data(rows=ROWS):
+    data = pd.DataFrame(rows, columns=['case_id', 'vital_status', 'treatment_outcome_at_tcga_followup',
+                                       'last_contact_days_to', 'death_days_to', 'new_tumor_event_dx_days_to'])
+    data['birth_days_to'] = -365.25 * 60
+    data['patient_id'] = data['case_id']
+    return data
+
+
+def _same(a, b):
+    return (np.isnan(a) and np.isnan(b)) or a == b
+
+
+def test_build_cohort_patients_matches_per_row_outcomes():
+    patients = cohort.build_cohort_patients(make_clinical_data(), benefit_days=365.25)
+    assert [patient.id for patient in patients] == [row[0] for row in ROWS]
+    for patient in patients:
+        (deceased, progressed, os, pfs, benefit, censor_time, uncapped_pfs) = EXPECTED[patient.id]
+        assert (patient.deceased, patient.progressed, patient.os, patient.pfs, patient.benefit) == \
+            (deceased, progressed, os, pfs, benefit)
+        assert _same(patient.additional_data['censor_time'], censor_time)
+        assert patient.additional_data['pfs'] == uncapped_pfs
+        assert patient.additional_data['os'] == os
+        assert patient.additional_data['age'] == 60
+
+
+def test_build_cohort_patient_single_row():
+    row = make_clinical_data().iloc[2]
+    patient = cohort.build_cohort_patient(row, benefit_days=100)
+    assert (patient.os, patient.pfs, patient.benefit) == (200, 200, False)
+
+
+def test_build_cohort_patients_asserts_outcomes_known():
+    data = make_clinical_data(ROWS + [('unknown', 'Dead', 'Progressive Disease', nan, nan, nan)])
+    with pytest.raises(AssertionError) as e:
+        cohort.build_cohort_patients(data, benefit_days=365.25)
+    assert 'PFS is NaN' in str(e.value)
+    assert "'unknown'" in str(e.value)
+
+
+def test_check_outcomes_asserts_pfs_not_after_os():
+    outcomes = pd.DataFrame({'case_id': ['ok', 'bad'], '_pfs': [10.0, 30.0], 'os': [20.0, 20.0]})
+    with pytest.raises(AssertionError) as e:
+        cohort._check_outcomes(outcomes)
+    assert "PFS is not <= OS for Patients ['bad']" in str(e.value)
+    outcomes = pd.DataFrame({'case_id': ['no-os'], '_pfs': [10.0], 'os': [nan]})
+    with pytest.raises(AssertionError) as e:
+        cohort._check_outcomes(outcomes)
+    assert 'OS is NaN' in str(e.value)
+
+
+def test_load_clinical_data_passes_workers_to_parser_only(monkeypatch):
+    calls = dict()
+    def download_clinical_files(project_name, n=None, data_dir=None, **kwargs):
+        calls['download'] = dict(kwargs, n=n)
+        return ['clinical.xml']
+    def update_clinical_data(xml_files, clinical_data=None, clinical_index=None, workers=None):
+        calls['update'] = workers
+        return (make_clinical_data(), None)
+    monkeypatch.setattr(cohort.qt, 'download_clinical_files', download_clinical_files)
+    monkeypatch.setattr(cohort.qt, 'update_clinical_data', update_clinical_data)
+    cohort._load_clinical_data(project_name='TCGA-BLCA', data_dir='data', workers=4, n=2)
+    assert calls == {'download': {'n': 2}, 'update': 4}
+
+
+def test_prep_vcf_fileinfo_reads_only_needed_columns(tmp_path, monkeypatch):
+    from query_tcga import storage
+    vcf_fileinfo = pd.DataFrame({'submitter_id': ['TCGA-XX-0001-01A', 'TCGA-XX-0001-10A', 'TCGA-XX-0002-01A'],
+                                 'filepath': ['a.vcf', 'b.vcf', 'c.vcf'],
+                                 'file_id': ['f1', 'f2', 'f3']})
+    storage.write_table(vcf_fileinfo, str(tmp_path), file_type='vcf_fileinfo')
+    read = list()
+    read_table = storage.read_table
+    monkeypatch.setattr(storage, 'read_table',
+                        lambda *args, **kwargs: read.append(kwargs.get('columns')) or read_table(*args, **kwargs))
+    res = cohort._prep_vcf_fileinfo(project_name='TCGA-XX', data_dir='data', project_data_dir=str(tmp_path))
+    assert read == [['submitter_id', 'filepath']]
+    assert res.to_dict('list') == {'patient_id': ['0001', '0002'],
+                                   'snv_vcf_paths': [['a.vcf', 'b.vcf'], ['c.vcf']]}
@@ -0,0 +1,223 @@
+from query_tcga import download
+from query_tcga import query_tcga as qt
+import collections
+import hashlib
+import os
+import pytest
+import requests
+import time
+from test.gdc_stub import StubGDCServer, settings, data_route, MANIFEST_HEADER
+
+CONTENTS = dict(('{:08d}-0000-0000-0000-000000000000'.format(i), os.urandom(1000 * (i + 1)))
+                for i in range(5))
+
+
+def _manifest(contents):
+    rows = ['\t'.join([file_id, 'file_{}.bam'.format(file_id[:8]), hashlib.md5(content).hexdigest(),
+                       str(len(content)), 'live'])
+            for (file_id, content) in sorted(contents.items())]
+    return '\n'.join([MANIFEST_HEADER] + rows)
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    ## bytes of a chunk cut short are discarded, so interrupt streams at chunk boundaries
+    monkeypatch.setattr(download, 'CHUNK_SIZE', 10)
+
+
+def _settings(server, **kwargs):
+    values = dict(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=1000, RATE_LIMIT_BURST=1000,
+                  RETRY_BACKOFF=0, DOWNLOAD_WORKERS=3)
+    values.update(kwargs)
+    return settings(**values)
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_download_manifest_in_parallel(tmpdir):
+    with StubGDCServer(routes={'data': data_route(CONTENTS)}, latency=0.1) as server, _settings(server):
+        manifest_data = qt._read_manifest(manifest_contents=_manifest(CONTENTS))
+        paths = download.download_manifest(manifest_data, data_dir=str(tmpdir))
+    assert server.max_in_flight == 3
+    assert paths == [os.path.join(str(tmpdir), file_id, filename)
+                     for (file_id, filename) in zip(manifest_data['id'], manifest_data['filename'])]
+    for (path, file_id) in zip(paths, manifest_data['id']):
+        assert _read(path) == CONTENTS[file_id]
+    assert not [name for name in os.listdir(os.path.dirname(paths[0])) if name.endswith(download.PARTIAL_SUFFIX)]
+
+
+def test_download_file_resumes_interrupted_stream(tmpdir):
+    (file_id, content) = sorted(CONTENTS.items())[-1]
+    with StubGDCServer(routes={'data': data_route(CONTENTS, interrupt_after=[1000, 1500])}) as server, \
+            _settings(server):
+        path = download.download_file(file_id, 'file.bam', data_dir=str(tmpdir), size=len(content),
+                                      sleep=lambda wait: None)
+    assert _read(path) == content
+    ranges = [request.headers.get('Range') for request in server.requests]
+    assert ranges == [None, 'bytes=1000-', 'bytes=2500-']
+
+
+def test_download_file_resumes_partial_file_from_earlier_run(tmpdir):
+    (file_id, content) = sorted(CONTENTS.items())[-1]
+    os.makedirs(os.path.join(str(tmpdir), file_id))
+    with open(os.path.join(str(tmpdir), file_id, 'file.bam' + download.PARTIAL_SUFFIX), 'wb') as f:
+        f.write(content[:1234])
+    with StubGDCServer(routes={'data': data_route(CONTENTS)}) as server, _settings(server):
+        path = download.download_file(file_id, 'file.bam', data_dir=str(tmpdir), size=len(content))
+    assert _read(path) == content
+    assert [request.headers.get('Range') for request in server.requests] == ['bytes=1234-']
+
+
+def test_download_file_restarts_if_range_ignored(tmpdir):
+    (file_id, content) = sorted(CONTENTS.items())[-1]
+    os.makedirs(os.path.join(str(tmpdir), file_id))
+    with open(os.path.join(str(tmpdir), file_id, 'file.bam' + download.PARTIAL_SUFFIX), 'wb') as f:
+        f.write(b'stale bytes')
+    with StubGDCServer(routes={'data': data_route(CONTENTS, ignore_range=True)}) as server, _settings(server):
+        path = download.download_file(file_id, 'file.bam', data_dir=str(tmpdir), size=len(content))
+    assert _read(path) == content
+
+
+def test_download_file_gives_up_after_retries(tmpdir):
+    (file_id, content) = sorted(CONTENTS.items())[0]
+    with StubGDCServer(routes={'data': data_route(CONTENTS, interrupt_after=[10] * 10)}) as server, \
+            _settings(server, RETRY_CONNECTION_ERRORS=2):
+        with pytest.raises(requests.RequestException):
+            download.download_file(file_id, 'file.bam', data_dir=str(tmpdir), size=len(content),
+                                   sleep=lambda wait: None)
+    assert len(server.requests) == 3
+    ## bytes received so far are kept, to resume later
+    assert os.path.getsize(os.path.join(str(tmpdir), file_id, 'file.bam' + download.PARTIAL_SUFFIX)) == 30
+
+
+def test_download_files_with_native_client(tmpdir):
+    manifest_contents = _manifest(CONTENTS)
+    with StubGDCServer(routes={'data': data_route(CONTENTS)}) as server, \
+            _settings(server, DOWNLOAD_CLIENT='native', VERIFY_CHECK='md5',
+                      VERIFY_CACHE_PATH=str(tmpdir.join('verified.sqlite'))):
+        downloaded = qt.download_from_manifest(manifest_contents=manifest_contents, data_dir=str(tmpdir))
+        assert len(downloaded) == len(CONTENTS)
+        ## nothing left to download
+        downloaded = qt.download_from_manifest(manifest_contents=manifest_contents, data_dir=str(tmpdir))
+        assert len(downloaded) == len(CONTENTS)
+    assert len(server.requests) == len(CONTENTS)
+
+
+LARGE_ID = 'ffffffff-0000-0000-0000-000000000000'
+LARGE = os.urandom(5500)
+
+
+def _ranges(server):
+    return sorted(request.headers.get('Range') for request in server.requests)
+
+
+def test_download_file_segmented(tmpdir):
+    contents = {LARGE_ID: LARGE}
+    with StubGDCServer(routes={'data': data_route(contents)}, latency=0.1) as server, \
+            _settings(server, SEGMENT_WORKERS=3, VERIFY_CACHE_PATH=str(tmpdir.join('verified.sqlite'))):
+        path = download.download_file_segmented(LARGE_ID, 'file.bam', data_dir=str(tmpdir), size=len(LARGE),
+                                                md5=hashlib.md5(LARGE).hexdigest(), segment_size=1000)
+    assert _read(path) == LARGE
+    assert _ranges(server) == sorted('bytes={}-{}'.format(start, min(start + 999, len(LARGE) - 1))
+                                     for start in range(0, len(LARGE), 1000))
+    assert server.max_in_flight == 3
+    assert sorted(os.listdir(os.path.dirname(path))) == ['file.bam']
+
+
+def test_download_file_segmented_resumes_from_state(tmpdir):
+    contents = {LARGE_ID: LARGE}
+    ## the 1st request (for the 1st segment) is cut short after 500 bytes, & not retried
+    with StubGDCServer(routes={'data': data_route(contents, interrupt_after=[500])}) as server, \
+            _settings(server, SEGMENT_WORKERS=1, RETRY_CONNECTION_ERRORS=0):
+        with pytest.raises(requests.RequestException):
+            download.download_file_segmented(LARGE_ID, 'file.bam', data_dir=str(tmpdir), size=len(LARGE),
+                                             segment_size=2000)
+    path = os.path.join(str(tmpdir), LARGE_ID, 'file.bam')
+    assert os.path.exists(path + download.STATE_SUFFIX)
+    assert os.path.getsize(path + download.PARTIAL_SUFFIX) == len(LARGE)
+    with StubGDCServer(routes={'data': data_route(contents)}) as server, _settings(server, SEGMENT_WORKERS=1):
+        download.download_file_segmented(LARGE_ID, 'file.bam', data_dir=str(tmpdir), size=len(LARGE),
+                                         segment_size=2000)
+    assert _read(path) == LARGE
+    ## segments after the 1st were downloaded in the 1st run
+    assert _ranges(server) == ['bytes=500-1999']
+    assert not os.path.exists(path + download.STATE_SUFFIX)
+
+
+def test_download_file_segmented_checks_md5(tmpdir):
+    with StubGDCServer(routes={'data': data_route({LARGE_ID: LARGE})}) as server, _settings(server):
+        with pytest.raises(download.DownloadError):
+            download.download_file_segmented(LARGE_ID, 'file.bam', data_dir=str(tmpdir), size=len(LARGE),
+                                             md5='0' * 32, segment_size=1000)
+    assert os.listdir(os.path.join(str(tmpdir), LARGE_ID)) == []
+
+
+def test_download_file_segmented_without_range_support(tmpdir):
+    with StubGDCServer(routes={'data': data_route({LARGE_ID: LARGE}, ignore_range=True)}) as server, \
+            _settings(server):
+        path = download.download_file_segmented(LARGE_ID, 'file.bam', data_dir=str(tmpdir), size=len(LARGE),
+                                                segment_size=1000)
+    assert _read(path) == LARGE
+    assert sorted(os.listdir(os.path.dirname(path))) == ['file.bam']
+
+
+def test_download_manifest_segments_large_files(tmpdir):
+    contents = dict(CONTENTS, **{LARGE_ID: LARGE})
+    with StubGDCServer(routes={'data': data_route(contents)}) as server, \
+            _settings(server, SEGMENT_THRESHOLD=5001, SEGMENT_SIZE=2000,
+                      VERIFY_CACHE_PATH=str(tmpdir.join('verified.sqlite'))):
+        paths = download.download_manifest(qt._read_manifest(manifest_contents=_manifest(contents)),
+                                           data_dir=str(tmpdir))
+    assert len(paths) == len(contents)
+    assert _read(paths[-1]) == LARGE
+    ranges = [request.headers.get('Range') for request in server.requests if LARGE_ID in request.path]
+    assert sorted(ranges) == ['bytes=0-1999', 'bytes=2000-3999', 'bytes=4000-5499']
+    assert len(server.requests) == len(CONTENTS) + 3
+
+
+def test_schedule_spreads_large_files_and_packs_small_ones():
+    sizes = [10, 5000, 20, 30, 8000, 40]
+    rows = [('id{}'.format(i), 'file{}'.format(i), size) for (i, size) in enumerate(sizes)]
+    batches = download.schedule(rows, max_workers=2, pack_bytes=1000)
+    assert batches == [[4], [1], [5], [0, 2], [3]]
+    assert download.schedule(rows, max_workers=1, pack_bytes=1000) == [[4], [1], [0, 2, 3, 5]]
+
+
+def test_download_progress_reports_throughput_and_eta():
+    now = [0.0]
+    tracker = download.DownloadProgress(total_bytes=1000, total_files=2, clock=lambda: now[0])
+    assert tracker.eta() is None
+    now[0] = 2.0
+    tracker.add(n_bytes=250, n_files=1)
+    assert tracker.throughput() == 125
+    assert tracker.eta() == 6
+    assert tracker.report() == 'Downloaded 0.0 of 0.0 MB (1 of 2 files) at 0.00 MB/s; 6s remaining'
+
+
+def test_download_manifest_checks_disk_space(tmpdir, monkeypatch):
+    monkeypatch.setattr(download.shutil, 'disk_usage', lambda path: collections.namedtuple(
+        'usage', ['total', 'used', 'free'])(10**6, 10**6 - 15500, 15500))
+    manifest_data = qt._read_manifest(manifest_contents=_manifest(CONTENTS))
+    with StubGDCServer(routes={'data': data_route(CONTENTS)}) as server, _settings(server, DISK_SPACE_RESERVE=1000):
+        with pytest.raises(download.DownloadError):
+            download.download_manifest(manifest_data, data_dir=str(tmpdir))
+        assert server.requests == []
+        ## bytes already received count towards the space needed
+        file_id = manifest_data['id'][0]
+        os.makedirs(os.path.join(str(tmpdir), file_id))
+        with open(os.path.join(str(tmpdir), file_id, manifest_data['filename'][0] + download.PARTIAL_SUFFIX), 'wb') as f:
+            f.write(CONTENTS[file_id])
+        assert len(download.download_manifest(manifest_data, data_dir=str(tmpdir))) == len(CONTENTS)
+
+
+def test_download_manifest_bandwidth_cap(tmpdir):
+    manifest_data = qt._read_manifest(manifest_contents=_manifest(CONTENTS))
+    with StubGDCServer(routes={'data': data_route(CONTENTS)}) as server, \
+            _settings(server, DOWNLOAD_BANDWIDTH=5000):
+        started = time.time()
+        download.download_manifest(manifest_data, data_dir=str(tmpdir))
+    ## 15000 bytes at 5000 bytes/s, after an initial burst of 5000 bytes
+    assert time.time() - started >= 1.8
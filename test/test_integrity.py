@@ -0,0 +1,63 @@
+from query_tcga import integrity
+import hashlib
+import os
+import pytest
+
+
+def _write(path, content):
+    with open(str(path), 'wb') as f:
+        f.write(content)
+    return str(path)
+
+
+@pytest.mark.parametrize('content', [b'', b'abc', os.urandom(100000)])
+def test_file_md5_in_chunks(tmpdir, content):
+    path = _write(tmpdir.join('file'), content)
+    assert integrity.file_md5(path, chunk_size=4096) == hashlib.md5(content).hexdigest()
+
+
+def test_check_files_reuses_md5_of_unchanged_files(tmpdir, monkeypatch):
+    store = integrity.HashStore(str(tmpdir.join('verified.sqlite')))
+    paths = [_write(tmpdir.join('file_{}'.format(i)), content)
+             for (i, content) in enumerate([b'first', b'second'])]
+    sizes = [5, 6]
+    md5s = [hashlib.md5(b'first').hexdigest(), hashlib.md5(b'second').hexdigest()]
+    hashed = list()
+    file_md5 = integrity.file_md5
+    monkeypatch.setattr(integrity, 'file_md5', lambda path: hashed.append(path) or file_md5(path))
+
+    assert integrity.check_files(paths, sizes, md5s, check='md5', store=store) == [True, True]
+    assert sorted(hashed) == sorted(os.path.abspath(path) for path in paths)
+    del hashed[:]
+    assert integrity.check_files(paths, sizes, md5s, check='md5', store=store) == [True, True]
+    assert hashed == []
+
+    ## same size, different content & mtime
+    _write(paths[1], b'SECOND')
+    os.utime(paths[1], (1, 1))
+    assert integrity.check_files(paths, sizes, md5s, check='md5', store=store) == [True, False]
+    assert hashed == [os.path.abspath(paths[1])]
+
+
+def test_check_files_checks_size_before_hashing(tmpdir, monkeypatch):
+    store = integrity.HashStore(str(tmpdir.join('verified.sqlite')))
+    path = _write(tmpdir.join('file'), b'trunc')
+    monkeypatch.setattr(integrity, 'file_md5', lambda path: pytest.fail('hashed a file of the wrong size'))
+    assert integrity.check_files([path, str(tmpdir.join('missing'))], [10, 10], ['x', 'x'],
+                                 check='md5', store=store) == [False, False]
+    with pytest.raises(ValueError):
+        integrity.check_files([path], [5], check='sha1')
+
+
+def test_check_files_stats_from_verify_workers(tmpdir, monkeypatch):
+    from test.gdc_stub import settings
+    path = _write(tmpdir.join('file'), b'12345')
+    workers = list()
+    map_concurrently = integrity.map_concurrently
+    monkeypatch.setattr(integrity, 'map_concurrently',
+                        lambda func, items, max_workers=None: workers.append(max_workers) or
+                        map_concurrently(func, items, max_workers=max_workers))
+    with settings(VERIFY_WORKERS=3):
+        assert integrity.check_files([path], [5]) == [True]
+        assert integrity.check_files([path], [5], max_workers=2) == [True]
+    assert workers == [3, 2]
@@ -0,0 +1,115 @@
+from query_tcga import metadata_store, api
+from test.gdc_stub import StubGDCServer, settings, hits_route, make_file_hit, request_filter_values
+import pytest
+
+FIELDS = ['file_id', 'file_name', 'cases.case_id', 'cases.samples.sample_id']
+
+
+class FakeServer(object):
+    """ Stand-in for `fetch` which records the ids requested
+    """
+    def __init__(self, hits):
+        self.hits = dict((hit['file_id'], hit) for hit in hits)
+        self.calls = list()
+
+    def __call__(self, ids, fields):
+        self.calls.append((list(ids), list(fields)))
+        return [self.hits[i] for i in ids if i in self.hits]
+
+
+def _hit(file_id, updated_datetime='2016-01-01T00:00:00'):
+    return dict(make_file_hit(file_id), updated_datetime=updated_datetime)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return metadata_store.MetadataStore(str(tmp_path / 'metadata.sqlite'), ttl=3600)
+
+
+def test_put_and_get(store):
+    store.put('files', [_hit('f1'), _hit('f2')], fields=FIELDS, id_field='file_id')
+    found, missing, stale = store.get('files', ['f1', 'f2', 'f3'], fields=FIELDS)
+    assert sorted(found) == ['f1', 'f2']
+    assert missing == ['f3']
+    assert stale == {}
+    assert 'updated_datetime' not in found['f1']
+    ## records are kept per set of fields requested
+    assert store.get('files', ['f1'], fields=['file_id'])[1] == ['f1']
+
+
+def test_find_ids_by_case_and_sample(store):
+    store.put('files', [_hit('f1'), _hit('f2')], fields=FIELDS, id_field='file_id')
+    assert store.find_ids('files', case_ids=['f1-case0']) == ['f1']
+    assert store.find_ids('files', sample_ids=['f2-case0-sample0']) == ['f2']
+
+
+def test_find_ids_for_cases_endpoint_records(store):
+    ## as returned for api.SAMPLE_FIELDS: each file of a case lists the case's samples
+    samples = [{'sample_id': 'c1-s0', 'sample_type': 'Primary Tumor'}, {'sample_id': 'c1-s1'}]
+    hits = [{'case_id': 'c1', 'files': [{'cases': [{'samples': samples}]}, {'cases': [{'samples': samples}]}]},
+            {'case_id': 'c2', 'files': []}]
+    assert list(metadata_store._iter_links(hits[0])) == [('c1', 'c1-s0'), ('c1', 'c1-s1')]
+    store.put('cases', hits, fields=api.SAMPLE_FIELDS, id_field='case_id')
+    assert store.find_ids('cases', sample_ids=['c1-s1']) == ['c1']
+    assert store.find_ids('cases', case_ids=['c1', 'c2']) == ['c1', 'c2']
+    assert store.find_ids('files', case_ids=['c1']) == []
+
+
+def test_invalidate(store):
+    store.put('files', [_hit('f1'), _hit('f2')], fields=FIELDS, id_field='file_id')
+    store.invalidate('files', ids=['f1'])
+    assert store.get('files', ['f1', 'f2'], fields=FIELDS)[1] == ['f1']
+    store.invalidate()
+    assert store.get('files', ['f2'], fields=FIELDS)[1] == ['f2']
+
+
+def test_fetch_through_store_only_fetches_missing(store, monkeypatch):
+    monkeypatch.setattr(metadata_store, 'get_store', lambda: store)
+    server = FakeServer([_hit('f1'), _hit('f2'), _hit('f3')])
+    res = metadata_store.fetch_through_store('files', ['f1', 'f2'], FIELDS, 'file_id', server)
+    assert [r['file_id'] for r in res] == ['f1', 'f2']
+    res = metadata_store.fetch_through_store('files', ['f3', 'f2', 'f1'], FIELDS, 'file_id', server)
+    assert [r['file_id'] for r in res] == ['f3', 'f2', 'f1']
+    assert [ids for (ids, fields) in server.calls] == [['f1', 'f2'], ['f3']]
+    assert 'updated_datetime' in server.calls[0][1]
+    assert 'updated_datetime' not in res[0]
+
+
+def test_fetch_through_store_checks_stale_records(store, monkeypatch):
+    monkeypatch.setattr(metadata_store, 'get_store', lambda: store)
+    server = FakeServer([_hit('f1'), _hit('f2')])
+    metadata_store.fetch_through_store('files', ['f1', 'f2'], FIELDS, 'file_id', server)
+    ## expire everything, then change f2 on the server
+    store.ttl = -1
+    server.hits['f2'] = dict(_hit('f2', updated_datetime='2017-01-01T00:00:00'), file_name='new.xml')
+    res = metadata_store.fetch_through_store('files', ['f1', 'f2'], FIELDS, 'file_id', server)
+    assert server.calls[1] == (['f1', 'f2'], ['file_id', 'updated_datetime'])
+    assert server.calls[2][0] == ['f2']
+    assert [r['file_name'] for r in res] == ['f1.xml', 'new.xml']
+
+
+def test_changed_cases_invalidate_their_files(store, monkeypatch):
+    monkeypatch.setattr(metadata_store, 'get_store', lambda: store)
+    store.put('files', [_hit('f1'), _hit('f2')], fields=FIELDS, id_field='file_id')
+    cases = {'f1-case0': {'case_id': 'f1-case0', 'updated_datetime': '2016-01-01T00:00:00'}}
+    fetch_cases = lambda ids, fields: [cases[i] for i in ids]
+    metadata_store.fetch_through_store('cases', ['f1-case0'], ['case_id'], 'case_id', fetch_cases)
+    store.ttl = -1
+    cases['f1-case0'] = dict(cases['f1-case0'], updated_datetime='2017-01-01T00:00:00')
+    metadata_store.fetch_through_store('cases', ['f1-case0'], ['case_id'], 'case_id', fetch_cases)
+    store.ttl = 3600
+    assert store.get('files', ['f1', 'f2'], fields=FIELDS)[1] == ['f1']
+
+def test_get_fileinfo_data_reads_from_store(tmp_path):
+    file_ids = ['f{}'.format(i) for i in range(20)]
+    hits = [_hit(file_id) for file_id in file_ids]
+    with StubGDCServer(routes={'files': hits_route(hits)}) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, USE_METADATA_STORE=True,
+                     METADATA_STORE_PATH=str(tmp_path / 'metadata.sqlite'),
+                     RATE_LIMIT=100, RATE_LIMIT_BURST=100):
+        first = api.get_fileinfo_data(file_ids[0:10])
+        second = api.get_fileinfo_data(file_ids)
+    assert len(server.requests) == 2
+    assert request_filter_values(server.requests[1], 'files.file_id') == file_ids[10:]
+    assert list(second['file_id']) == file_ids
+    assert list(first['file_id']) == file_ids[0:10]
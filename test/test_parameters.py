@@ -86,3 +86,45 @@ def test_verify_data_list():
                                 allowed_values=valid_options) == True
     with pytest.raises(ValueError):
         parameters._verify_data_list(['TCGA-BLCA'], allowed_values=['Clinical'])
+
+
+def _schema_route(request):
+    import json
+    if request.path.endswith('/_mapping'):
+        body = {'_mapping': {'files.data_category': {}, 'files.data_type': {}, 'files.file_id': {}}}
+    else:
+        facet = request.params['facets']
+        keys = {'data_category': ['Clinical', 'Biospecimen'], 'project.project_id': ['TCGA-BLCA']}[facet]
+        body = {'data': {'aggregations': {facet: {'buckets': [{'key': key} for key in keys]}}}}
+    return 200, {'Content-Type': 'application/json'}, json.dumps(body)
+
+
+def test_verify_uses_schema_registry():
+    from test.gdc_stub import StubGDCServer, settings
+    with StubGDCServer(routes={'files': _schema_route}) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=1000, RATE_LIMIT_BURST=1000, USE_CACHE=False):
+        parameters.SCHEMA.clear()
+        for i in range(3):
+            parameters._construct_filter_element('files.data_category', ['Clinical', 'Biospecimen'], verify=True)
+        with pytest.raises(ValueError):
+            parameters._construct_filter_element('files.data_category', 'Transcriptome', verify=True)
+        with pytest.raises(ValueError) as e:
+            parameters._verify_field_name('data_category', endpoint_name='files')
+        assert 'files.data_category' in str(e.value)
+        ## one request for the field names & one for values of files.data_category
+        assert len(server.requests) == 2
+        parameters.SCHEMA.clear()
+
+
+def test_schema_registry_reloads_after_ttl():
+    now = [0]
+    loads = []
+    registry = parameters.SchemaRegistry(ttl=10, clock=lambda: now[0])
+    load = lambda: loads.append(1) or ['a', 'b']
+    assert registry._get('key', load) == frozenset(['a', 'b'])
+    now[0] = 10
+    registry._get('key', load)
+    assert len(loads) == 1
+    now[0] = 11
+    registry._get('key', load)
+    assert len(loads) == 2
@@ -1,12 +1,16 @@
 
 from query_tcga import query_tcga as qt
 from query_tcga import config
+from query_tcga import cache
 import pytest
+import os
+import hashlib
 import shutil
 import pandas as pd
 import requests
 from query_tcga import error_handling as errors
 from query_tcga.log_with import log_with
+from test.gdc_stub import StubGDCServer, settings, files_route, make_manifest_rows, load_manifest_fixture, MANIFEST_HEADER
 import logging
 
 
@@ -121,9 +125,156 @@ def test_list_failed_downloads():
     assert len(new_failed) == 0
 
 
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_characterize_downloads_offline(tmpdir, max_workers):
+    rows = make_manifest_rows(6)
+    manifest_contents = '\n'.join([MANIFEST_HEADER] + rows)
+    expected = list()
+    for (i, row) in enumerate(rows):
+        (file_id, filename) = row.split('\t')[:2]
+        path = os.path.join(str(tmpdir), file_id, filename)
+        expected.append(path)
+        if i % 2 == 0:
+            os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(b'x' * int(row.split('\t')[3]))
+    ## a directory without the expected file
+    os.makedirs(os.path.dirname(expected[1]))
+    res = qt._characterize_downloads(data_dir=str(tmpdir), manifest_contents=manifest_contents,
+                                     max_workers=max_workers)
+    assert res['success'] == expected[0::2]
+    assert res['failed'] == expected[1::2]
+    assert qt._list_failed_downloads(data_dir=str(tmpdir), manifest_contents=manifest_contents) == expected[1::2]
+
+
+def test_characterize_downloads_checks_size_and_md5(tmpdir):
+    rows = list()
+    for (i, content) in enumerate([b'complete', b'truncated', b'corrupted']):
+        file_id = '{:08d}-0000-0000-0000-000000000000'.format(i)
+        os.makedirs(os.path.join(str(tmpdir), file_id))
+        with open(os.path.join(str(tmpdir), file_id, 'file_{}.bam'.format(i)), 'wb') as f:
+            f.write(content[:5] if content == b'truncated' else content)
+        md5 = hashlib.md5(b'CORRUPTED' if content == b'corrupted' else content).hexdigest()
+        rows.append('\t'.join([file_id, 'file_{}.bam'.format(i), md5, str(len(content)), 'live']))
+    manifest_contents = '\n'.join([MANIFEST_HEADER] + rows)
+    paths = [os.path.join(str(tmpdir), *row.split('\t')[:2]) for row in rows]
+    with settings(VERIFY_CACHE_PATH=str(tmpdir.join('verified.sqlite'))):
+        res = qt._characterize_downloads(data_dir=str(tmpdir), manifest_contents=manifest_contents, check='exists')
+        assert res['success'] == paths
+        res = qt._characterize_downloads(data_dir=str(tmpdir), manifest_contents=manifest_contents, check='size')
+        assert res['success'] == [paths[0], paths[2]]
+        assert res['corrupt'] == [paths[1]]
+        res = qt._characterize_downloads(data_dir=str(tmpdir), manifest_contents=manifest_contents, check='md5')
+        assert res['success'] == [paths[0]]
+        assert res['failed'] == res['corrupt'] == paths[1:]
+        updates = qt._filter_manifest_updates(manifest_contents, data_dir=str(tmpdir), check='md5')
+        assert updates.splitlines() == [MANIFEST_HEADER] + rows[1:]
+
+
+def test_filter_manifest_updates_by_id_and_filename(tmpdir):
+    ## the same filename, under different ids
+    rows = ['{:08d}-0000-0000-0000-000000000000\tsame_name.xml\t{:032x}\t3\tlive'.format(i, i) for i in range(3)]
+    manifest_contents = '\n'.join([MANIFEST_HEADER] + rows) + '\n'
+    os.makedirs(os.path.join(str(tmpdir), rows[1].split('\t')[0]))
+    with open(os.path.join(str(tmpdir), rows[1].split('\t')[0], 'same_name.xml'), 'w') as f:
+        f.write('abc')
+    updates = qt._filter_manifest_updates(manifest_contents, data_dir=str(tmpdir), check='size')
+    assert updates == '\n'.join([MANIFEST_HEADER, rows[0], rows[2]])
+    ## md5s are kept as given
+    assert updates.splitlines()[1].split('\t')[2] == '0' * 32
+    manifest_data = qt._read_manifest(manifest_contents=manifest_contents)
+    updates = qt._filter_manifest_updates(manifest_data, data_dir=str(tmpdir), check='size')
+    assert list(updates['id']) == [rows[0].split('\t')[0], rows[2].split('\t')[0]]
+    assert qt._filter_manifest_updates(manifest_contents, data_dir=str(tmpdir), only_updates=False) == manifest_contents
+
+
 def test_download_from_manifest():
     manifest_contents = qt.get_manifest(project_name='TCGA-BLCA', data_category='Clinical', n=5)
     downloaded = qt.download_from_manifest(manifest_contents=manifest_contents, data_dir=TEST_DATA_DIR)
     assert isinstance(downloaded, list)
     assert len(manifest_contents.splitlines()) == len(downloaded)+1
 
+
+def test_get_manifest_concurrent_pages_in_order():
+    rows = make_manifest_rows(40)
+    with StubGDCServer(routes={'files': files_route(rows)}, latency=0.05) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=100, RATE_LIMIT_BURST=100):
+        serial = qt.get_manifest(pages=4, size=10, max_workers=1)
+        concurrent = qt.get_manifest(pages=4, size=10, max_workers=4)
+    assert concurrent == serial
+    records = concurrent.splitlines()[1:]
+    assert records == sorted(set(records))
+
+
+def test_iter_manifest_stops_after_n():
+    rows = make_manifest_rows(50)
+    with StubGDCServer(routes={'files': files_route(rows)}) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=100, RATE_LIMIT_BURST=100):
+        chunks = list(qt.iter_manifest(n=7, pages=10, size=5, max_workers=1))
+    assert [len(chunk) for chunk in chunks] == [5, 2]
+    assert len(server.requests) == 2
+    assert list(chunks[0].columns) == ['id', 'filename', 'md5', 'size', 'state']
+
+
+def test_get_manifest_data_matches_get_manifest():
+    rows = make_manifest_rows(30)
+    with StubGDCServer(routes={'files': files_route(rows)}) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, RATE_LIMIT=100, RATE_LIMIT_BURST=100):
+        manifest = qt.get_manifest(pages=3, size=10)
+        manifest_data = qt.get_manifest_data(pages=3, size=10)
+    assert list(manifest_data['filename']) == [row.split('\t')[1] for row in manifest.splitlines()[1:]]
+
+
+def test_get_manifest_counts_new_files_with_cache():
+    rows = make_manifest_rows(50)
+    with StubGDCServer(routes={'files': files_route(rows)}) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, MAX_PAGE_SIZE=100, RATE_LIMIT=100, RATE_LIMIT_BURST=100,
+                     USE_CACHE=True, CACHE_BACKEND='memory', CACHE_PATH='test_http_cache'):
+        cache.clear()
+        assert len(qt.get_manifest().splitlines()) == 51
+        rows.extend(make_manifest_rows(60)[50:])
+        assert len(qt.get_manifest().splitlines()) == 61
+        assert cache.stats()['entries'] == 0
+
+def _get_fixture_manifest(max_page_size, server_max_size=None, **kwargs):
+    rows = load_manifest_fixture()
+    with StubGDCServer(routes={'files': files_route(rows, max_size=server_max_size)}) as server, \
+            settings(GDC_API_ENDPOINT=server.endpoint, MAX_PAGE_SIZE=max_page_size,
+                     RATE_LIMIT=100, RATE_LIMIT_BURST=100):
+        manifest = qt.get_manifest(**kwargs)
+    return rows, manifest, server.requests
+
+
+@pytest.mark.parametrize('max_page_size', [1, 7, 10, 56, 57, 58, 10000])
+def test_get_manifest_fixture_pages_not_skipped_or_duplicated(max_page_size):
+    rows, manifest, requests_made = _get_fixture_manifest(max_page_size)
+    assert manifest.splitlines()[0] == 'id\tfilename\tmd5\tsize\tstate'
+    assert manifest.splitlines()[1:] == rows
+    ## one count request + fewest pages allowed
+    assert len(requests_made) == 1 + -(-len(rows) // max_page_size)
+
+
+def test_get_manifest_fixture_single_request():
+    rows, manifest, requests_made = _get_fixture_manifest(10000)
+    assert [r.method for r in requests_made] == ['POST', 'POST']
+    assert requests_made[0].json()['size'] == 0
+    assert requests_made[1].json()['from'] == 0
+
+
+@pytest.mark.parametrize('n', [1, 10, 57, 100])
+def test_get_manifest_fixture_using_n(n):
+    rows, manifest, requests_made = _get_fixture_manifest(10000, n=n)
+    assert manifest.splitlines()[1:] == rows[0:n]
+    ## no count request needed when n fits on one page
+    assert len(requests_made) == 1
+
+
+@pytest.mark.parametrize('size, pages', [(5, 3), (10, 6), (20, 3)])
+def test_get_manifest_fixture_using_pages(size, pages):
+    rows, manifest, requests_made = _get_fixture_manifest(10000, size=size, pages=pages)
+    assert manifest.splitlines()[1:] == rows[0:size*pages]
+
+
+def test_get_manifest_fixture_detects_server_page_cap():
+    with pytest.raises(ValueError):
+        _get_fixture_manifest(30, server_max_size=20)
@@ -0,0 +1,61 @@
+from query_tcga import storage
+from test.gdc_stub import settings
+import pandas as pd
+import pytest
+
+
+def _table():
+    return pd.DataFrame({'patient_id': ['A1', 'A2', 'A3'],
+                         'age': [61, 72, 55],
+                         'gender': pd.Categorical(['MALE', 'FEMALE', 'MALE'])})
+
+
+def test_csv_roundtrip_with_columns(tmp_path):
+    storage.write_table(_table(), str(tmp_path), 'clinical', format='csv')
+    assert (tmp_path / 'clinical.csv').exists()
+    res = storage.read_table(str(tmp_path), 'clinical', columns=['patient_id', 'age'], format='csv')
+    assert list(res.columns) == ['patient_id', 'age']
+    assert list(res['age']) == [61, 72, 55]
+
+
+def test_read_missing_table(tmp_path):
+    assert storage.read_table(str(tmp_path), 'clinical', format='csv') is None
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        storage.get_format('xlsx')
+
+
+def test_columnar_format_falls_back_to_csv(monkeypatch):
+    monkeypatch.setattr(storage, '_has_pyarrow', lambda: False)
+    with settings(CACHE_FORMAT='parquet'):
+        assert storage.get_format() == 'csv'
+
+
+def test_prepare_columnar_converts_mixed_columns():
+    df = pd.DataFrame({'mixed': ['a', 1.5, None], 'text': ['a', 'b', None]})
+    res = storage._prepare_columnar(df)
+    assert list(res['mixed'][:2]) == ['a', '1.5']
+    assert pd.isnull(res['mixed'][2])
+    assert list(df['mixed'][:2]) == ['a', 1.5]
+
+
+@pytest.mark.parametrize('format', storage.COLUMNAR_FORMATS)
+def test_columnar_roundtrip_keeps_dtypes(tmp_path, format):
+    pytest.importorskip('pyarrow')
+    storage.write_table(_table(), str(tmp_path), 'clinical', format=format)
+    res = storage.read_table(str(tmp_path), 'clinical', format=format)
+    pd.testing.assert_frame_equal(res, _table())
+    res = storage.read_table(str(tmp_path), 'clinical', columns=['gender'], format=format)
+    assert list(res.columns) == ['gender']
+
+
+@pytest.mark.parametrize('format', storage.COLUMNAR_FORMATS)
+def test_csv_table_is_migrated(tmp_path, format):
+    pytest.importorskip('pyarrow')
+    storage.write_table(_table(), str(tmp_path), 'clinical', format='csv')
+    res = storage.read_table(str(tmp_path), 'clinical', format=format)
+    assert list(res['patient_id']) == ['A1', 'A2', 'A3']
+    assert not (tmp_path / 'clinical.csv').exists()
+    assert (tmp_path / 'clinical.{}'.format(format)).exists()